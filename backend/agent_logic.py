@@ -1,67 +1,111 @@
 import os
 import json
-import requests
+import time
+import queue
 import datetime
-import smtplib
+import threading
 from email.mime.text import MIMEText
-from imap_tools import MailBox, AND
-from typing import Dict, Any, List
+from typing import Callable, Dict, Any, List, Optional
+from imap_pool import ImapPool
+from smtp_pool import SmtpPool
+from llm_client import LLMClient, OPENROUTER_URL
+from model_router import ModelRouter, DEFAULT_TIER, reply_tier
+from intent_rules import matcher as intent_matcher
+from intent_model import load_model, INTENT_MODEL_THRESHOLD
+from mail_sync import new_sync_state, pending_uids, mark_seen, advance
+from mail_fetch import FetchStats, fetch_lazy
+from automation import AutomationDetector
+from body_text import message_text
+from llm_cache import open_llm_cache, cache_key
+from reply_stream import stream_reply
+from outbox import Outbox, OutboxSender, OUTBOX_DB, idempotency_key, references_for
+from metrics import stage_seconds, messages, llm_requests, smtp_sends, record_usage, span, start_span, end_span
 
 # Core Logic extracted from previous email_agent.py
 # Now stateless function calls, getting config passed in
 
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
-MODEL_NAME = "mistralai/mistral-7b-instruct"
+OPENROUTER_URL = os.environ.get("OPENROUTER_URL", OPENROUTER_URL)
 MAX_EMAIL_PREVIEW = 600
+IMAP_SERVER = os.environ.get("IMAP_SERVER", "imap.gmail.com")
+IMAP_PORT = int(os.environ.get("IMAP_PORT", 993))
+IMAP_SSL = os.environ.get("IMAP_SSL", "1") != "0"
+IMAP_TIMEOUT = float(os.environ.get("IMAP_TIMEOUT", 30))
+SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") != "0"
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", 30))
+PIPELINE_LLM_WORKERS = int(os.environ.get("PIPELINE_LLM_WORKERS", 4))
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 8))
+# Bump when the reply prompt changes so cached replies aren't reused
+REPLY_PROMPT_VERSION = "reply-v2"
+# Stream replies through reply_stream (token budget, early stop) instead of
+# waiting for the whole completion
+REPLY_STREAMING = os.environ.get("REPLY_STREAMING", "1") != "0"
+
+# Shared HTTP connection pool for OpenRouter, with retries, timeouts and
+# in-flight limits (OPENROUTER_MAX_CONCURRENCY overall, per API key)
+llm_client = LLMClient(OPENROUTER_URL, on_usage=record_usage)
+# Picks among LLM_MODELS by health and latency, hedging slow requests
+model_router = ModelRouter(llm_client)
+# Identifies the model setup in cache keys
+MODEL_NAME = model_router.primary
+
+# Authenticated IMAP sessions shared across cycles (and /login validation)
+imap_pool = ImapPool(IMAP_SERVER, IMAP_PORT, ssl=IMAP_SSL, timeout=IMAP_TIMEOUT)
+# Authenticated SMTP sessions, one per account, reused for every reply
+smtp_pool = SmtpPool(SMTP_SERVER, SMTP_PORT, starttls=SMTP_STARTTLS, timeout=SMTP_TIMEOUT)
+# Persistent reply cache (None when LLM_CACHE_DB is empty)
+llm_cache = open_llm_cache()
+# Hashed n-gram model for mail the keyword rules have no opinion on (None when untrained)
+local_model = load_model()
+# Header rules + per-account sender reputation (REPUTATION_DB)
+automation = AutomationDetector()
+# Replies waiting for (or retrying) SMTP delivery; the sender's worker runs in main.py
+outbox = Outbox(OUTBOX_DB)
+outbox_sender = OutboxSender(outbox, lambda entry, app_pass: _send_queued(entry, app_pass))
+# Bytes fetched by each account's most recent cycle (mail_fetch.FetchStats.as_dict)
+fetch_stats: Dict[str, Dict[str, int]] = {}
+# Log entry error for messages left to the next cycle by the deadline
+DEADLINE_ERROR = "Cycle deadline reached, remaining messages deferred"
 
 def get_timestamp():
     return datetime.datetime.now().isoformat()
 
-def call_openrouter(messages: list, api_key: str) -> Dict[str, Any]:
+def call_openrouter(messages: list, api_key: str, tier: str = DEFAULT_TIER) -> Dict[str, Any]:
     if not api_key:
         return {}
         
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://localhost", 
-        "X-Title": "EmailAgent"
-    }
     payload = {
         "model": MODEL_NAME,
         "messages": messages,
         "temperature": 0.1
     }
     try:
-        response = requests.post(OPENROUTER_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+        with stage_seconds.time(stage="llm"):
+            response = model_router.chat_sync(payload, api_key, tier)
+        llm_requests.inc(outcome="ok")
+        return response
     except Exception as e:
         print(f"LLM API Error: {e}")
+        llm_requests.inc(outcome="error")
         return {}
 
 def classify_intent_rules(text: str, sender: str) -> Dict[str, Any]:
-    text_lower = text.lower()
-    sender_lower = sender.lower()
-    
-    promo_keywords = [
-        "unsubscribe", "newsletter", "offer", "discount", "sale", "welcome", 
-        "verify", "alert", "security", "code", "login", "update", "marketing",
-        "noreply", "no-reply", "notification", "statement"
-    ]
-    if any(k in text_lower for k in promo_keywords) or \
-       any(k in sender_lower for k in promo_keywords):
-        return {"intent": "Promotional/Notification", "confidence": 1.0}
-
-    meeting_keywords = ["meeting", "zoom", "teams", "calendly", "schedule", "availability", "meet"]
-    if any(k in text_lower for k in meeting_keywords):
-        return {"intent": "Meeting Request", "confidence": 0.9}
+    # Single pass over body + sender; precedence Promotional > Meeting > Support > General
+    return intent_matcher.classify(text, sender)
 
-    support_keywords = ["help", "issue", "problem", "error", "fail", "broken", "bug", "support"]
-    if any(k in text_lower for k in support_keywords):
-        return {"intent": "Support Query", "confidence": 0.9}
-
-    return {"intent": "General", "confidence": 0.5}
+def classify_intent(text: str, sender: str) -> Dict[str, Any]:
+    """
+    Keyword rules first; when no keyword hits, the local model's answer if it
+    is at least INTENT_MODEL_THRESHOLD confident. Otherwise the rules'
+    General fallback (the backend drafts a reply for General mail anyway).
+    """
+    cls = classify_intent_rules(text, sender)
+    if not cls["hits"] and local_model is not None:
+        guess = local_model.classify_batch([text])[0]
+        if guess["confidence"] >= INTENT_MODEL_THRESHOLD:
+            return guess
+    return cls
 
 def decide_strategy(intent: str) -> str:
     strategies = {
@@ -71,7 +115,8 @@ def decide_strategy(intent: str) -> str:
     }
     return strategies.get(intent, strategies["General"])
 
-def generate_reply_llm(email_text: str, intent: str, strategy: str, sender_name: str, api_key: str) -> str:
+def reply_payload(email_text: str, intent: str, strategy: str, sender_name: str) -> Dict[str, Any]:
+    """Chat completion request for a reply (shared with the /draft endpoint)."""
     system_prompt = (
         "You are a professional email assistant. "
         f"The email intent is '{intent}'. "
@@ -86,89 +131,396 @@ def generate_reply_llm(email_text: str, intent: str, strategy: str, sender_name:
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": f"Incoming Email Body:\n{email_text[:MAX_EMAIL_PREVIEW]}\n\nDraft a reply:"}
     ]
-    data = call_openrouter(messages, api_key)
+    return {"model": MODEL_NAME, "messages": messages, "temperature": 0.1}
+
+def _stream_reply(payload: Dict[str, Any], api_key: str, tier: str) -> Optional[str]:
+    """The cleaned, streamed reply; None when the request failed."""
+    if not api_key:
+        return None
+    try:
+        with stage_seconds.time(stage="llm"):
+            reply = stream_reply(model_router.tier(tier), payload, api_key)["reply"]
+        llm_requests.inc(outcome="ok")
+        return reply
+    except Exception as e:
+        print(f"LLM API Error: {e}")
+        llm_requests.inc(outcome="error")
+        return None
+
+def generate_reply_llm(email_text: str, intent: str, strategy: str, sender_name: str, api_key: str,
+                       user_email: Optional[str] = None) -> str:
+    tier = reply_tier(intent, email_text)
+    key = None
+    if llm_cache is not None:
+        # Any model of the tier may answer (routing, failover, hedging)
+        key = cache_key("reply", email_text[:MAX_EMAIL_PREVIEW], model_router.tier_models(tier), REPLY_PROMPT_VERSION,
+                        llm_cache.scope(user_email), intent=intent, strategy=strategy, sender_name=sender_name)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached
+
+    payload = reply_payload(email_text, intent, strategy, sender_name)
+    if REPLY_STREAMING:
+        # Already cleaned, budgeted and cut at the sign-off
+        content = _stream_reply(payload, api_key, tier)
+        if content is None:
+            return "Thank you for your email. We will get back to you shortly."
+        if not content:
+            return "Thank you for your email."
+        if key is not None:
+            llm_cache.put(key, content)
+        return content
+
+    data = call_openrouter(payload["messages"], api_key, tier)
     try:
         content = data['choices'][0]['message']['content'].strip()
         content = content.replace("<s>", "").replace("</s>", "").strip()
         if content.startswith('"') and content.endswith('"'):
             content = content[1:-1]
-        return content if content else "Thank you for your email."
+        if not content:
+            return "Thank you for your email."
+        if key is not None:
+            llm_cache.put(key, content)
+        return content
     except:
         return "Thank you for your email. We will get back to you shortly."
 
-def send_email(to_email: str, subject: str, body: str, user_email: str, app_pass: str):
+def build_reply(to_email: str, subject: str, body: str, user_email: str, in_reply_to: Optional[str] = None,
+                references: Optional[str] = None, message_id: Optional[str] = None) -> MIMEText:
     msg = MIMEText(body)
     msg['Subject'] = f"Re: {subject}"
     msg['From'] = user_email
     msg['To'] = to_email
+    # Threading headers, so the reply lands in the sender's conversation
+    if in_reply_to:
+        msg['In-Reply-To'] = in_reply_to
+        msg['References'] = references or in_reply_to
+    if message_id:
+        msg['Message-ID'] = message_id
+    return msg
+
+def send_email(to_email: str, subject: str, body: str, user_email: str, app_pass: str,
+               in_reply_to: Optional[str] = None, references: Optional[str] = None,
+               message_id: Optional[str] = None):
+    # Assuming Gmail for MVP; the pooled session is shared by all replies of a cycle
+    msg = build_reply(to_email, subject, body, user_email, in_reply_to, references, message_id)
+    with stage_seconds.time(stage="smtp"):
+        result = smtp_pool.send(user_email, app_pass, msg)
+    smtp_sends.inc(outcome="sent" if result["sent"] else "failed")
+    if not result["sent"]:
+        print(f"SMTP Error: {result['error']}")
+    return result["sent"]
+
+def send_emails(replies: List[Dict[str, str]], user_email: str, app_pass: str) -> List[Dict[str, Any]]:
+    """
+    Batched send: `replies` are {"to", "subject", "body"} dicts. Uses one
+    SMTP session for all of them and returns a result per reply.
+    """
+    msgs = [build_reply(r["to"], r["subject"], r["body"], user_email) for r in replies]
+    results = smtp_pool.send_batch(user_email, app_pass, msgs)
+    for result in results:
+        if not result["sent"]:
+            print(f"SMTP Error ({result['to']}): {result['error']}")
+    return results
+
+def _send_queued(entry: Dict[str, Any], app_pass: str) -> bool:
+    """OutboxSender's send function."""
+    return send_email(entry["to_addr"], entry["subject"], entry["body"], entry["user_email"], app_pass,
+                      in_reply_to=entry["in_reply_to"], references=entry["refs"], message_id=entry["message_id"])
+
+def _header(msg, name: str) -> str:
+    values = (msg.headers or {}).get(name) or ("",)
+    return values[0].strip()
+
+def triage_headers(msg, user_email: Optional[str] = None) -> Optional[str]:
+    """The automation reason for a message that can be dropped on its headers alone, else None."""
+    return automation.reason(msg, user_email)
+
+# triage_message()'s `reason` when triage_headers() hasn't been run yet
+_UNTRIAGED = object()
+
+def triage_message(msg, user_email: Optional[str] = None, reason: Any = _UNTRIAGED):
+    """
+    Cheap per-message checks done in the fetch stage.
+    Returns (log_entry, job): job is None when no reply is needed, and
+    log_entry is None when the message is dropped without a log line.
+    `reason` is triage_headers()'s result when the caller already has it.
+    """
+    log_entry = {
+        "subject": msg.subject,
+        "sender": msg.from_,
+        "timestamp": get_timestamp(),
+        "action": "Skipped"
+    }
+    
+    if getattr(msg, "unreadable", False) is True:
+        # Headers or body didn't come back; an error keeps it unread for the next cycle
+        log_entry["error"] = "Message could not be read, left unread"
+        return log_entry, None
+
+    # Noreply senders and automated mail, before looking at the body
+    if reason is _UNTRIAGED:
+        reason = triage_headers(msg, user_email)
+    if reason:
+        log_entry["action"] = "Ignored (No-Reply)" if reason == "No-Reply" else "Ignored (Automated)"
+        log_entry["automated"] = reason
+        return log_entry, None
+    
+    # Markup, quoted chains and anything past BODY_TEXT_LIMIT never reach the classifier
+    body = message_text(msg)
+    if not body:
+        return None, None
 
+    # Classify
+    with stage_seconds.time(stage="classify"):
+        cls = classify_intent(body, msg.from_)
+    intent = cls["intent"]
+    log_entry["intent"] = intent
+    # Kept for the history store's full-text search
+    log_entry["email_text"] = body[:MAX_EMAIL_PREVIEW]
+
+    if intent == "Promotional/Notification":
+        log_entry["action"] = "Ignored (Promotional)"
+        return log_entry, None
+    
+    job = {
+        "to": msg.from_,
+        "subject": msg.subject,
+        "body": body,
+        "intent": intent,
+        "sender_name": msg.from_values.name if msg.from_values.name else "there",
+        "message_id": _header(msg, "message-id"),
+        "references": _header(msg, "references"),
+    }
+    return log_entry, job
+
+def _generate_stage(jobs: queue.Queue, replies: queue.Queue, api_key: str, user_email: str):
+    while True:
+        item = jobs.get()
+        if item is None:
+            return
+        index, log_entry, job = item
+        try:
+            strategy = decide_strategy(job["intent"])
+            with span("agent.generate", job.get("span"), intent=job["intent"]):
+                job["reply"] = generate_reply_llm(job["body"], job["intent"], strategy, job["sender_name"],
+                                                  api_key, user_email)
+        except Exception as e:
+            log_entry["action"] = "Failed to Send"
+            log_entry["error"] = str(e)
+            job = None
+        replies.put((index, log_entry, job))
+
+def _send_stage(replies: queue.Queue, finish: Callable[[int, Dict[str, Any]], None], user_email: str,
+                app_pass: str):
+    while True:
+        item = replies.get()
+        if item is None:
+            return
+        index, log_entry, job = item
+        if job is not None:
+            try:
+                with span("agent.send", job.get("span")):
+                    log_entry["action"] = _queue_and_send(job, user_email, app_pass)
+                log_entry["reply_preview"] = job["reply"][:50] + "..."
+                log_entry["reply"] = job["reply"]
+            except Exception as e:
+                # Not even queued; the message stays unread for the next cycle
+                log_entry["action"] = "Failed to Send"
+                log_entry["error"] = str(e)
+        finish(index, log_entry)
+
+def _notify(on_action: Optional[Callable[[Dict[str, Any]], None]], log_entry: Dict[str, Any]):
+    if on_action is None:
+        return
     try:
-        # Assuming Gmail for MVP
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(user_email, app_pass)
-            server.send_message(msg)
-        return True
+        on_action(log_entry)
     except Exception as e:
-        print(f"SMTP Error: {e}")
-        return False
+        print(f"Action listener failed: {e}")
+
+def _queue_and_send(job: Dict[str, Any], user_email: str, app_pass: str) -> str:
+    """
+    Queues the reply in the outbox, then makes the first delivery attempt.
+    A failed attempt leaves it queued for outbox_sender's retries, so the
+    message counts as handled either way; a reply already queued (or sent)
+    for this Message-ID is never queued again.
+    """
+    key = idempotency_key(user_email, job["message_id"], job["to"], job["subject"], job["body"])
+    entry, _ = outbox.enqueue(user_email, key, job["to"], job["subject"], job["reply"],
+                              in_reply_to=job["message_id"],
+                              refs=references_for(job["message_id"], job["references"]))
+    if entry["status"] == "sent":
+        return "Replied"
+    if entry["status"] == "failed":
+        return "Failed to Send (Gave Up)"
+    claimed = outbox.claim(entry_id=entry["id"])
+    if claimed and outbox_sender.deliver(claimed[0], app_pass):
+        return "Replied"
+    outbox_sender.wake()
+    return "Reply Queued"
+
+def _timed(iterable, seconds: List[float]):
+    """Yields from `iterable`, adding the time spent waiting for each item to seconds[0]."""
+    it = iter(iterable)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                seconds[0] += time.perf_counter() - started
+            yield item
+    finally:
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()
+
+def _sender_outcomes(logs: List[Dict[str, Any]]):
+    """
+    (sender, was_automated) per processed message, for the sender reputation.
+    Only header verdicts count as automated: reputation verdicts would feed
+    back on themselves, and a promotional classification can be a keyword
+    false positive on a person's mail, so it counts as neither.
+    """
+    for entry in logs:
+        if not entry.get("sender") or "error" in entry:
+            continue
+        reason = entry.get("automated")
+        if reason:
+            if reason != "Sender Reputation":
+                yield entry["sender"], True
+        elif entry.get("intent") and entry["intent"] != "Promotional/Notification":
+            yield entry["sender"], False
 
-def run_agent_cycle(user_email: str, app_pass: str, api_key: str):
+def _handled(log_entry: Optional[Dict[str, Any]]) -> bool:
+    """Whether a message is done with (and may be flagged \\Seen)."""
+    return log_entry is None or (log_entry.get("action") != "Failed to Send" and "error" not in log_entry)
+
+def run_agent_cycle(user_email: str, app_pass: str, api_key: str, deadline: Optional[float] = None,
+                    sync_state: Optional[Dict[str, int]] = None,
+                    on_action: Optional[Callable[[Dict[str, Any]], None]] = None):
     """
     Runs one cycle of: Fetch -> Classify -> Reply
     Returns a list of actions taken for logging.
+    If `deadline` (epoch seconds) passes, remaining messages are left for the next cycle.
+
+    Fetching is incremental (see mail_sync.py): only unread messages above
+    `sync_state`'s high-water mark are fetched, oldest first, in bulk
+    batches. They are flagged \\Seen only once handled, and `sync_state` is
+    updated in place for the caller to save. Bodies are fetched lazily (see
+    mail_fetch.py): headers first, then a capped text part only for messages
+    triage_headers() keeps. Byte counts land in fetch_stats[user_email].
+
+    Stages run as a pipeline connected by bounded queues: the IMAP fetch and
+    rule classification happen here, PIPELINE_LLM_WORKERS threads draft
+    replies in parallel, and one sender thread sends them over the pooled
+    SMTP session. Log entries keep the fetch order. `on_action` is called
+    with each message's log entry as soon as it is final (from the sender
+    thread for replies), for live status.
+
+    Stage latencies and per-message outcomes go to metrics.py; with tracing
+    on, the cycle and each message are spans.
     """
-    logs = []
+    cycle_started = time.perf_counter()
+    cycle_span = start_span("agent.cycle", user=user_email)
+    spans: Dict[int, Any] = {}
+    imap_seconds = [0.0]
+    if sync_state is None:
+        sync_state = new_sync_state()
+    results: Dict[int, Dict[str, Any]] = {}
+    uids: Dict[int, int] = {}
+    error = None
+    jobs = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    replies = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    generators = [
+        threading.Thread(target=_generate_stage, args=(jobs, replies, api_key, user_email), daemon=True)
+        for _ in range(PIPELINE_LLM_WORKERS)
+    ]
+
+    def finish(index: int, log_entry: Dict[str, Any]):
+        # Called once per message, from this thread or the sender thread
+        results[index] = log_entry
+        messages.inc(intent=log_entry.get("intent", "none"), action=log_entry["action"])
+        end_span(spans.pop(index, None), intent=log_entry.get("intent"), action=log_entry["action"])
+        _notify(on_action, log_entry)
+
+    sender = threading.Thread(target=_send_stage, args=(replies, finish, user_email, app_pass), daemon=True)
+    for t in generators + [sender]:
+        t.start()
+    drained = False
+    stats = FetchStats()
+
+    def drain():
+        # Generators first, then the sender
+        for _ in generators:
+            jobs.put(None)
+        for t in generators:
+            t.join()
+        replies.put(None)
+        sender.join()
+
     try:
-        # 1. Connect
-        with MailBox("imap.gmail.com").login(user_email, app_pass) as mailbox:
-            # Fetch latest 10 unread
-            msgs = mailbox.fetch(AND(seen=False), limit=10, reverse=True, mark_seen=True)
-            
-            for msg in msgs:
-                log_entry = {
-                    "subject": msg.subject,
-                    "sender": msg.from_,
-                    "timestamp": get_timestamp(),
-                    "action": "Skipped"
-                }
-                
-                # Check Noreply
-                if "noreply" in msg.from_.lower() or "no-reply" in msg.from_.lower():
-                    log_entry["action"] = "Ignored (No-Reply)"
-                    logs.append(log_entry)
-                    continue
-                
-                body = (msg.text or msg.html or "").strip()
-                if not body:
-                    continue
-
-                # Classify
-                cls = classify_intent_rules(body, msg.from_)
-                intent = cls["intent"]
-                log_entry["intent"] = intent
-
-                if intent == "Promotional/Notification":
-                    log_entry["action"] = "Ignored (Promotional)"
-                    logs.append(log_entry)
-                    continue
-                
-                # Reply
-                strategy = decide_strategy(intent)
-                sender_name = msg.from_values.name if msg.from_values.name else "there"
-                reply = generate_reply_llm(body, intent, strategy, sender_name, api_key)
-                
-                # Send
-                sent = send_email(msg.from_, msg.subject, reply, user_email, app_pass)
-                if sent:
-                    log_entry["action"] = "Replied"
-                    log_entry["reply_preview"] = reply[:50] + "..."
+        # 1. Connect (pooled session, reconnects if the server dropped it)
+        imap_started = time.perf_counter()
+        with imap_pool.session(user_email, app_pass) as mailbox:
+            candidates, highest_uid = pending_uids(mailbox, sync_state)
+            imap_seconds[0] += time.perf_counter() - imap_started
+            handled = set()
+
+            # Header verdicts, computed once: they decide the body fetch and then triage
+            reasons: Dict[str, Optional[str]] = {}
+
+            def needs_body(m) -> bool:
+                reasons[m.uid] = triage_headers(m, user_email)
+                return reasons[m.uid] is None
+
+            fetched = _timed(fetch_lazy(mailbox, candidates, needs_body, stats=stats), imap_seconds)
+            for index, msg in enumerate(fetched):
+                if deadline is not None and time.time() > deadline:
+                    results[index] = {"error": DEADLINE_ERROR}
+                    break
+
+                uids[index] = int(msg.uid)
+                spans[index] = start_span("agent.message", cycle_span, uid=uids[index])
+                log_entry, job = triage_message(msg, user_email, reasons.pop(msg.uid, _UNTRIAGED))
+                if job is not None:
+                    job["span"] = spans[index]
+                    jobs.put((index, log_entry, job))
+                elif log_entry is not None:
+                    finish(index, log_entry)
                 else:
-                    log_entry["action"] = "Failed to Send"
-                
-                logs.append(log_entry)
+                    end_span(spans.pop(index))
+                    handled.add(uids[index])
+
+            # Replies must be sent before their messages are flagged
+            drain()
+            drained = True
+            handled.update(uid for index, uid in uids.items() if index in results and _handled(results[index]))
+            imap_started = time.perf_counter()
+            mark_seen(mailbox, sorted(handled))
+            imap_seconds[0] += time.perf_counter() - imap_started
+            advance(sync_state, candidates, handled, highest_uid)
 
     except Exception as e:
-        logs.append({"error": str(e)})
-    
+        error = {"error": str(e)}
+    finally:
+        if not drained:
+            drain()
+    stage_seconds.observe(imap_seconds[0], stage="imap")
+    stage_seconds.observe(time.perf_counter() - cycle_started, stage="cycle")
+    end_span(cycle_span, messages=len(results), error=error["error"] if error else None)
+    fetch_stats[user_email] = stats.as_dict()
+    if stats.messages:
+        print(f"📦 {user_email}: {stats.messages} messages, {stats.bodies} bodies, "
+              f"{stats.fetched_bytes} bytes fetched, {fetch_stats[user_email]['skipped_bytes']} skipped")
+
+    logs = [results[i] for i in sorted(results)]
+    try:
+        automation.learn(user_email, _sender_outcomes(logs))
+    except Exception as e:
+        print(f"Sender reputation update failed: {e}")
+    if error:
+        logs.append(error)
     return logs, get_timestamp()
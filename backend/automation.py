@@ -0,0 +1,211 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from email.utils import parseaddr
+from typing import Dict, Iterable, Optional, Tuple
+
+# Automated-mail detection
+# Decides from headers alone whether a message was sent by a machine
+# (RFC 3834 Auto-Submitted, Precedence, RFC 2369/2919 list headers,
+# Exchange's X-Auto-Response-Suppress, no-reply local parts), falling back
+# to a per-account sender reputation learned from earlier outcomes. Every
+# check is a dict lookup, so automated mail is dropped before its body is
+# fetched or classified.
+
+REPUTATION_DB = os.environ.get("REPUTATION_DB", "reputation.db")  # "" keeps it in memory only
+# A sender is treated as automated after this many messages, if at least
+# REPUTATION_THRESHOLD of them were automated
+REPUTATION_MIN_MESSAGES = int(os.environ.get("REPUTATION_MIN_MESSAGES", 3))
+REPUTATION_THRESHOLD = float(os.environ.get("REPUTATION_THRESHOLD", 0.9))
+# Every Nth message from a sender flagged by reputation goes through anyway,
+# so its outcome re-evaluates the sender (0 never lets one through)
+REPUTATION_RECHECK_EVERY = int(os.environ.get("REPUTATION_RECHECK_EVERY", 10))
+
+BULK_PRECEDENCE = {"bulk", "list", "junk", "auto_reply"}
+# Matched on word boundaries of the local part, not as substrings:
+# "info-noreply@" and "notifications@" are automated, "renotify.fan@" is a person
+_NOREPLY = re.compile(
+    r"(?:^|[-+._])(?:no-?reply|do-?not-?reply)(?:$|[-+._\d])"
+    r"|^(?:mailer-daemon|postmaster|bounces?|notifications?)(?:$|[-+._])"
+)
+
+
+def bare_address(sender: str) -> str:
+    """'Jo <Jo@x.com>' -> 'jo@x.com'; bare addresses (MailMessage.from_) skip parseaddr."""
+    if "<" in (sender or ""):
+        return (parseaddr(sender)[1] or sender).lower()
+    return (sender or "").strip().lower()
+
+
+def local_part(address: str) -> str:
+    addr = bare_address(address)
+    return addr.rpartition("@")[0] if "@" in addr else addr
+
+
+def is_noreply_address(address: str) -> bool:
+    return bool(_NOREPLY.search(local_part(address)))
+
+
+def _first(headers: Dict, name: str) -> str:
+    values = headers.get(name)
+    if not values:
+        return ""
+    return (values[0] if isinstance(values, (tuple, list)) else values).strip().lower()
+
+
+def header_reason(headers: Dict, sender: str) -> Optional[str]:
+    """
+    Why a message is machine-sent going by its headers, or None. `headers`
+    maps lower-case names to a tuple of values (MailMessage.headers shape).
+    """
+    if is_noreply_address(sender):
+        return "No-Reply"
+    auto = _first(headers, "auto-submitted")
+    if auto and auto != "no":
+        return "Auto-Submitted"
+    if headers.get("x-auto-response-suppress"):
+        return "X-Auto-Response-Suppress"
+    if _first(headers, "precedence") in BULK_PRECEDENCE:
+        return "Precedence"
+    if headers.get("list-id") or headers.get("list-unsubscribe"):
+        return "Mailing List"
+    return None
+
+
+class SenderReputation:
+    """
+    Per-account (automated, human) message counts per sender address, kept
+    in memory for O(1) lookups and persisted to SQLite when `path` is set.
+    A person's message from a sender flagged as automated restarts the
+    sender's automated count: the reputation was wrong.
+    """
+
+    def __init__(self, path: Optional[str] = REPUTATION_DB, min_messages: Optional[int] = None,
+                 threshold: Optional[float] = None):
+        self.path = path or None
+        self.min_messages = REPUTATION_MIN_MESSAGES if min_messages is None else min_messages
+        self.threshold = REPUTATION_THRESHOLD if threshold is None else threshold
+        self._counts: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if self.path:
+            self._ensure_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Per-thread connections, as in user_store.SQLiteUserStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS sender_reputation ("
+            "user_email TEXT NOT NULL, sender TEXT NOT NULL, automated INTEGER NOT NULL, "
+            "human INTEGER NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (user_email, sender))"
+        )
+
+    def _account(self, user_email: str) -> Dict[str, Tuple[int, int]]:
+        counts = self._counts.get(user_email)
+        if counts is None:
+            counts = {}
+            if self.path:
+                rows = self._conn().execute(
+                    "SELECT sender, automated, human FROM sender_reputation WHERE user_email = ?", (user_email,)
+                )
+                counts = {sender: (automated, human) for sender, automated, human in rows}
+            with self._lock:
+                counts = self._counts.setdefault(user_email, counts)
+        return counts
+
+    def counts(self, user_email: str, sender: str) -> Tuple[int, int]:
+        return self._account(user_email).get(bare_address(sender), (0, 0))
+
+    def _flagged(self, automated: int, human: int) -> bool:
+        total = automated + human
+        return total >= self.min_messages and automated >= self.threshold * total
+
+    def is_automated(self, user_email: str, sender: str) -> bool:
+        return self._flagged(*self.counts(user_email, sender))
+
+    def record_many(self, user_email: str, outcomes: Iterable[Tuple[str, bool]]):
+        """Counts (sender, was_automated) outcomes, in one transaction."""
+        account = self._account(user_email)
+        changed = {}
+        with self._lock:
+            for sender, automated in outcomes:
+                addr = bare_address(sender)
+                if not addr:
+                    continue
+                auto_count, human_count = account.get(addr, (0, 0))
+                if automated:
+                    auto_count += 1
+                else:
+                    if self._flagged(auto_count, human_count):
+                        auto_count = 0
+                    human_count += 1
+                account[addr] = changed[addr] = (auto_count, human_count)
+        if not changed or not self.path:
+            return
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO sender_reputation (user_email, sender, automated, human, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_email, sender) DO UPDATE SET "
+                "automated = excluded.automated, human = excluded.human, updated_at = excluded.updated_at",
+                [(user_email, addr, a, h, now) for addr, (a, h) in changed.items()],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class AutomationDetector:
+    """
+    Header rules first, then the account's learned sender reputation. Every
+    `recheck_every`th message of a sender flagged only by reputation is let
+    through, so a sender that stopped looking automated can recover.
+    """
+
+    def __init__(self, reputation: Optional[SenderReputation] = None, recheck_every: Optional[int] = None):
+        self.reputation = reputation if reputation is not None else SenderReputation()
+        self.recheck_every = REPUTATION_RECHECK_EVERY if recheck_every is None else recheck_every
+        # (user_email, sender) -> messages dropped on reputation since the last recheck
+        self._held: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def reason(self, msg, user_email: Optional[str] = None) -> Optional[str]:
+        """
+        Why `msg` (anything with imap_tools-style .headers and .from_) looks
+        automated, or None when it should go on to classification.
+        """
+        headers = getattr(msg, "headers", None)
+        reason = header_reason(headers if isinstance(headers, dict) else {}, msg.from_)
+        if reason is None and user_email and self.reputation.is_automated(user_email, msg.from_):
+            key = (user_email, bare_address(msg.from_))
+            with self._lock:
+                held = self._held.get(key, 0) + 1
+                if self.recheck_every and held >= self.recheck_every:
+                    self._held.pop(key, None)
+                    return None
+                self._held[key] = held
+            reason = "Sender Reputation"
+        return reason
+
+    def learn(self, user_email: str, outcomes: Iterable[Tuple[str, bool]]):
+        self.reputation.record_many(user_email, outcomes)
@@ -0,0 +1,159 @@
+import os
+import re
+from html.parser import HTMLParser
+from typing import Iterable, List, Optional
+
+# Streaming body normalizer
+# Turns a text or HTML body into the plain text the classifier and the reply
+# prompt see: markup, <style>/<script> and quoted reply chains are dropped,
+# entities decoded, whitespace collapsed. Input is fed in chunks and
+# processing stops as soon as BODY_TEXT_LIMIT characters have been produced,
+# so a 200 KB newsletter costs no more than its first screenful.
+
+BODY_TEXT_LIMIT = int(os.environ.get("BODY_TEXT_LIMIT", 4000))
+FEED_CHUNK = 2048
+
+# Lines that start a quoted reply/forward chain; nothing after them is the sender's own text
+_QUOTE_HEADER = re.compile(
+    r"^(?:-{2,}\s*(?:original message|forwarded message)\s*-{2,}"
+    r"|on\b.{0,200}\bwrote:|le\b.{0,200}\ba écrit\s?:|am\b.{0,200}\bschrieb\b.{0,200}:"
+    r"|_{10,}|-- ?)$",
+    re.I,
+)
+_WROTE = re.compile(r"\bwrote:$", re.I)
+# Invisible characters marketing mail pads preheaders with
+_INVISIBLE = dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff\u034f\u00ad"))
+_LOOKS_HTML = re.compile(r"^\s*<(?:!doctype|html|head|body|div|table|p|span)\b", re.I)
+
+
+class BodyNormalizer:
+    """Collects normalized lines until the limit or a quoted chain is reached."""
+
+    def __init__(self, limit: Optional[int] = None, blank_lines: bool = True):
+        self.limit = limit or BODY_TEXT_LIMIT
+        self.blank_lines = blank_lines
+        self.lines: List[str] = []
+        self.size = 0
+        self.done = False
+        self._partial = ""
+
+    def write(self, text: str):
+        if self.done:
+            return
+        *complete, self._partial = (self._partial + text).split("\n")
+        for line in complete:
+            self._line(line)
+            if self.done:
+                return
+        if len(self._partial) >= self.limit - self.size:
+            # One endless line (unbroken HTML): no need to wait for its end
+            self._line(self._partial)
+            self._partial = ""
+
+    def newline(self):
+        self.write("\n")
+
+    def _line(self, line: str):
+        line = " ".join(line.translate(_INVISIBLE).split())
+        if line.startswith(">"):
+            return
+        if _QUOTE_HEADER.match(line) or (
+            # "On Mon, 6 Jan 2025 John <\njohn@doe.com> wrote:" wraps in plain text
+            _WROTE.search(line) and self.lines and self.lines[-1].lower().startswith("on ")
+        ):
+            if _WROTE.search(line) and not _QUOTE_HEADER.match(line):
+                self.lines.pop()
+            self.done = True
+            return
+        if not line and (not self.blank_lines or not self.lines or not self.lines[-1]):
+            return
+        if self.size + len(line) >= self.limit:
+            line = line[:self.limit - self.size]
+            self.done = True
+        self.lines.append(line)
+        self.size += len(line) + 1
+
+    def text(self) -> str:
+        if not self.done and self._partial:
+            self._line(self._partial)
+            self._partial = ""
+        return "\n".join(self.lines).strip()
+
+
+class _HTMLText(HTMLParser):
+    SKIP = {"script", "style", "head", "title", "noscript", "template", "svg"}
+    BLOCK = {"p", "div", "br", "li", "tr", "table", "ul", "ol", "section", "article", "header", "footer",
+             "h1", "h2", "h3", "h4", "h5", "h6", "hr", "blockquote", "pre"}
+    # Containers mail clients wrap the quoted thread in
+    QUOTE_MARKERS = ("gmail_quote", "yahoo_quoted", "moz-cite-prefix", "divrplyfwdmsg", "appendonsend")
+
+    def __init__(self, sink: BodyNormalizer):
+        super().__init__(convert_charrefs=True)
+        self.sink = sink
+        self.skip = 0
+        self.quote = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skip += 1
+        elif tag == "blockquote":
+            self.quote += 1
+        markers = " ".join(v for k, v in attrs if k in ("class", "id") and v).lower()
+        if markers and any(m in markers for m in self.QUOTE_MARKERS):
+            self.sink.done = True
+        if tag in self.BLOCK:
+            self.sink.newline()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skip = max(self.skip - 1, 0)
+        elif tag == "blockquote":
+            self.quote = max(self.quote - 1, 0)
+        if tag in self.BLOCK:
+            self.sink.newline()
+
+    def handle_data(self, data):
+        if not self.skip and not self.quote:
+            # Source newlines are just whitespace in HTML
+            self.sink.write(data.replace("\n", " "))
+
+
+def normalize_stream(chunks: Iterable[str], html: bool = False, limit: Optional[int] = None) -> str:
+    """Normalizes a body delivered in chunks; stops consuming them once done."""
+    # Nested block tags in HTML would leave runs of empty lines, so none are kept
+    sink = BodyNormalizer(limit, blank_lines=not html)
+    parser = _HTMLText(sink) if html else None
+    for chunk in chunks:
+        if parser is not None:
+            parser.feed(chunk)
+        else:
+            sink.write(chunk)
+        if sink.done:
+            break
+    if parser is not None and not sink.done:
+        parser.close()
+    return sink.text()
+
+
+def _chunks(text: str) -> Iterable[str]:
+    for start in range(0, len(text), FEED_CHUNK):
+        yield text[start:start + FEED_CHUNK]
+
+
+def extract_text(text: Optional[str] = None, html: Optional[str] = None, limit: Optional[int] = None) -> str:
+    """
+    Plain text of a message for classification and prompts, at most `limit`
+    characters. Prefers the text part; uses the HTML part when there is none
+    (or the "text" part is really HTML).
+    """
+    if text and text.strip() and not _LOOKS_HTML.match(text[:200]):
+        return normalize_stream(_chunks(text), html=False, limit=limit)
+    source = html if html and html.strip() else text
+    if not source:
+        return ""
+    return normalize_stream(_chunks(source), html=True, limit=limit)
+
+
+def message_text(msg, limit: Optional[int] = None) -> str:
+    """extract_text() for anything with imap_tools-style .text/.html attributes."""
+    return extract_text(msg.text, msg.html, limit)
@@ -0,0 +1,200 @@
+import os
+import json
+import base64
+import sqlite3
+import datetime
+import threading
+from email.utils import parseaddr
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Interaction history
+# Every processed email (sender, intent, action, text, reply) as one row in
+# SQLite, indexed for per-account lookups by sender, intent and time, with
+# FTS5 full-text search over the email text when SQLite provides it.
+
+HISTORY_DB = os.environ.get("HISTORY_DB", "history.db")
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+COLUMNS = ["user_email", "ts", "timestamp", "sender", "sender_addr", "subject",
+           "intent", "action", "email_text", "reply"]
+
+
+def sender_address(sender: str) -> str:
+    """'John Doe <John@Doe.com>' -> 'john@doe.com' (lookups ignore display names)."""
+    return (parseaddr(sender or "")[1] or sender or "").lower()
+
+
+def encode_cursor(ts: float, row_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([ts, row_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """Raises ValueError on anything that isn't a cursor we issued."""
+    try:
+        ts, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(ts), int(row_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def fts_query(text: str) -> str:
+    """Quotes each word so user input can't trip FTS5 query syntax."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+class HistoryStore:
+    def __init__(self, path: str = HISTORY_DB):
+        self.path = path
+        self._local = threading.local()
+        self.fts = False
+        self._ensure_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Per-thread connections, as in user_store.SQLiteUserStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS interactions ("
+            "id INTEGER PRIMARY KEY, user_email TEXT NOT NULL, ts REAL NOT NULL, timestamp TEXT, "
+            "sender TEXT, sender_addr TEXT, subject TEXT, intent TEXT, action TEXT, "
+            "email_text TEXT, reply TEXT)"
+        )
+        # Every lookup is per account and newest first; the rowid breaks ties
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_user_ts ON interactions (user_email, ts)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_interactions_sender ON interactions (user_email, sender_addr, ts)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_intent ON interactions (user_email, intent, ts)")
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS interactions_fts USING fts5("
+                "subject, email_text, content='interactions', content_rowid='id')"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS interactions_ai AFTER INSERT ON interactions BEGIN "
+                "INSERT INTO interactions_fts (rowid, subject, email_text) "
+                "VALUES (new.id, new.subject, new.email_text); END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS interactions_ad AFTER DELETE ON interactions BEGIN "
+                "INSERT INTO interactions_fts (interactions_fts, rowid, subject, email_text) "
+                "VALUES ('delete', old.id, old.subject, old.email_text); END"
+            )
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: text search falls back to LIKE
+            self.fts = False
+
+    @staticmethod
+    def _to_row(user_email: str, entry: Dict[str, Any]) -> Tuple:
+        timestamp = entry.get("timestamp") or datetime.datetime.now().isoformat()
+        ts = datetime.datetime.fromisoformat(timestamp).timestamp()
+        sender = entry.get("sender") or ""
+        return (
+            user_email, ts, timestamp, sender, sender_address(sender), entry.get("subject"),
+            entry.get("intent"), entry.get("action"), entry.get("email_text"),
+            entry.get("reply") or entry.get("generated_reply"),
+        )
+
+    def record_many(self, user_email: str, entries: Iterable[Dict[str, Any]]) -> int:
+        """Stores cycle log entries (or memory log records) in one transaction."""
+        rows = [self._to_row(user_email, e) for e in entries if "error" not in e]
+        if not rows:
+            return 0
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                f"INSERT INTO interactions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+                rows,
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def record(self, user_email: str, entry: Dict[str, Any]) -> int:
+        return self.record_many(user_email, [entry])
+
+    def _filters(self, user_email: str, sender: Optional[str], intent: Optional[str],
+                 since: Optional[float], until: Optional[float], text: Optional[str]) -> Tuple[List[str], List[Any]]:
+        where, params = ["user_email = ?"], [user_email]
+        if sender:
+            where.append("sender_addr = ?")
+            params.append(sender_address(sender))
+        if intent:
+            where.append("intent = ?")
+            params.append(intent)
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            params.append(until)
+        # Whitespace-only text would be an empty (invalid) MATCH
+        if text and text.strip():
+            if self.fts:
+                where.append("id IN (SELECT rowid FROM interactions_fts WHERE interactions_fts MATCH ?)")
+                params.append(fts_query(text))
+            else:
+                where.append("(email_text LIKE ? OR subject LIKE ?)")
+                params.extend([f"%{text}%"] * 2)
+        return where, params
+
+    def _execute(self, sql: str, params: List[Any], text: Optional[str]) -> sqlite3.Cursor:
+        """Raises ValueError when FTS5 rejects the search text."""
+        try:
+            return self._conn().execute(sql, params)
+        except sqlite3.OperationalError as e:
+            if text and self.fts and "fts5" in str(e):
+                raise ValueError(f"Invalid search query: {text!r}") from e
+            raise
+
+    def query(self, user_email: str, sender: Optional[str] = None, intent: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None, text: Optional[str] = None,
+              limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of interactions, newest first. Returns (items, next_cursor);
+        pass next_cursor back to continue, None means there is nothing more.
+        Keyset pagination, so deep pages cost the same as the first.
+        """
+        limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+        where, params = self._filters(user_email, sender, intent, since, until, text)
+        if cursor:
+            ts, row_id = decode_cursor(cursor)
+            where.append("(ts, id) < (?, ?)")
+            params.extend([ts, row_id])
+        rows = self._execute(
+            f"SELECT * FROM interactions WHERE {' AND '.join(where)} ORDER BY ts DESC, id DESC LIMIT ?",
+            params + [limit + 1], text,
+        ).fetchall()
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(items[-1]["ts"], items[-1]["id"])
+        return items, next_cursor
+
+    def count(self, user_email: str, sender: Optional[str] = None, intent: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None, text: Optional[str] = None) -> int:
+        where, params = self._filters(user_email, sender, intent, since, until, text)
+        return self._execute(
+            f"SELECT COUNT(*) FROM interactions WHERE {' AND '.join(where)}", params, text
+        ).fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
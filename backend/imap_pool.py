@@ -0,0 +1,172 @@
+import os
+import time
+import socket
+import imaplib
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+from imap_tools import MailBox, MailBoxUnencrypted
+from imap_tools.errors import MailboxLoginError
+
+# IMAP connection pool
+# Keeps one authenticated session per account between cycles so a run
+# doesn't pay a TLS handshake + LOGIN every time, and reconnects when the
+# server has dropped the session.
+
+IMAP_HEALTHCHECK_AFTER = float(os.environ.get("IMAP_HEALTHCHECK_AFTER", 30))
+IMAP_POOL_MAX_IDLE = float(os.environ.get("IMAP_POOL_MAX_IDLE", 25 * 60))
+IMAP_IDLE_POLL_SECONDS = float(os.environ.get("IMAP_IDLE_POLL_SECONDS", 60))
+IMAP_IDLE_RETRY_MAX = float(os.environ.get("IMAP_IDLE_RETRY_MAX", 300))
+
+# Errors that mean the connection itself is unusable
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError, socket.timeout, EOFError)
+
+
+class ImapPool:
+    def __init__(self, host: str, port: Optional[int] = None, ssl: bool = True, timeout: Optional[float] = None):
+        self.host = host
+        self.port = port or (993 if ssl else 143)
+        self.ssl = ssl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # email -> (mailbox, password, last_used)
+        self._idle: Dict[str, Tuple[object, str, float]] = {}
+        self.connects = 0
+
+    def _connect(self, user: str, password: str):
+        cls = MailBox if self.ssl else MailBoxUnencrypted
+        mailbox = cls(self.host, self.port, timeout=self.timeout).login(user, password)
+        self.connects += 1
+        return mailbox
+
+    @staticmethod
+    def _close(mailbox):
+        try:
+            mailbox.logout()
+        except Exception:
+            pass
+
+    def _healthy(self, mailbox) -> bool:
+        try:
+            status, _ = mailbox.client.noop()
+            return status == "OK"
+        except CONNECTION_ERRORS:
+            return False
+
+    @contextmanager
+    def session(self, user: str, password: str):
+        """
+        Yields a logged-in MailBox for `user`, reusing a pooled one when possible.
+        Sessions that raise inside the block are discarded, not returned to the pool.
+        """
+        with self._lock:
+            pooled = self._idle.pop(user, None)
+
+        mailbox = None
+        if pooled:
+            mailbox, pooled_password, last_used = pooled
+            stale = time.time() - last_used > IMAP_HEALTHCHECK_AFTER
+            if pooled_password != password or (stale and not self._healthy(mailbox)):
+                self._close(mailbox)
+                mailbox = None
+        if mailbox is None:
+            mailbox = self._connect(user, password)
+
+        try:
+            yield mailbox
+        except BaseException:
+            self._close(mailbox)
+            raise
+
+        with self._lock:
+            extra = self._idle.get(user)
+            self._idle[user] = (mailbox, password, time.time())
+        if extra:
+            self._close(extra[0])
+
+    def validate(self, user: str, password: str):
+        """Checks credentials; the session stays pooled for the user's first cycle."""
+        with self.session(user, password):
+            pass
+
+    def discard(self, user: str):
+        with self._lock:
+            pooled = self._idle.pop(user, None)
+        if pooled:
+            self._close(pooled[0])
+
+    def evict_idle(self, max_idle: float = IMAP_POOL_MAX_IDLE) -> int:
+        """Logs out sessions unused for longer than `max_idle` seconds."""
+        cutoff = time.time() - max_idle
+        with self._lock:
+            expired = [u for u, (_, _, used) in self._idle.items() if used < cutoff]
+            closing = [self._idle.pop(u)[0] for u in expired]
+        for mailbox in closing:
+            self._close(mailbox)
+        return len(closing)
+
+    def close_all(self):
+        with self._lock:
+            closing = [mailbox for mailbox, _, _ in self._idle.values()]
+            self._idle.clear()
+        for mailbox in closing:
+            self._close(mailbox)
+
+
+class IdleWatcher:
+    """
+    Holds a dedicated IMAP IDLE session for one account and calls
+    `on_new_mail(user)` as soon as the server announces new messages.
+    Runs in its own daemon thread; reconnects with backoff on any failure
+    except a rejected login, which stops it and is kept in `auth_error`
+    (main.sync_idle_watcher starts a new watcher when the password changes).
+    """
+
+    def __init__(self, pool: ImapPool, user: str, password: str, on_new_mail: Callable[[str], None],
+                 poll_seconds: float = IMAP_IDLE_POLL_SECONDS):
+        self.pool = pool
+        self.user = user
+        self.password = password
+        self.on_new_mail = on_new_mail
+        self.poll_seconds = poll_seconds
+        self.auth_error: Optional[Exception] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"imap-idle-{user}", daemon=True)
+
+    def start(self) -> "IdleWatcher":
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            mailbox = None
+            try:
+                mailbox = self.pool._connect(self.user, self.password)
+                backoff = 1.0
+                while not self._stop.is_set():
+                    # Re-issued every poll so the server never times the IDLE out
+                    mailbox.idle.start()
+                    responses = mailbox.idle.poll(timeout=self.poll_seconds)
+                    mailbox.idle.stop()
+                    if any(b"EXISTS" in r for r in responses):
+                        self.on_new_mail(self.user)
+            except MailboxLoginError as e:
+                # Retrying won't fix the credentials (and may get the account locked)
+                self.auth_error = e
+                print(f"❌ IMAP IDLE login failed for {self.user}: {e}; push stopped until the password changes")
+                return
+            except Exception as e:
+                # Anything else (including bugs in on_new_mail) must not end push for good
+                if not self._stop.is_set():
+                    kind = "" if isinstance(e, CONNECTION_ERRORS) else f" ({type(e).__name__})"
+                    print(f"IMAP IDLE error for {self.user}{kind}: {e}, retrying in {backoff:.0f}s")
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, IMAP_IDLE_RETRY_MAX)
+            finally:
+                if mailbox is not None:
+                    ImapPool._close(mailbox)
@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import sqlite3
+import argparse
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # the model tier is optional
+    np = None
+
+# Local intent model
+# A hashed word/bigram linear classifier (multinomial logistic regression)
+# stored as one small NumPy weight matrix. Sits between the keyword rules and
+# the LLM: mail the rules have no opinion on is scored here in one vectorized
+# pass per batch, and only predictions below INTENT_MODEL_THRESHOLD go on to
+# the LLM. Train and evaluate offline:
+#   python backend/intent_model.py train --data memory.json --out intent_model.npz
+#   python backend/intent_model.py eval --model intent_model.npz --data history.db
+
+INTENT_MODEL_FILE = os.environ.get("INTENT_MODEL_FILE", "intent_model.npz")  # missing file = tier off
+INTENT_MODEL_THRESHOLD = float(os.environ.get("INTENT_MODEL_THRESHOLD", 0.7))
+DEFAULT_FEATURE_BITS = 16
+# Only the start of a body is featurized (the rest is mostly signature/footer)
+MAX_FEATURE_CHARS = 2000
+
+_WORD_BYTES = set(b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_") | set(range(128, 256))
+_NORMALIZE = bytes((c | 0x20 if 65 <= c <= 90 else c) if c in _WORD_BYTES else 32 for c in range(256))
+# Present in every document, so it doubles as the bias term
+_BIAS = b"\x00bias"
+
+
+def hashed_features(text: str, n_features: int) -> List[int]:
+    """Distinct hashed unigram and bigram buckets of `text` (plus the bias bucket)."""
+    words = text[:MAX_FEATURE_CHARS].encode("utf-8", "replace").translate(_NORMALIZE).split()
+    mask = n_features - 1
+    buckets = {zlib.crc32(_BIAS) & mask}
+    for word in words:
+        buckets.add(zlib.crc32(word) & mask)
+    for first, second in zip(words, words[1:]):
+        buckets.add(zlib.crc32(first + b" " + second) & mask)
+    return list(buckets)
+
+
+def featurize(texts: Sequence[str], n_features: int) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    Sparse rows as (cols, vals, offsets): row i is cols[offsets[i]:offsets[i+1]],
+    each feature weighted 1/sqrt(row length) so long mails don't dominate.
+    """
+    cols, vals, offsets = [], [], [0]
+    for text in texts:
+        row = hashed_features(text or "", n_features)
+        cols.extend(row)
+        vals.extend([1.0 / len(row) ** 0.5] * len(row))
+        offsets.append(len(cols))
+    return (np.asarray(cols, dtype=np.int64), np.asarray(vals, dtype=np.float32),
+            np.asarray(offsets, dtype=np.int64))
+
+
+def _softmax(scores: "np.ndarray") -> "np.ndarray":
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class IntentModel:
+    def __init__(self, weights: "np.ndarray", labels: List[str]):
+        self.weights = weights.astype(np.float32)   # (n_features, n_labels)
+        self.labels = labels
+        self.n_features = weights.shape[0]
+
+    def _scores(self, cols, vals, offsets) -> "np.ndarray":
+        # Every row has the bias feature, so no reduceat segment is empty
+        return np.add.reduceat(self.weights[cols] * vals[:, None], offsets[:-1], axis=0)
+
+    def predict_proba(self, texts: Sequence[str]) -> "np.ndarray":
+        if not texts:
+            return np.zeros((0, len(self.labels)), dtype=np.float32)
+        return _softmax(self._scores(*featurize(texts, self.n_features)))
+
+    def classify_batch(self, texts: Sequence[str]) -> List[Dict[str, Any]]:
+        """One {"intent", "confidence"} per text, from a single vectorized pass."""
+        probs = self.predict_proba(texts)
+        best = probs.argmax(axis=1)
+        return [{"intent": self.labels[i], "confidence": round(float(probs[row, i]), 3)}
+                for row, i in enumerate(best)]
+
+    def save(self, path: str):
+        # float16 halves the file; scores are computed in float32
+        np.savez_compressed(path, weights=self.weights.astype(np.float16), labels=np.array(self.labels))
+
+    @classmethod
+    def load(cls, path: str) -> "IntentModel":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["weights"], [str(label) for label in data["labels"]])
+
+
+def train(texts: Sequence[str], labels: Sequence[str], feature_bits: int = DEFAULT_FEATURE_BITS,
+          epochs: int = 300, lr: float = 2.0, l2: float = 1e-4) -> IntentModel:
+    """
+    Full-batch gradient descent on softmax cross-entropy, with classes
+    weighted inversely to their frequency (the history is mostly
+    notifications, the interesting classes are rare).
+    """
+    n_features = 1 << feature_bits
+    label_names = sorted(set(labels))
+    y = np.array([label_names.index(label) for label in labels])
+    counts = np.bincount(y, minlength=len(label_names))
+    sample_weight = (len(y) / (len(label_names) * counts[y])).astype(np.float32)
+    onehot = np.eye(len(label_names), dtype=np.float32)[y]
+
+    cols, vals, offsets = featurize(texts, n_features)
+    rows = np.repeat(np.arange(len(texts)), np.diff(offsets))
+    model = IntentModel(np.zeros((n_features, len(label_names)), dtype=np.float32), label_names)
+    for _ in range(epochs):
+        probs = _softmax(model._scores(cols, vals, offsets))
+        grad_rows = (probs - onehot) * sample_weight[:, None] / len(y)
+        grad = np.zeros_like(model.weights)
+        np.add.at(grad, cols, grad_rows[rows] * vals[:, None])
+        model.weights -= lr * (grad + l2 * model.weights)
+    return model
+
+
+def load_model(path: Optional[str] = None) -> Optional[IntentModel]:
+    """The trained model, or None when NumPy or the model file is missing."""
+    path = INTENT_MODEL_FILE if path is None else path
+    if np is None or not path or not os.path.exists(path):
+        return None
+    return IntentModel.load(path)
+
+
+# -- Offline tooling ----------------------------------------------------------
+
+def load_examples(path: str) -> List[Tuple[str, str]]:
+    """
+    (email_text, intent) pairs from a memory.json file, an interaction log
+    directory (memory/) or a history.db, skipping records without either.
+    """
+    if os.path.isdir(path):
+        from interaction_log import InteractionLog
+        records: Iterable[Dict[str, Any]] = InteractionLog(path).read()
+    elif path.endswith(".db"):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        records = [dict(row) for row in conn.execute("SELECT email_text, intent FROM interactions")]
+        conn.close()
+    else:
+        with open(path) as f:
+            records = json.load(f)
+    return [(r["email_text"], r["intent"]) for r in records if r.get("email_text") and r.get("intent")]
+
+
+def evaluate(model: IntentModel, examples: List[Tuple[str, str]], threshold: float) -> Dict[str, Any]:
+    texts = [text for text, _ in examples]
+    start = time.perf_counter()
+    predictions = model.classify_batch(texts)
+    elapsed = time.perf_counter() - start
+    per_label = {}
+    for label in sorted({gold for _, gold in examples} | set(model.labels)):
+        tp = sum(1 for p, (_, g) in zip(predictions, examples) if p["intent"] == label and g == label)
+        predicted = sum(1 for p in predictions if p["intent"] == label)
+        actual = sum(1 for _, g in examples if g == label)
+        per_label[label] = {"precision": tp / predicted if predicted else 0.0,
+                            "recall": tp / actual if actual else 0.0, "support": actual}
+    confident = [(p, g) for p, (_, g) in zip(predictions, examples) if p["confidence"] >= threshold]
+    return {
+        "examples": len(examples),
+        "accuracy": sum(p["intent"] == g for p, (_, g) in zip(predictions, examples)) / max(len(examples), 1),
+        # What the tier settles locally, and how often it is right when it does
+        "coverage": len(confident) / max(len(examples), 1),
+        "confident_accuracy": sum(p["intent"] == g for p, g in confident) / max(len(confident), 1),
+        "us_per_email": elapsed / max(len(examples), 1) * 1e6,
+        "labels": per_label,
+    }
+
+
+def print_report(report: Dict[str, Any], threshold: float):
+    print(f"{report['examples']} examples: accuracy {report['accuracy']:.2f}, "
+          f"{report['us_per_email']:.1f} us/email (batched)")
+    print(f"confidence >= {threshold}: {report['coverage']:.0%} handled locally, "
+          f"{report['confident_accuracy']:.2f} accurate; the rest escalates to the LLM")
+    print(f"{'intent':>26} {'precision':>10} {'recall':>7} {'support':>8}")
+    for label, m in report["labels"].items():
+        print(f"{label:>26} {m['precision']:>10.2f} {m['recall']:>7.2f} {m['support']:>8}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Train or evaluate the local intent model.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train_cmd = sub.add_parser("train", help="train on labelled records, report on a held-out split")
+    train_cmd.add_argument("--data", nargs="+", required=True, help="memory.json, memory/ or history.db")
+    train_cmd.add_argument("--out", default=INTENT_MODEL_FILE)
+    train_cmd.add_argument("--feature-bits", type=int, default=DEFAULT_FEATURE_BITS)
+    train_cmd.add_argument("--epochs", type=int, default=300)
+    train_cmd.add_argument("--holdout", type=float, default=0.2)
+    eval_cmd = sub.add_parser("eval", help="evaluate a saved model")
+    eval_cmd.add_argument("--model", default=INTENT_MODEL_FILE)
+    eval_cmd.add_argument("--data", nargs="+", required=True)
+    for cmd in (train_cmd, eval_cmd):
+        cmd.add_argument("--threshold", type=float, default=INTENT_MODEL_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if np is None:
+        sys.exit("NumPy is required: pip install numpy")
+    examples = [example for path in args.data for example in load_examples(path)]
+    if args.command == "eval":
+        print_report(evaluate(IntentModel.load(args.model), examples, args.threshold), args.threshold)
+        return
+
+    random.Random(0).shuffle(examples)
+    split = int(len(examples) * (1 - args.holdout)) if args.holdout else len(examples)
+    train_set, test_set = examples[:split], examples[split:]
+    model = train([t for t, _ in train_set], [l for _, l in train_set], args.feature_bits, args.epochs)
+    if test_set:
+        print_report(evaluate(model, test_set, args.threshold), args.threshold)
+    if args.holdout:
+        # Ship a model trained on everything
+        model = train([t for t, _ in examples], [l for _, l in examples], args.feature_bits, args.epochs)
+    model.save(args.out)
+    print(f"Saved {len(model.labels)} intents x {model.n_features} features to {args.out} "
+          f"({os.path.getsize(args.out) // 1024} KB)")
+
+
+if __name__ == "__main__":
+    main()
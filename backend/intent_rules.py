@@ -0,0 +1,145 @@
+import os
+import json
+from typing import Any, Dict, List, Optional
+
+# Keyword rules for intent classification
+# All keyword lists are built into one lookup table at import, so a body is
+# tokenised and scanned once no matter how many categories or keywords there are.
+
+INTENT_KEYWORDS_FILE = os.environ.get("INTENT_KEYWORDS_FILE")
+
+# Checked in this order; the first category with a hit wins.
+DEFAULT_CATEGORIES = [
+    {
+        "intent": "Promotional/Notification",
+        "confidence": 1.0,
+        "match_sender": True,
+        # Only unambiguous marketing words: automated mail is caught on its
+        # headers (automation.py); "code", "update", "alert", "login"... are
+        # just as common in mail from people
+        "keywords": [
+            "unsubscribe", "newsletter", "discount", "promo", "marketing",
+            "noreply", "no-reply", "receipt"
+        ],
+    },
+    {
+        "intent": "Meeting Request",
+        "confidence": 0.9,
+        "keywords": ["meeting", "zoom", "teams", "calendly", "schedule", "availability", "meet"],
+    },
+    {
+        "intent": "Support Query",
+        "confidence": 0.9,
+        "keywords": ["help", "issue", "problem", "error", "fail", "broken", "bug", "support", "ticket"],
+    },
+]
+FALLBACK = {"intent": "General", "confidence": 0.5}
+
+
+# Byte table that lowercases ASCII and turns everything except word
+# characters into spaces, so tokenising is translate() + split(), both in C.
+# Non-ASCII bytes are kept as word characters.
+_WORD_BYTES = set(b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_") | set(range(128, 256))
+_NORMALIZE = bytes((c | 0x20 if 65 <= c <= 90 else c) if c in _WORD_BYTES else 32 for c in range(256))
+
+
+def _normalize(text: str) -> bytes:
+    return text.encode("utf-8", "replace").translate(_NORMALIZE)
+
+
+class IntentMatcher:
+    """
+    Single-pass multi-keyword matcher. The text is tokenised once and each
+    distinct word is looked up by prefix in a keyword table, so keywords match
+    at the start of a word ("fail" also matches "failed", but "code" no longer
+    matches "barcode"). Multi-word keywords ("follow up") are matched against
+    the normalised word sequence; keywords with punctuation ("no-reply") only
+    as written, so "got no reply" isn't a hit.
+
+    (A combined regex was measured too: CPython's sre is several times slower
+    than the old substring scans on large bodies, this is faster than both.)
+    """
+
+    def __init__(self, categories: List[Dict[str, Any]]):
+        self.categories = categories
+        # normalised keyword -> (keyword, [intents])
+        self._words: Dict[bytes, Any] = {}
+        self._phrases: Dict[bytes, Any] = {}
+        self._literals: Dict[bytes, Any] = {}
+        for category in categories:
+            for keyword in category["keywords"]:
+                tokens = _normalize(keyword).split()
+                if not tokens:
+                    continue
+                if tokens != keyword.lower().encode("utf-8", "replace").split():
+                    table, key = self._literals, keyword.lower().encode("utf-8", "replace")
+                else:
+                    table, key = (self._words if len(tokens) == 1 else self._phrases), b" ".join(tokens)
+                table.setdefault(key, (keyword.lower(), []))[1].append(category["intent"])
+        self._lengths = sorted({len(k) for k in self._words}, reverse=True)
+        # Cheap first check: most words don't share a keyword's leading bytes
+        self._stem = min(self._lengths, default=0)
+        self._stems = {k[:self._stem] for k in self._words}
+        self._sender_intents = {c["intent"] for c in categories if c.get("match_sender")}
+
+    def _hits(self, text: str) -> List[Any]:
+        found = []
+        normalized = _normalize(text)
+        lengths = self._lengths
+        table = self._words
+        stem, stems = self._stem, self._stems
+        for word in set(normalized.split()):
+            if word[:stem] not in stems:
+                continue
+            # Longest first, so "meeting" is reported rather than "meet"
+            for size in lengths:
+                if size <= len(word):
+                    entry = table.get(word[:size])
+                    if entry is not None:
+                        found.append(entry)
+                        break
+        if self._phrases:
+            normalized = b" " + normalized
+            found.extend(entry for key, entry in self._phrases.items() if b" " + key in normalized)
+        if self._literals:
+            lowered = text.lower().encode("utf-8", "replace")
+            found.extend(entry for key, entry in self._literals.items() if key in lowered)
+        return found
+
+    def scan(self, text: str, sender: str = "") -> Dict[str, List[str]]:
+        """Returns {intent: [keywords hit]} for every category matched by the body (or sender)."""
+        hits: Dict[str, List[str]] = {}
+        for source, intents in ((text, None), (sender, self._sender_intents)):
+            if not source:
+                continue
+            for keyword, owners in self._hits(source):
+                for intent in owners:
+                    if intents is None or intent in intents:
+                        found = hits.setdefault(intent, [])
+                        if keyword not in found:
+                            found.append(keyword)
+        for found in hits.values():
+            found.sort()
+        return hits
+
+    def classify(self, text: str, sender: str = "") -> Dict[str, Any]:
+        hits = self.scan(text, sender)
+        for category in self.categories:
+            if category["intent"] in hits:
+                return {"intent": category["intent"], "confidence": category["confidence"], "hits": hits}
+        return {**FALLBACK, "hits": hits}
+
+
+def load_categories(path: Optional[str] = INTENT_KEYWORDS_FILE) -> List[Dict[str, Any]]:
+    """
+    Keyword categories from a JSON file (a list shaped like
+    DEFAULT_CATEGORIES, in precedence order), or the built-in defaults.
+    """
+    if not path:
+        return DEFAULT_CATEGORIES
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# Built once at import
+matcher = IntentMatcher(load_categories())
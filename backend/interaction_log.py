@@ -0,0 +1,178 @@
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+# Interaction log
+# Append-only JSON Lines, split into numbered segments. Each record is one
+# write at the end of the current segment; nothing is ever rewritten, and a
+# crash can at worst leave a torn last line, which the reader skips.
+
+MEMORY_LOG_DIR = os.environ.get("MEMORY_LOG_DIR", "memory")
+LOG_SEGMENT_BYTES = int(os.environ.get("LOG_SEGMENT_BYTES", 8 * 1024 * 1024))
+# fsync after this many records or seconds, whichever comes first
+LOG_FSYNC_EVERY = int(os.environ.get("LOG_FSYNC_EVERY", 16))
+LOG_FSYNC_INTERVAL = float(os.environ.get("LOG_FSYNC_INTERVAL", 1.0))
+# gzip segments once they are rotated out
+LOG_COMPRESS = os.environ.get("LOG_COMPRESS", "1") == "1"
+
+SEGMENT_RE = re.compile(r"^interactions-(\d{6})\.jsonl(\.gz)?$")
+
+
+class InteractionLog:
+    def __init__(self, directory: str = MEMORY_LOG_DIR, segment_bytes: int = LOG_SEGMENT_BYTES,
+                 fsync_every: int = LOG_FSYNC_EVERY, fsync_interval: float = LOG_FSYNC_INTERVAL,
+                 compress: bool = LOG_COMPRESS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self) -> List[str]:
+        """Segment paths, oldest first."""
+        found = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_RE.match(name)
+            if match:
+                found.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return [path for _, path in sorted(found)]
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"interactions-{number:06d}.jsonl")
+
+    def _open_current(self):
+        segments = self.segments()
+        last = segments[-1] if segments else None
+        if last is None or last.endswith(".gz"):
+            number = int(SEGMENT_RE.match(os.path.basename(last)).group(1)) + 1 if last else 1
+            path = self._segment_path(number)
+        else:
+            path = last
+        self._file = open(path, "ab")
+        self._size = self._file.tell()
+        if self._size:
+            # A crash mid-write can leave a torn line; start on a fresh one
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write(b"\n")
+                    self._size += 1
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _rotate(self):
+        self._sync()
+        path = self._file.name
+        self._file.close()
+        self._file = None
+        if self.compress:
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        number = int(SEGMENT_RE.match(os.path.basename(path)).group(1)) + 1
+        self._file = open(self._segment_path(number), "ab")
+        self._size = 0
+
+    def append(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._file is None:
+                self._open_current()
+            if self._size and self._size + len(line) > self.segment_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+            self._pending += 1
+            if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def flush(self):
+        """Forces buffered records to disk."""
+        with self._lock:
+            if self._file is not None and self._pending:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def read(self) -> Iterator[Dict[str, Any]]:
+        """Streams every record, oldest first, one segment at a time."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+        for path in self.segments():
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rb") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash
+                        continue
+
+    def is_empty(self) -> bool:
+        return not any(os.path.getsize(path) for path in self.segments())
+
+    def import_json(self, path: str) -> int:
+        """
+        Imports a legacy memory.json (one JSON array) if the log is still
+        empty, then renames it to .bak. Returns the number of records imported.
+        The records are written to a temporary file that is renamed into
+        place as the first segment, so a crash midway leaves the log empty
+        and the import is simply redone on the next start.
+        """
+        if not os.path.exists(path) or not self.is_empty():
+            return 0
+        try:
+            with open(path, "r") as f:
+                content = f.read()
+            records = json.loads(content) if content.strip() else []
+        except (IOError, json.JSONDecodeError) as e:
+            print(f"Could not import {path}: {e}")
+            return 0
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            segments = self.segments()
+            # Only empty segments exist; take the place of the newest one
+            target = segments[-1] if segments and not segments[-1].endswith(".gz") else self._segment_path(1)
+            tmp = target + ".tmp"
+            with open(tmp, "wb") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, target)
+        os.replace(path, path + ".bak")
+        return len(records)
+
+
+def open_interaction_log(directory: str = MEMORY_LOG_DIR, legacy_file: Optional[str] = None) -> InteractionLog:
+    """Opens the log, importing `legacy_file` (memory.json) on first use."""
+    log = InteractionLog(directory)
+    if legacy_file:
+        imported = log.import_json(legacy_file)
+        if imported:
+            print(f"📦 Imported {imported} records from {legacy_file} into {directory}/")
+    return log
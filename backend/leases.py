@@ -0,0 +1,126 @@
+import os
+import time
+import socket
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Leased user assignments
+# Lets several backend processes (uvicorn workers, or hosts sharing the user
+# database) schedule the same users without processing a mailbox twice.
+# A worker runs a user's cycle only while it holds that user's lease: claims
+# are a single conditional upsert in SQLite, and a lease expires
+# LEASE_TTL_SECONDS after its last heartbeat, so users held by a worker that
+# crashed are picked up by the others once the lease runs out.
+
+LEASE_DB = os.environ.get("LEASE_DB", "")  # "" keeps the leases next to the users (users.db)
+LEASE_TTL_SECONDS = float(os.environ.get("LEASE_TTL_SECONDS", 90))
+LEASE_HEARTBEAT_SECONDS = float(os.environ.get("LEASE_HEARTBEAT_SECONDS", 30))
+LEASE_RESYNC_SECONDS = float(os.environ.get("LEASE_RESYNC_SECONDS", 60))
+
+
+def default_worker_id() -> str:
+    return os.environ.get("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseStore:
+    """Per-user leases in a SQLite table shared by every worker."""
+
+    def __init__(self, path: str, worker_id: Optional[str] = None, ttl: float = LEASE_TTL_SECONDS):
+        self.path = path
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = ttl
+        self._local = threading.local()
+        self._ensure_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Per-thread connections, as in user_store.SQLiteUserStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "email TEXT PRIMARY KEY, worker TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_leases_worker ON leases (worker)")
+
+    def claim(self, emails: Iterable[str], now: Optional[float] = None) -> Tuple[List[str], Dict[str, float]]:
+        """
+        Takes the lease of every listed user that is free (never leased,
+        expired or released) or already ours, in one transaction. Returns
+        (claimed, busy) where busy maps the others to their lease expiry.
+        """
+        now = time.time() if now is None else now
+        claimed, busy = [], {}
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for email in emails:
+                cur = conn.execute(
+                    "INSERT INTO leases (email, worker, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (email) DO UPDATE SET worker = excluded.worker, expires_at = excluded.expires_at "
+                    "WHERE leases.expires_at <= ? OR leases.worker = excluded.worker",
+                    (email, self.worker_id, now + self.ttl, now),
+                )
+                if cur.rowcount == 1:
+                    claimed.append(email)
+                else:
+                    busy[email] = conn.execute(
+                        "SELECT expires_at FROM leases WHERE email = ?", (email,)
+                    ).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return claimed, busy
+
+    def renew(self, emails: Iterable[str], now: Optional[float] = None) -> int:
+        """Heartbeat: extends our leases on `emails`. Returns how many we still hold."""
+        now = time.time() if now is None else now
+        emails = list(emails)
+        if not emails:
+            return 0
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            held = 0
+            for email in emails:
+                held += conn.execute(
+                    "UPDATE leases SET expires_at = ? WHERE email = ? AND worker = ?",
+                    (now + self.ttl, email, self.worker_id),
+                ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return held
+
+    def release(self, email: str, until: float = 0.0):
+        """Gives a lease up; with `until`, nobody (us included) can claim it before then."""
+        self._conn().execute(
+            "UPDATE leases SET worker = '', expires_at = ? WHERE email = ? AND worker = ?",
+            (until, email, self.worker_id),
+        )
+
+    def workers(self, now: Optional[float] = None) -> Dict[str, int]:
+        """Live leases per worker."""
+        now = time.time() if now is None else now
+        cur = self._conn().execute(
+            "SELECT worker, COUNT(*) FROM leases WHERE expires_at > ? AND worker != '' GROUP BY worker", (now,)
+        )
+        return {worker: count for worker, count in cur.fetchall()}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
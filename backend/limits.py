@@ -0,0 +1,17 @@
+import asyncio
+from typing import Dict
+
+# Concurrency limits
+# One semaphore per key (IMAP host, API key, ...), created on first use.
+
+
+class KeyedSemaphore:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._sems: Dict[str, asyncio.Semaphore] = {}
+
+    def get(self, key: str) -> asyncio.Semaphore:
+        sem = self._sems.get(key)
+        if sem is None:
+            sem = self._sems[key] = asyncio.Semaphore(self.limit)
+        return sem
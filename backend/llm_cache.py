@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+# LLM response cache
+# Persistent, content-addressed cache for classification and reply calls.
+# Identical (normalised) bodies asked the same question with the same model
+# and prompt reuse the stored answer instead of calling OpenRouter again.
+
+LLM_CACHE_DB = os.environ.get("LLM_CACHE_DB", "llm_cache.db")  # "" disables the cache
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10000))
+LLM_CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+# 1 = one cache for every backend user; 0 = entries are only reused by the
+# account that created them
+LLM_CACHE_SHARED = os.environ.get("LLM_CACHE_SHARED", "0") == "1"
+
+# Evict only when the table is this much over its limit, so puts stay cheap
+EVICT_SLACK = 0.1
+
+
+def normalize_body(text: str) -> str:
+    """Case- and whitespace-insensitive form of a body, used for keys."""
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(kind: str, body: str, model: str, prompt_version: str, scope: str = "", **params: Any) -> str:
+    """
+    SHA-256 over everything that determines the answer: the call kind
+    ("classify", "reply"), normalised body, model, prompt version and any
+    prompt parameters (intent, strategy, sender name...). `scope` keeps
+    per-account entries apart when the cache isn't shared.
+    """
+    material = json.dumps(
+        [kind, normalize_body(body), model, prompt_version, scope, sorted(params.items())],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """SQLite-backed key/value cache with TTL and least-recently-used size eviction."""
+
+    def __init__(self, path: str = LLM_CACHE_DB, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 ttl: float = LLM_CACHE_TTL_SECONDS, shared: bool = LLM_CACHE_SHARED):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ensure_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread (pipeline workers call in parallel)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)")
+
+    def scope(self, user_email: Optional[str]) -> str:
+        """Key scope for an account: empty when the cache is shared."""
+        return "" if self.shared else (user_email or "")
+
+    def get(self, key: str, now: Optional[float] = None) -> Optional[Any]:
+        now = time.time() if now is None else now
+        conn = self._conn()
+        row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is not None and now - row[1] > self.ttl:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), now, now),
+        )
+        count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if count > self.max_entries * (1 + EVICT_SLACK):
+            self.evict(now)
+
+    def evict(self, now: Optional[float] = None) -> int:
+        """Drops expired entries, then least recently used ones down to max_entries."""
+        now = time.time() if now is None else now
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,)).rowcount
+        removed += conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            "SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        size = self._conn().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": size,
+            "shared": self.shared,
+        }
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def open_llm_cache(path: str = LLM_CACHE_DB) -> Optional[LLMCache]:
+    """The cache configured by LLM_CACHE_DB, or None when caching is disabled."""
+    return LLMCache(path) if path else None
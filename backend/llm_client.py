@@ -0,0 +1,282 @@
+import os
+import json
+import queue
+import random
+import asyncio
+import threading
+import concurrent.futures
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+import httpx
+
+from limits import KeyedSemaphore
+
+# LLM HTTP client
+# One shared httpx.AsyncClient (keep-alive connection pool, optional HTTP/2)
+# running on a background event loop, so both async code and the sync agent
+# functions in worker threads reuse the same connections.
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 10))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 60))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", 20))
+LLM_MAX_INFLIGHT = int(os.environ.get("OPENROUTER_MAX_CONCURRENCY", 8))
+LLM_MAX_INFLIGHT_PER_KEY = int(os.environ.get("LLM_MAX_INFLIGHT_PER_KEY", 4))
+LLM_HTTP2 = os.environ.get("LLM_HTTP2", "0") == "1"
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_HEADERS = {
+    "Content-Type": "application/json",
+    "HTTP-Referer": "https://localhost",
+    "X-Title": "EmailAgent",
+}
+
+
+class LLMError(Exception):
+    """Raised when a request fails after all retries."""
+
+
+# Marks the end of a stream on the consumer's queue
+_END = object()
+
+
+def parse_sse_chunk(line: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    (content, usage) of one OpenAI-style SSE `data:` line. Content is "" for
+    [DONE] and None if there is none; usage comes with the final chunk.
+    """
+    if not line.startswith("data:"):
+        return None, None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return "", None
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        return None, None
+    if not isinstance(chunk, dict):
+        return None, None
+    usage = chunk.get("usage") or None
+    try:
+        return chunk["choices"][0].get("delta", {}).get("content") or None, usage
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return None, usage
+
+
+def parse_sse_delta(line: str) -> Optional[str]:
+    """Content of one OpenAI-style SSE `data:` line; "" for [DONE], None if there is none."""
+    return parse_sse_chunk(line)[0]
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class LLMClient:
+    def __init__(self, url: str = OPENROUTER_URL, max_retries: int = LLM_MAX_RETRIES,
+                 connect_timeout: float = LLM_CONNECT_TIMEOUT, read_timeout: float = LLM_READ_TIMEOUT,
+                 max_inflight: int = LLM_MAX_INFLIGHT, max_inflight_per_key: int = LLM_MAX_INFLIGHT_PER_KEY,
+                 http2: bool = LLM_HTTP2, on_usage: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.url = url
+        # Called with {"model", "usage"} for every completion that reports token usage
+        self.on_usage = on_usage
+        self.max_retries = max_retries
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_inflight = max_inflight
+        self.http2 = http2 and _http2_available()
+        self._key_slots = KeyedSemaphore(max_inflight_per_key)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_inflight, max_keepalive_connections=self.max_inflight)
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits, http2=self.http2)
+            self._slots = asyncio.Semaphore(self.max_inflight)
+        return self._client
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), LLM_BACKOFF_MAX)
+            except ValueError:
+                pass
+        # Full jitter: uniform(0, base * 2^attempt), capped
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+    async def _chat(self, payload: Dict[str, Any], api_key: str, max_retries: Optional[int] = None) -> Dict[str, Any]:
+        # Always runs on the client's own loop (see chat / chat_sync)
+        client = self._get_client()
+        headers = {**DEFAULT_HEADERS, "Authorization": f"Bearer {api_key}"}
+        max_retries = self.max_retries if max_retries is None else max_retries
+        last_error = None
+        for attempt in range(max_retries + 1):
+            retry_after = None
+            # Slots are held per attempt, never while backing off
+            async with self._key_slots.get(api_key), self._slots:
+                try:
+                    response = await client.post(self.url, headers=headers, json=payload)
+                    if response.status_code not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        try:
+                            data = response.json()
+                        except ValueError as e:
+                            raise LLMError(f"Invalid JSON response: {response.text[:200]}") from e
+                        self._usage(data, payload)
+                        return data
+                    retry_after = response.headers.get("Retry-After")
+                    last_error = f"HTTP {response.status_code}"
+                except httpx.HTTPStatusError as e:
+                    raise LLMError(f"HTTP {e.response.status_code}: {e.response.text[:200]}") from e
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    last_error = f"{type(e).__name__}: {e}"
+            if attempt < max_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+        raise LLMError(f"Giving up after {max_retries + 1} attempts ({last_error})")
+
+    async def _stream(self, payload: Dict[str, Any], api_key: str, emit: Callable[[str], None],
+                      max_retries: Optional[int] = None):
+        """
+        Streaming (SSE) chat completion; calls emit(delta) for each content
+        piece. Retries like _chat, but only until the first byte arrives:
+        a stream that breaks halfway raises, since replaying it would repeat text.
+        """
+        client = self._get_client()
+        headers = {**DEFAULT_HEADERS, "Authorization": f"Bearer {api_key}", "Accept": "text/event-stream"}
+        # Usage arrives in the last chunk; a stream cut short at the sign-off has none
+        payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+        max_retries = self.max_retries if max_retries is None else max_retries
+        last_error = None
+        for attempt in range(max_retries + 1):
+            retry_after = None
+            started = False
+            # Slots are held per attempt, never while backing off
+            async with self._key_slots.get(api_key), self._slots:
+                try:
+                    async with client.stream("POST", self.url, headers=headers, json=payload) as response:
+                        if response.status_code not in RETRY_STATUSES:
+                            if response.status_code >= 400:
+                                body = (await response.aread()).decode("utf-8", "replace")
+                                raise LLMError(f"HTTP {response.status_code}: {body[:200]}")
+                            lines = response.aiter_lines()
+                            try:
+                                async for line in lines:
+                                    delta, usage = parse_sse_chunk(line)
+                                    if usage:
+                                        self._usage({"usage": usage}, payload)
+                                    if delta == "":
+                                        break
+                                    if delta:
+                                        started = True
+                                        emit(delta)
+                            finally:
+                                await lines.aclose()
+                            return
+                        retry_after = response.headers.get("Retry-After")
+                        last_error = f"HTTP {response.status_code}"
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    if started:
+                        raise LLMError(f"Stream interrupted: {type(e).__name__}: {e}") from e
+                    last_error = f"{type(e).__name__}: {e}"
+            if attempt < max_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+        raise LLMError(f"Giving up after {max_retries + 1} attempts ({last_error})")
+
+    def _usage(self, data: Any, payload: Dict[str, Any]):
+        if self.on_usage is None or not isinstance(data, dict) or not data.get("usage"):
+            return
+        try:
+            self.on_usage({"model": data.get("model") or payload.get("model"), "usage": data["usage"]})
+        except Exception as e:
+            print(f"Usage hook failed: {e}")
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-client", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro) -> "concurrent.futures.Future":
+        """Schedules a coroutine on the client's loop (where _chat/_stream must run)."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    async def chat(self, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """
+        POSTs a chat completion. Retries 429/5xx and transport errors with
+        jittered backoff; raises LLMError when retries are exhausted.
+        """
+        return await asyncio.wrap_future(self.submit(self._chat(payload, api_key)))
+
+    def chat_sync(self, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """Blocking version of chat() for worker threads."""
+        return self.submit(self._chat(payload, api_key)).result()
+
+    def stream_sync(self, payload: Dict[str, Any], api_key: str) -> Iterator[str]:
+        """
+        Yields content deltas of a streaming completion as they arrive.
+        Closing the generator early (break) cancels the request, so the
+        server stops generating tokens nobody will read.
+        """
+        return self.iter_sync(lambda emit: self._stream(payload, api_key, emit))
+
+    def stream(self, payload: Dict[str, Any], api_key: str) -> AsyncIterator[str]:
+        """Async version of stream_sync()."""
+        return self.iter_async(lambda emit: self._stream(payload, api_key, emit))
+
+    def iter_sync(self, start: Callable[[Callable[[str], None]], Any]) -> Iterator[str]:
+        """Runs the coroutine start(emit) on the client's loop, yielding what it emits."""
+        deltas: "queue.Queue[Any]" = queue.Queue()
+        future = self.submit(start(deltas.put))
+        future.add_done_callback(lambda _: deltas.put(_END))
+        try:
+            while True:
+                delta = deltas.get()
+                if delta is _END:
+                    break
+                yield delta
+            future.result()
+        finally:
+            if not future.done():
+                future.cancel()
+
+    async def iter_async(self, start: Callable[[Callable[[str], None]], Any]) -> AsyncIterator[str]:
+        """iter_sync() for callers on another event loop."""
+        loop = asyncio.get_running_loop()
+        deltas: "asyncio.Queue[Any]" = asyncio.Queue()
+        put = lambda item: loop.call_soon_threadsafe(deltas.put_nowait, item)
+        future = self.submit(start(put))
+        future.add_done_callback(lambda _: put(_END))
+        try:
+            while True:
+                delta = await deltas.get()
+                if delta is _END:
+                    break
+                yield delta
+            future.result()
+        finally:
+            if not future.done():
+                future.cancel()
+
+    async def _aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        # Finalize response iterators left behind by cancelled streams
+        await asyncio.get_running_loop().shutdown_asyncgens()
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,380 @@
+import os
+import re
+import base64
+import codecs
+import quopri
+import email
+import email.policy
+import itertools
+from email.utils import parseaddr
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+import mail_sync
+
+# Header-first lazy fetching
+# Phase one fetches only the headers triage needs (plus RFC822.SIZE and
+# BODYSTRUCTURE) for a batch of UIDs. Messages that survive header triage get
+# phase two: just their first text part, capped at BODY_FETCH_BYTES with a
+# partial BODY.PEEK[part]<0.N>. Attachments are never downloaded, and neither
+# is anything of an ignored message past its headers.
+
+BODY_FETCH_BYTES = int(os.environ.get("BODY_FETCH_BYTES", 16384))
+# Everything triage and automation.header_reason() look at
+HEADER_FIELDS = ["FROM", "SUBJECT", "DATE", "MESSAGE-ID", "REFERENCES", "LIST-UNSUBSCRIBE",
+                 "LIST-ID", "PRECEDENCE", "AUTO-SUBMITTED", "X-AUTO-RESPONSE-SUPPRESS"]
+
+
+class Address(NamedTuple):
+    name: str
+    email: str
+
+
+class TextPart(NamedTuple):
+    section: str      # IMAP section path, e.g. "1" or "2.1"
+    subtype: str      # "plain" or "html"
+    encoding: str     # Content-Transfer-Encoding, lower case
+    charset: str
+    size: int
+
+
+class LazyMessage:
+    """
+    The fields of an imap_tools MailMessage that the agent uses, built from a
+    header-only fetch. `text`/`html` stay empty until the body is fetched.
+    """
+
+    def __init__(self, uid: str, size: int, header_bytes: bytes, structure: Optional[list]):
+        self.uid = uid
+        self.size = size
+        self.structure = structure
+        parsed = email.message_from_bytes(header_bytes, policy=email.policy.default)
+        headers: Dict[str, List[str]] = {}
+        for key, value in parsed.items():
+            headers.setdefault(key.lower(), []).append(str(value))
+        # Same shape as MailMessage.headers: lower-case names -> tuple of values
+        self.headers = {k: tuple(v) for k, v in headers.items()}
+        self.subject = self.header("subject")
+        name, addr = parseaddr(self.header("from"))
+        self.from_ = addr.lower()
+        self.from_values = Address(name, self.from_)
+        self.text = ""
+        self.html = ""
+        self.body_fetched = False
+        self.truncated = False
+        # No header literal came back, or the body fetch returned nothing: leave it unread
+        self.unreadable = not header_bytes
+
+    def header(self, name: str) -> str:
+        values = self.headers.get(name.lower())
+        return values[0] if values else ""
+
+    def text_part(self) -> Optional[TextPart]:
+        return find_text_part(self.structure) if self.structure is not None else None
+
+
+class FetchStats:
+    """Bytes pulled from the server during one cycle, by phase."""
+
+    def __init__(self):
+        self.messages = 0
+        self.bodies = 0
+        self.header_bytes = 0
+        self.body_bytes = 0
+        self.mailbox_bytes = 0   # RFC822.SIZE of every message looked at
+
+    @property
+    def fetched_bytes(self) -> int:
+        return self.header_bytes + self.body_bytes
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "messages": self.messages,
+            "bodies_fetched": self.bodies,
+            "header_bytes": self.header_bytes,
+            "body_bytes": self.body_bytes,
+            "fetched_bytes": self.fetched_bytes,
+            "skipped_bytes": max(self.mailbox_bytes - self.fetched_bytes, 0),
+        }
+
+
+# -- BODYSTRUCTURE ------------------------------------------------------------
+
+_TOKEN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|\{\d+\}\r\n|[^\s()"]+')
+
+
+def parse_bodystructure(data: bytes) -> list:
+    """Parses a parenthesized BODYSTRUCTURE into nested lists of str/int/None."""
+    stack: List[list] = [[]]
+    pos = 0
+    while pos < len(data):
+        m = _TOKEN.search(data, pos)
+        if not m:
+            break
+        token = m.group()
+        pos = m.end()
+        if token == b"(":
+            stack.append([])
+        elif token == b")":
+            done = stack.pop()
+            stack[-1].append(done)
+        elif token.startswith(b'"'):
+            stack[-1].append(re.sub(rb"\\(.)", rb"\1", token[1:-1]).decode("utf-8", "replace"))
+        elif token.startswith(b"{"):
+            length = int(token[1:token.index(b"}")])
+            stack[-1].append(data[pos:pos + length].decode("utf-8", "replace"))
+            pos += length
+        elif token.upper() == b"NIL":
+            stack[-1].append(None)
+        else:
+            text = token.decode("ascii", "replace")
+            stack[-1].append(int(text) if text.isdigit() else text)
+    return stack[0][0] if stack[0] and isinstance(stack[0][0], list) else stack[0]
+
+
+def _is_attachment(part: list) -> bool:
+    # The disposition is a ("ATTACHMENT" (params)) list somewhere in the extension data
+    for field in part[7:]:
+        if isinstance(field, list) and field and isinstance(field[0], str) and field[0].lower() == "attachment":
+            return True
+    return False
+
+
+def _text_parts(node: list, path: str) -> Iterator[TextPart]:
+    if node and isinstance(node[0], list):
+        # multipart: child parts first, then the subtype and extension data
+        children = itertools.takewhile(lambda c: isinstance(c, list), node)
+        for i, child in enumerate(children):
+            yield from _text_parts(child, f"{path}.{i + 1}" if path else str(i + 1))
+        return
+    if len(node) < 7 or str(node[0]).lower() != "text" or _is_attachment(node):
+        return
+    params = node[2] if isinstance(node[2], list) else []
+    charset = "utf-8"
+    for key, value in zip(params[::2], params[1::2]):
+        if str(key).lower() == "charset" and value:
+            charset = value
+    yield TextPart(path or "1", str(node[1]).lower(), str(node[5] or "7bit").lower(), charset,
+                   node[6] if isinstance(node[6], int) else 0)
+
+
+# Read instead of a text part when BODYSTRUCTURE has none (or didn't parse): the raw body
+RAW_TEXT = TextPart("TEXT", "plain", "7bit", "utf-8", 0)
+
+
+def find_text_part(structure: list) -> Optional[TextPart]:
+    """The first inline text/plain part, else the first text/html one."""
+    parts = list(_text_parts(structure, ""))
+    for subtype in ("plain", "html"):
+        for part in parts:
+            if part.subtype == subtype:
+                return part
+    return None
+
+
+def decode_part(data: bytes, part: TextPart, truncated: bool) -> str:
+    if part.encoding == "base64":
+        data = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+        if truncated:
+            # A capped fetch can stop mid-quantum
+            data = data[:len(data) - len(data) % 4]
+        data = base64.b64decode(data + b"=" * (-len(data) % 4))
+    elif part.encoding == "quoted-printable":
+        if truncated:
+            # ...or mid-escape ("=" or "=A" at the very end)
+            data = re.sub(rb"=[0-9A-Fa-f]?$", b"", data)
+        data = quopri.decodestring(data)
+    try:
+        decoder = codecs.getincrementaldecoder(part.charset)("replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    # Not final when truncated, so a multi-byte character cut in half is dropped
+    return decoder.decode(data, final=not truncated)
+
+
+# -- FETCH responses ----------------------------------------------------------
+
+_MESSAGE_START = re.compile(rb"^\d+ \(")
+_LITERAL = re.compile(rb"\{(\d+)\}\r\n")
+_QUOTED = re.compile(rb'"(?:[^"\\]|\\.)*"')
+_ITEM_NAME = re.compile(rb"\s*([A-Za-z0-9.]+(?:\[[^\]]*\])?(?:<\d+>)?)\s+")
+_ATOM = re.compile(rb"[^\s()]+")
+
+
+def _group_fetch_response(data: list) -> List[bytes]:
+    """
+    imaplib hands back a flat list mixing (prefix, literal) tuples and plain
+    bytes. Rebuilds each message's response as sent, with every literal back
+    in place after its {N} marker (CRLF included), so literals inside
+    BODYSTRUCTURE and the header/body literals can't be mixed up.
+    """
+    grouped: List[bytes] = []
+    for item in data:
+        if isinstance(item, tuple):
+            prefix, literal = item
+            chunk = prefix + b"\r\n" + literal
+        elif isinstance(item, bytes) and item:
+            prefix = chunk = item
+        else:
+            continue
+        if _MESSAGE_START.match(prefix) or not grouped:
+            grouped.append(chunk)
+        else:
+            grouped[-1] += chunk
+    return grouped
+
+
+def _uid_fetch(mailbox, uids: List[str], items: str) -> List[Dict[str, bytes]]:
+    typ, data = mailbox.client.uid("FETCH", ",".join(uids), items)
+    if typ != "OK":
+        raise RuntimeError(f"UID FETCH failed: {data!r}")
+    return [_fetch_items(response) for response in _group_fetch_response(data)]
+
+
+def _list_end(data: bytes, start: int) -> int:
+    """Index just past the list opening at `start`, skipping quoted strings and literals."""
+    depth = 0
+    pos = start
+    while pos < len(data):
+        char = data[pos:pos + 1]
+        if char == b'"':
+            m = _QUOTED.match(data, pos)
+            pos = m.end() if m else pos + 1
+            continue
+        if char == b"{":
+            m = _LITERAL.match(data, pos)
+            if m:
+                pos = m.end() + int(m.group(1))
+                continue
+        if char == b"(":
+            depth += 1
+        elif char == b")":
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        pos += 1
+    return len(data)
+
+
+def _fetch_items(response: bytes) -> Dict[str, bytes]:
+    """
+    One message's "N (NAME value NAME value ...)" as {NAME: value}. Lists
+    keep their parentheses (and any literals inside them), literals and
+    quoted strings are returned as their content.
+    """
+    items: Dict[str, bytes] = {}
+    m = _MESSAGE_START.match(response)
+    pos = m.end() if m else 0
+    while pos < len(response):
+        name = _ITEM_NAME.match(response, pos)
+        if not name:
+            break
+        pos = name.end()
+        if response[pos:pos + 1] == b"(":
+            end = _list_end(response, pos)
+            value = response[pos:end]
+        elif _LITERAL.match(response, pos):
+            literal = _LITERAL.match(response, pos)
+            end = literal.end() + int(literal.group(1))
+            value = response[literal.end():end]
+        elif response[pos:pos + 1] == b'"':
+            quoted = _QUOTED.match(response, pos)
+            end = quoted.end() if quoted else len(response)
+            value = re.sub(rb"\\(.)", rb"\1", response[pos + 1:end - 1])
+        else:
+            atom = _ATOM.match(response, pos)
+            if not atom:
+                break
+            end = atom.end()
+            value = atom.group()
+        items[name.group(1).decode("ascii", "replace").upper()] = value
+        pos = end
+    return items
+
+
+def _item(items: Dict[str, bytes], prefix: str) -> Optional[bytes]:
+    for name, value in items.items():
+        if name.startswith(prefix):
+            return value
+    return None
+
+
+def fetch_headers(mailbox, uids: List[str], stats: Optional[FetchStats] = None) -> List[LazyMessage]:
+    """Phase one: triage headers, size and structure for `uids`, in UID order."""
+    fields = " ".join(HEADER_FIELDS)
+    msgs = []
+    for items in _uid_fetch(mailbox, uids, f"(UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({fields})])"):
+        uid = items.get("UID", b"")
+        if not uid.isdigit():
+            continue
+        size = items.get("RFC822.SIZE", b"")
+        structure = None
+        if items.get("BODYSTRUCTURE"):
+            try:
+                structure = parse_bodystructure(items["BODYSTRUCTURE"])
+            except (ValueError, IndexError):
+                structure = None
+        header_bytes = _item(items, "BODY[HEADER.FIELDS") or b""
+        msg = LazyMessage(uid.decode(), int(size) if size.isdigit() else 0, header_bytes, structure)
+        msgs.append(msg)
+        if stats is not None:
+            stats.messages += 1
+            stats.header_bytes += len(header_bytes)
+            stats.mailbox_bytes += msg.size
+    return sorted(msgs, key=lambda m: int(m.uid))
+
+
+def fetch_bodies(mailbox, msgs: List[LazyMessage], max_bytes: Optional[int] = None,
+                 stats: Optional[FetchStats] = None):
+    """
+    Phase two: fills in `text`/`html` from each message's first text part,
+    reading at most `max_bytes` of it. One UID FETCH per distinct section.
+    """
+    max_bytes = max_bytes or BODY_FETCH_BYTES
+    by_section: Dict[str, List[LazyMessage]] = {}
+    for msg in msgs:
+        msg.body_fetched = True
+        # Without a usable structure, the raw body text (capped) is better than nothing
+        part = msg.text_part() or RAW_TEXT
+        by_section.setdefault(part.section, []).append(msg)
+    for section, group in by_section.items():
+        by_uid = {msg.uid: msg for msg in group}
+        missing = set(by_uid)
+        for items in _uid_fetch(mailbox, list(by_uid), f"(UID BODY.PEEK[{section}]<0.{max_bytes}>)"):
+            msg = by_uid.get(items.get("UID", b"").decode())
+            data = _item(items, "BODY[")
+            if msg is None or data is None:
+                continue
+            missing.discard(msg.uid)
+            part = msg.text_part() or RAW_TEXT
+            msg.truncated = len(data) >= max_bytes and (part.size or msg.size) > max_bytes
+            text = decode_part(data, part, msg.truncated)
+            if part.subtype == "plain":
+                msg.text = text
+            else:
+                msg.html = text
+            if stats is not None:
+                stats.bodies += 1
+                stats.body_bytes += len(data)
+        for uid in missing:
+            by_uid[uid].unreadable = True
+
+
+def fetch_batches(mailbox, uids: List[int], needs_body: Callable[[Any], bool], batch_size: Optional[int] = None,
+                  max_bytes: Optional[int] = None, stats: Optional[FetchStats] = None) -> Iterator[List[LazyMessage]]:
+    """
+    Yields the messages for `uids` in order, one list per batch, two phases
+    per batch: headers for all, then a capped text part only for those
+    `needs_body(msg)` accepts. Nothing sets \\Seen (all fetches use BODY.PEEK).
+    """
+    batch_size = batch_size or mail_sync.SYNC_BATCH_SIZE
+    for start in range(0, len(uids), batch_size):
+        batch = [str(uid) for uid in uids[start:start + batch_size]]
+        msgs = fetch_headers(mailbox, batch, stats)
+        fetch_bodies(mailbox, [m for m in msgs if needs_body(m)], max_bytes, stats)
+        yield msgs
+
+
+def fetch_lazy(mailbox, uids: List[int], needs_body: Callable[[Any], bool], batch_size: Optional[int] = None,
+               max_bytes: Optional[int] = None, stats: Optional[FetchStats] = None) -> Iterator[LazyMessage]:
+    """fetch_batches(), one message at a time."""
+    for msgs in fetch_batches(mailbox, uids, needs_body, batch_size, max_bytes, stats):
+        yield from msgs
@@ -0,0 +1,83 @@
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from imap_tools import AND, MailMessageFlags
+
+# Incremental mailbox sync
+# Each account remembers the UIDVALIDITY of its INBOX and a high-water mark
+# (last_uid): every message at or below it has been dealt with. A cycle only
+# searches above the mark, fetches candidates oldest-first in bulk batches
+# (headers first, see mail_fetch.py), and flags \Seen only on messages that
+# were actually handled.
+
+SYNC_FOLDER = os.environ.get("SYNC_FOLDER", "INBOX")
+SYNC_BATCH_SIZE = int(os.environ.get("SYNC_BATCH_SIZE", 50))
+# On an account's first sync only the newest N unread messages are taken;
+# older unread mail is left alone rather than answered months late.
+SYNC_INITIAL_BACKLOG = int(os.environ.get("SYNC_INITIAL_BACKLOG", 50))
+
+
+def new_sync_state() -> Dict[str, int]:
+    return {"uidvalidity": 0, "last_uid": 0}
+
+
+def select_folder(mailbox, folder: str = SYNC_FOLDER) -> Tuple[int, int]:
+    """
+    (Re-)selects the folder, which also refreshes a pooled session's view,
+    and returns its (UIDVALIDITY, UIDNEXT) from the SELECT response.
+    """
+    mailbox.folder.set(folder)
+    values = []
+    for name in ("UIDVALIDITY", "UIDNEXT"):
+        _, data = mailbox.client.response(name)
+        values.append(int(data[-1]) if data and data[-1] else 0)
+    return values[0], values[1]
+
+
+def pending_uids(mailbox, state: Dict[str, int], initial_backlog: Optional[int] = None) -> Tuple[List[int], int]:
+    """
+    Unread UIDs above the high-water mark, oldest first, plus the highest UID
+    the mailbox had when selected. Resets the mark in `state` when the
+    server's UIDVALIDITY changed (old UIDs are meaningless).
+    """
+    if initial_backlog is None:
+        initial_backlog = SYNC_INITIAL_BACKLOG
+    uidvalidity, uidnext = select_folder(mailbox)
+    first_sync = state.get("uidvalidity") != uidvalidity or not state.get("last_uid")
+    if state.get("uidvalidity") != uidvalidity:
+        state["uidvalidity"] = uidvalidity
+        state["last_uid"] = 0
+    last_uid = state["last_uid"]
+    if last_uid and uidnext and uidnext - 1 <= last_uid:
+        # Nothing new since the last cycle; skip the SEARCH entirely
+        return [], last_uid
+
+    criteria = AND(seen=False) if first_sync else AND(uid=f"{last_uid + 1}:*", seen=False)
+    # "N:*" matches the highest UID even when it is below N, so filter again
+    uids = sorted(int(uid) for uid in mailbox.uids(criteria) if int(uid) > last_uid)
+    if first_sync:
+        uids = uids[-initial_backlog:] if initial_backlog else []
+        # Start the mark just below what we'll process (or at the newest message)
+        state["last_uid"] = uids[0] - 1 if uids else max(uidnext - 1, 0)
+    return uids, max(uidnext - 1, uids[-1] if uids else 0)
+
+
+def mark_seen(mailbox, uids: Iterable[int]):
+    uids = [str(uid) for uid in uids]
+    if uids:
+        mailbox.flag(uids, MailMessageFlags.SEEN, True)
+
+
+def advance(state: Dict[str, int], candidates: List[int], handled: Set[int], highest_uid: int) -> int:
+    """
+    Moves the high-water mark up to just below the first candidate that was
+    not handled (failed, or deferred by a deadline), so it is retried next
+    cycle while everything before it is never searched again. When all were
+    handled the mark moves to `highest_uid` (from pending_uids), skipping
+    messages that were already read.
+    """
+    for uid in sorted(candidates):
+        if uid not in handled:
+            state["last_uid"] = max(state.get("last_uid", 0), uid - 1)
+            return state["last_uid"]
+    state["last_uid"] = max(state.get("last_uid", 0), highest_uid)
+    return state["last_uid"]
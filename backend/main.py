@@ -1,15 +1,29 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks
+from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import json
 import os
 import asyncio
+import time
 import datetime
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.interval import IntervalTrigger
+import itertools
 
 # Import our logic
-from agent_logic import run_agent_cycle
+from agent_logic import run_agent_cycle, imap_pool, smtp_pool, llm_client, llm_cache, fetch_stats, automation, IMAP_SERVER
+from agent_logic import classify_intent, decide_strategy, reply_payload, model_router, outbox, outbox_sender
+from agent_logic import DEADLINE_ERROR
+from model_router import reply_tier
+from reply_stream import astream_reply, generation_stats
+from imap_pool import IdleWatcher, IMAP_POOL_MAX_IDLE
+from user_store import open_user_store, migrate_from_json
+from history_store import HistoryStore, HISTORY_PAGE_SIZE
+from scheduler import DueScheduler, RETRY_DELAY_SECONDS
+from leases import LeaseStore, LEASE_DB, LEASE_HEARTBEAT_SECONDS, LEASE_RESYNC_SECONDS
+from limits import KeyedSemaphore
+from status_hub import StatusHub, sse
+from metrics import REGISTRY, Gauge, cycles, polls, scheduler_lag_seconds
+from polling import ADAPTIVE_POLLING, next_poll
 
 app = FastAPI(title="Email Agent Backend")
 
@@ -22,21 +36,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mock Database (JSON file)
-DB_FILE = "users.json"
-
-def load_db():
-    if not os.path.exists(DB_FILE):
-        return {}
-    with open(DB_FILE, 'r') as f:
-        try:
-            return json.load(f)
-        except:
-            return {}
-
-def save_db(data):
-    with open(DB_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+# User Database (SQLite, see user_store.py)
+store = open_user_store()
+# Processed-email history (SQLite, see history_store.py)
+history = HistoryStore()
+# Live per-user status pushed to the popup (see status_hub.py)
+status_hub = StatusHub()
+# Which worker runs which user when several share the user database (see leases.py)
+leases = LeaseStore(LEASE_DB or store.path)
 
 # Models
 class LoginRequest(BaseModel):
@@ -53,142 +60,440 @@ class SettingsRequest(BaseModel):
     email: str
     interval: int
 
+class DraftRequest(BaseModel):
+    email: str                    # account whose OpenRouter key is used
+    text: str                     # body of the mail to answer
+    sender_name: str = "there"
+    intent: Optional[str] = None  # classified from `text` when omitted
+
 # Scheduler
-scheduler = AsyncIOScheduler()
+scheduler = DueScheduler()
 
-async def active_user_job():
-    """Runs every 1 minute to check for users needing updates."""
-    db = load_db()
-    now = datetime.datetime.now()
-    updated = False
-    
-    for email, user in db.items():
-        if not user.get("active", False):
-            continue
-            
-        last_str = user.get("last_run")
-        interval = user.get("interval_minutes", 30)
-        
-        should_run = False
-        if not last_str:
-            should_run = True # First run
-        else:
-            last_run = datetime.datetime.fromisoformat(last_str)
-            next_run_time = last_run + datetime.timedelta(minutes=interval)
-            if now >= next_run_time:
-                should_run = True
-                
-        if should_run:
+# Optional IMAP IDLE push mode: new mail makes the user due immediately
+IMAP_IDLE = os.environ.get("IMAP_IDLE", "0") == "1"
+idle_watchers = {}
+
+def sync_schedule(user):
+    """Mirrors one user's row into the scheduler's due-time heap and the status snapshot."""
+    if user:
+        status_hub.set_user(user)
+    if user and user.get("active"):
+        scheduler.reschedule(user["email"], user["next_due_at"])
+    elif user:
+        scheduler.remove(user["email"])
+        backlog.pop(user["email"], None)
+    if IMAP_IDLE and user:
+        sync_idle_watcher(user)
+
+def sync_idle_watcher(user):
+    email = user["email"]
+    watcher = idle_watchers.pop(email, None)
+    if watcher and user.get("active") and watcher.password == user["app_password"]:
+        idle_watchers[email] = watcher
+        return
+    if watcher:
+        watcher.stop(timeout=0)
+    if user.get("active"):
+        loop = asyncio.get_running_loop()
+        on_new_mail = lambda e: loop.call_soon_threadsafe(scheduler.reschedule, e, time.time())
+        idle_watchers[email] = IdleWatcher(imap_pool, email, user["app_password"], on_new_mail).start()
+
+async def evict_idle_sessions():
+    while True:
+        await asyncio.sleep(IMAP_POOL_MAX_IDLE / 5)
+        await asyncio.to_thread(imap_pool.evict_idle)
+        await asyncio.to_thread(smtp_pool.evict_idle)
+
+# Cycle concurrency (OpenRouter calls are capped separately in agent_logic)
+MAX_CONCURRENT_CYCLES = int(os.environ.get("MAX_CONCURRENT_CYCLES", 10))
+MAX_CYCLES_PER_IMAP_HOST = int(os.environ.get("MAX_CYCLES_PER_IMAP_HOST", 5))
+CYCLE_TIMEOUT_SECONDS = float(os.environ.get("CYCLE_TIMEOUT_SECONDS", 300))
+
+cycle_slots = asyncio.Semaphore(MAX_CONCURRENT_CYCLES)
+imap_host_slots = KeyedSemaphore(MAX_CYCLES_PER_IMAP_HOST)
+running_users = set()
+cycle_tasks = set()
+# Due users waiting for a free cycle slot (email -> due time); they are only
+# leased once a slot is free, so idle workers can take them meanwhile
+backlog = {}
+# Taken out of the backlog by a claim_backlog() that is waiting on the lease store
+claiming = set()
+
+REGISTRY.register(Gauge("running_cycles", "Cycles in progress.", lambda: len(running_users)))
+REGISTRY.register(Gauge("scheduled_users", "Active users in the scheduler.", lambda: len(scheduler)))
+REGISTRY.register(Gauge("cycle_backlog", "Due users waiting for a free cycle slot.", lambda: len(backlog)))
+REGISTRY.register(Gauge("status_connections", "Connected status streams.", lambda: status_hub.connections()))
+REGISTRY.register(Gauge("outbox_pending", "Replies waiting for delivery.",
+                        lambda: outbox.depth()["pending"]))
+
+async def run_user_cycle(user, due_at: Optional[float] = None):
+    """Runs one user's cycle under the concurrency limits and saves its result."""
+    email = user["email"]
+    cycle = None
+    # Other workers leave the user alone until the retry delay has passed
+    retry_at = 0.0
+    try:
+        async with cycle_slots, imap_host_slots.get(IMAP_SERVER):
+            if due_at is not None:
+                # Includes time spent waiting for a cycle slot
+                scheduler_lag_seconds.observe(max(time.time() - due_at, 0.0))
             print(f"🔄 Processing for {email}...")
-            try:
-                # Run in thread pool
-                logs, timestamp = await asyncio.to_thread(
-                    run_agent_cycle, 
-                    user['email'], 
-                    user['app_password'], 
-                    user['openrouter_key']
-                )
-                print(f"✅ Finished {email}: {len(logs)} actions.")
-                user["last_run"] = timestamp
-                updated = True
-            except Exception as e:
-                print(f"❌ Error user {email}: {e}")
-
-    if updated:
-        save_db(db)
+            status_hub.cycle_started(email)
+            # Updated in place by the cycle as messages are handled
+            sync_state = {"uidvalidity": user.get("uidvalidity", 0), "last_uid": user.get("last_uid", 0)}
+            # Run in thread pool; the deadline makes the thread stop between messages
+            cycle = asyncio.ensure_future(asyncio.to_thread(
+                run_agent_cycle, 
+                user['email'], 
+                user['app_password'], 
+                user['openrouter_key'],
+                time.time() + CYCLE_TIMEOUT_SECONDS,
+                sync_state,
+                lambda entry: status_hub.action(email, entry)
+            ))
+            logs, timestamp = await asyncio.wait_for(asyncio.shield(cycle), CYCLE_TIMEOUT_SECONDS)
+        print(f"✅ Finished {email}: {len(logs)} actions.")
+        errors = [entry["error"] for entry in logs if "action" not in entry]
+        cycles.inc(outcome="error" if errors else "ok")
+        status_hub.cycle_finished(email, len(logs) - len(errors), errors[0] if errors else None,
+                                  fetch_stats.get(email))
+        await asyncio.to_thread(history.record_many, email, logs)
+        fields = dict(last_run=timestamp, **sync_state)
+        if not [error for error in errors if error != DEADLINE_ERROR]:
+            # The mailbox was checked: count it, and adapt the next check to what it found
+            arrivals = (fetch_stats.get(email) or {}).get("messages", 0)
+            polls.inc(result="mail" if arrivals else "empty")
+            if ADAPTIVE_POLLING:
+                fields.update(next_poll(user, arrivals, minutes_between(user.get("last_run"), timestamp),
+                                        backlog=DEADLINE_ERROR in errors))
+        sync_schedule(await asyncio.to_thread(store.update, email, **fields))
+    except asyncio.TimeoutError:
+        print(f"⏱️ Timed out user {email} after {CYCLE_TIMEOUT_SECONDS}s")
+        cycles.inc(outcome="timeout")
+        retry_at = time.time() + RETRY_DELAY_SECONDS
+        scheduler.reschedule(email, retry_at)
+        status_hub.cycle_finished(email, 0, f"Timed out after {CYCLE_TIMEOUT_SECONDS}s", fetch_stats.get(email),
+                                  next_due_at=retry_at)
+    except Exception as e:
+        print(f"❌ Error user {email}: {e}")
+        cycles.inc(outcome="error")
+        retry_at = time.time() + RETRY_DELAY_SECONDS
+        scheduler.reschedule(email, retry_at)
+        status_hub.cycle_finished(email, 0, str(e), fetch_stats.get(email), next_due_at=retry_at)
+    finally:
+        if cycle is not None and not cycle.done():
+            # The worker thread can't be killed; keep the user marked as running
+            # (and leased) until it actually returns so cycles never overlap.
+            cycle.add_done_callback(lambda _: track(finish_cycle(email, retry_at)))
+        else:
+            await finish_cycle(email, retry_at)
+
+def track(coro):
+    """Runs `coro` as a task that is kept referenced until it ends."""
+    task = asyncio.ensure_future(coro)
+    cycle_tasks.add(task)
+    task.add_done_callback(cycle_tasks.discard)
+    return task
+
+async def finish_cycle(email, retry_at: float = 0.0):
+    try:
+        await asyncio.to_thread(leases.release, email, retry_at)
+    finally:
+        running_users.discard(email)
+    # A slot is free: take the next backlogged user
+    await claim_backlog()
+
+def minutes_between(last_run: Optional[str], timestamp: str) -> Optional[float]:
+    if not last_run:
+        return None
+    delta = datetime.datetime.fromisoformat(timestamp) - datetime.datetime.fromisoformat(last_run)
+    return max(delta.total_seconds() / 60, 0.0)
+
+def ran_since(user, due_at: Optional[float]) -> bool:
+    """True if the stored last run is at or after `due_at`, i.e. another worker got there first."""
+    if due_at is None or not user.get("last_run"):
+        return False
+    return datetime.datetime.fromisoformat(user["last_run"]).timestamp() >= due_at
+
+async def claim_backlog():
+    """
+    Leases backlogged users into the free cycle slots and starts their cycles.
+    The lease and user stores are read off the event loop; users being
+    claimed count against the free slots, so concurrent calls never over-claim.
+    """
+    while backlog and len(running_users) + len(claiming) < MAX_CONCURRENT_CYCLES:
+        free = MAX_CONCURRENT_CYCLES - len(running_users) - len(claiming)
+        candidates = {email: backlog.pop(email) for email in list(itertools.islice(backlog, free))}
+        batch = set(candidates)
+        claiming.update(batch)
+        try:
+            claimed, busy = await asyncio.to_thread(leases.claim, list(candidates))
+            for email, expires_at in busy.items():
+                # Another worker has it; look again when its lease could have lapsed
+                candidates.pop(email)
+                scheduler.reschedule(email, expires_at)
+            for email in claimed:
+                due_at = candidates.pop(email)
+                user = await asyncio.to_thread(store.get, email)
+                if not user or not user.get("active") or ran_since(user, due_at):
+                    await asyncio.to_thread(leases.release, email)
+                    if user and user.get("active"):
+                        scheduler.reschedule(email, user["next_due_at"])
+                    continue
+                running_users.add(email)
+                track(run_user_cycle(user, due_at))
+        finally:
+            claiming.difference_update(batch)
+            # Anything not dealt with (the store failed) waits for the next call
+            for email, due_at in candidates.items():
+                backlog.setdefault(email, due_at)
+
+async def active_user_job(emails):
+    """Called by the scheduler with the users whose due time has passed."""
+    for email in emails:
+        due_at = scheduler.popped_due.pop(email, None)
+        if email in running_users or email in claiming:
+            # Never overlap cycles; check again once this one has had time to end
+            scheduler.reschedule(email, time.time() + RETRY_DELAY_SECONDS)
+            continue
+        backlog.setdefault(email, due_at)
+    await claim_backlog()
+
+async def renew_leases():
+    """Heartbeat for the users this worker is running."""
+    while True:
+        await asyncio.sleep(LEASE_HEARTBEAT_SECONDS)
+        held = await asyncio.to_thread(leases.renew, list(running_users))
+        if held < len(running_users):
+            print(f"⚠️ Lost {len(running_users) - held} leases (heartbeat too late?)")
+
+async def resync_schedule():
+    """
+    Reloads due times from the store: users changed through other workers, or
+    left due by one that died. Connected popups get the stored fields too.
+    """
+    while True:
+        await asyncio.sleep(LEASE_RESYNC_SECONDS)
+        schedule = await asyncio.to_thread(store.active_schedule)
+        scheduler.load([(email, due) for email, due in schedule
+                        if email not in running_users and email not in backlog and email not in claiming])
+        for email in status_hub.subscribed():
+            user = await asyncio.to_thread(store.get, email)
+            if user:
+                status_hub.refresh(user)
 
 @app.on_event("startup")
-def start_scheduler():
-    # Run loop often to check various user schedules
-    scheduler.add_job(active_user_job, IntervalTrigger(minutes=1))
-    scheduler.start()
-    print("⏰ Scheduler started (1 min check loop)")
+async def start_scheduler():
+    imported = migrate_from_json(store)
+    if imported:
+        print(f"📦 Migrated {imported} users from users.json")
+
+    # Status snapshots; resync_schedule and POST /status refresh them from the store
+    status_hub.load(store.all_users())
+
+    # Sleeps until the next user is due instead of polling every minute
+    scheduler.load(store.active_schedule())
+    app.state.scheduler_task = asyncio.create_task(scheduler.run(active_user_job))
+    app.state.evict_task = asyncio.create_task(evict_idle_sessions())
+    # Other workers may share the user database; see leases.py
+    app.state.lease_task = asyncio.create_task(renew_leases())
+    app.state.resync_task = asyncio.create_task(resync_schedule())
+    # Retries queued replies; credentials are looked up per send so a new app password is picked up
+    app.state.outbox_task = asyncio.create_task(
+        outbox_sender.run(lambda email: (store.get(email) or {}).get("app_password"))
+    )
+    print(f"⏰ Scheduler started ({len(scheduler)} active users, worker {leases.worker_id})")
+
+    if IMAP_IDLE:
+        for email, _ in store.active_schedule():
+            sync_idle_watcher(await asyncio.to_thread(store.get, email))
+        print(f"📬 IMAP IDLE push enabled for {len(idle_watchers)} users")
+
+@app.on_event("shutdown")
+def stop_connections():
+    for watcher in idle_watchers.values():
+        watcher.stop(timeout=0)
+    imap_pool.close_all()
+    smtp_pool.close_all()
+    llm_client.close()
+    automation.reputation.close()
+    outbox.close()
+    leases.close()
+    if llm_cache is not None:
+        print(f"🗃️ LLM cache: {llm_cache.stats()}")
 
 @app.post("/login")
 async def login(req: LoginRequest):
     print(f"🔐 Attempting Login: {req.email} | Pass Length: {len(req.app_password)}")
-    # Test credentials by trying to login
+    # Test credentials by trying to login (session is kept for the first cycle)
     try:
-        from imap_tools import MailBox
-        with MailBox("imap.gmail.com").login(req.email, req.app_password):
-            pass # Success
+        await asyncio.to_thread(imap_pool.validate, req.email, req.app_password)
     except Exception as e:
         print(f"❌ Login failed: {e}")
         raise HTTPException(status_code=401, detail=f"Login failed: {str(e)}")
 
     # Save to "Database"
-    db = load_db()
-    
     # Preserve existing settings if re-logging in
-    existing = db.get(req.email, {})
+    existing = await asyncio.to_thread(store.get, req.email) or {}
     
-    db[req.email] = {
+    user = await asyncio.to_thread(store.upsert, {
         "email": req.email,
         "app_password": req.app_password,
         "openrouter_key": req.openrouter_key,
         "active": True,
         "interval_minutes": req.interval,
         "last_run": existing.get("last_run")
-    }
-    save_db(db)
+    })
     
-    # Trigger an immediate run in background if never run
-    if not existing.get("last_run"):
-        await active_user_job()
+    # Never-run users are due immediately, so this also triggers the first run
+    sync_schedule(user)
     
     return {"status": "success", "message": "Logged in and Agent Started"}
 
 @app.post("/settings")
 async def update_settings(req: SettingsRequest):
-    db = load_db()
-    if req.email not in db:
+    # A new interval also restarts adaptive polling from it
+    user = await asyncio.to_thread(store.update, req.email, interval_minutes=req.interval, poll_interval=0)
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    db[req.email]["interval_minutes"] = req.interval
-    save_db(db)
+    sync_schedule(user)
     return {"status": "updated", "interval": req.interval}
 
 @app.post("/status")
 async def get_status(email: str):
-    db = load_db()
-    user = db.get(email)
-    if not user:
+    """
+    One-off status read (the popup subscribes to /status/stream instead).
+    active, last_run, next_run and interval come from the store (another
+    worker may have run the cycle); the running cycle, its recent actions
+    and last_fetch (bytes the last cycle pulled from IMAP: headers vs
+    bodies vs never fetched) from this worker's memory.
+    """
+    user = await asyncio.to_thread(store.get, email)
+    if user:
+        status_hub.refresh(user)
+    status = status_hub.get(email)
+    if status is None:
         return {"active": False}
-    
-    # Calculate next run
-    last_run_str = user.get("last_run")
-    next_run_str = "Pending..."
-    if last_run_str:
-        last_dt = datetime.datetime.fromisoformat(last_run_str)
-        interval = user.get("interval_minutes", 30)
-        next_dt = last_dt + datetime.timedelta(minutes=interval)
-        
-        # Friendly format
-        delta = next_dt - datetime.datetime.now()
-        minutes_left = int(delta.total_seconds() / 60)
-        
-        if minutes_left <= 0:
-            next_run_str = "Now/Soon"
-        else:
-            next_run_str = f"in {minutes_left} mins"
+    return status
 
-    return {
-        "active": user.get("active", False),
-        "last_run": last_run_str,
-        "next_run": next_run_str,
-        "interval": user.get("interval_minutes", 30)
-    }
+@app.get("/status/stream")
+async def stream_status(email: str):
+    """
+    Server-Sent Events for one account: a "status" snapshot on connect and
+    on every settings change, then cycle_started / action / cycle_finished
+    as cycles run.
+    """
+    if email not in status_hub:
+        raise HTTPException(status_code=404, detail="User not found")
+    return StreamingResponse(status_hub.stream(email), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/toggle")
 async def toggle_agent(req: ToggleRequest):
-    db = load_db()
-    if req.email not in db:
+    user = await asyncio.to_thread(store.update, req.email, active=req.active)
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    db[req.email]["active"] = req.active
-    save_db(db)
+    sync_schedule(user)
     return {"status": "updated", "active": req.active}
 
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """ISO 8601 date/datetime or epoch seconds -> epoch seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid time: {value}")
+
+@app.get("/history")
+async def get_history(email: str, sender: Optional[str] = None, intent: Optional[str] = None,
+                      since: Optional[str] = None, until: Optional[str] = None, q: Optional[str] = None,
+                      limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None):
+    """Newest-first interactions; pass `next_cursor` back as `cursor` for the next page."""
+    try:
+        items, next_cursor = await asyncio.to_thread(
+            history.query, email, sender=sender, intent=intent, since=parse_time(since),
+            until=parse_time(until), text=q, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/history/count")
+async def count_history(email: str, sender: Optional[str] = None, intent: Optional[str] = None,
+                        since: Optional[str] = None, until: Optional[str] = None, q: Optional[str] = None):
+    try:
+        count = await asyncio.to_thread(
+            history.count, email, sender=sender, intent=intent, since=parse_time(since), until=parse_time(until),
+            text=q
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"count": count}
+
+@app.post("/draft")
+async def draft_reply(req: DraftRequest):
+    """
+    Streams a reply draft as Server-Sent Events: "delta" events carry cleaned
+    text as it is generated, a final "done" event the timings
+    (ttft_ms, total_ms), token count and stop reason.
+    """
+    user = await asyncio.to_thread(store.get, req.email)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    intent = req.intent or classify_intent(req.text, "")["intent"]
+    payload = reply_payload(req.text, intent, decide_strategy(intent), req.sender_name)
+
+    async def events():
+        yield sse("intent", intent)
+        try:
+            # Closed by Starlette if the popup goes away, which cancels the LLM request
+            client = model_router.tier(reply_tier(intent, req.text))
+            async for event, data in astream_reply(client, payload, user["openrouter_key"]):
+                yield sse(event, data)
+        except Exception as e:
+            yield sse("error", str(e))
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/generation")
+async def generation_latency():
+    """p50/p95 time to first token and total latency of recent streamed replies."""
+    return generation_stats.summary()
+
+@app.get("/models")
+async def model_stats():
+    """Configured models with their rolling p50/p95 latency, error rate and health."""
+    return model_router.snapshot()
+
+@app.get("/outbox")
+async def outbox_stats():
+    """Queue depth by status, delivery/retry counters and enqueue-to-delivery latency."""
+    return await asyncio.to_thread(outbox_sender.metrics)
+
+@app.get("/workers")
+async def worker_stats():
+    """Live user leases per worker, plus this worker's id, running cycles and backlog."""
+    workers = await asyncio.to_thread(leases.workers)
+    return {"worker": leases.worker_id, "running": len(running_users), "backlog": len(backlog), "leases": workers}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text format: stage latency histograms, message/LLM/SMTP counters, scheduler lag."""
+    text = await asyncio.to_thread(REGISTRY.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/cache")
+async def cache_stats():
+    if llm_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **llm_cache.stats()}
+
 @app.get("/")
 def home():
     return {"message": "Email Agent API Running"}
@@ -0,0 +1,232 @@
+import os
+import time
+import bisect
+import threading
+import contextlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # tracing is optional
+    otel_trace = None
+
+# Metrics and tracing
+# Counters, gauges and histograms kept in process and rendered in the
+# Prometheus text format at GET /metrics (no client library needed). Stage
+# latencies (imap, classify, llm, smtp, cycle), messages by intent and action,
+# LLM token usage and scheduler lag are recorded on the hot path; each is a
+# dict update under a lock. With OTEL_ENABLED=1 and opentelemetry-api
+# installed (plus whatever SDK/exporter is configured), cycles and messages
+# are also traced as spans; otherwise span() is a no-op.
+
+METRICS_PREFIX = "email_agent"
+OTEL_ENABLED = os.environ.get("OTEL_ENABLED", "0") == "1"
+# Seconds; covers a sub-millisecond rule match up to a slow cycle
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelKey, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name + "_total", help, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in values]
+
+
+class Gauge(_Metric):
+    """A value that is set, or read from `callback` at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.callback = callback
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    def _samples(self) -> List[str]:
+        value = self._value
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                return []
+        return [f"{self.name} {_number(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+stage_seconds = REGISTRY.register(Histogram(
+    "stage_seconds", "Latency of each pipeline stage (imap and cycle per cycle; classify, llm, smtp per call).",
+    ["stage"]))
+messages = REGISTRY.register(Counter(
+    "messages", "Processed messages by intent and action.", ["intent", "action"]))
+llm_tokens = REGISTRY.register(Counter(
+    "llm_tokens", "LLM tokens reported in the response usage field.", ["model", "type"]))
+llm_requests = REGISTRY.register(Counter(
+    "llm_requests", "LLM requests by outcome.", ["outcome"]))
+smtp_sends = REGISTRY.register(Counter(
+    "smtp_sends", "SMTP send attempts by outcome.", ["outcome"]))
+cycles = REGISTRY.register(Counter(
+    "cycles", "Agent cycles by outcome.", ["outcome"]))
+polls = REGISTRY.register(Counter(
+    "polls", "Completed mailbox checks by whether they found new mail.", ["result"]))
+scheduler_lag_seconds = REGISTRY.register(Histogram(
+    "scheduler_lag_seconds", "Time from a user's due time to the start of their cycle.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)))
+
+
+def record_usage(response: Dict[str, Any], model: Optional[str] = None):
+    """Adds an OpenAI-style `usage` block ({"prompt_tokens", "completion_tokens"}) to llm_tokens."""
+    response = response or {}
+    usage = response.get("usage") or {}
+    model = response.get("model") or model or "unknown"
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens")
+        if tokens:
+            llm_tokens.inc(tokens, model=model, type=kind)
+
+
+# -- tracing ------------------------------------------------------------------
+
+_tracer = otel_trace.get_tracer("email_agent") if (otel_trace is not None and OTEL_ENABLED) else None
+
+
+def start_span(name: str, parent: Any = None, **attributes) -> Any:
+    """A started span (end it with end_span), or None when tracing is off."""
+    if _tracer is None:
+        return None
+    context = otel_trace.set_span_in_context(parent) if parent is not None else None
+    return _tracer.start_span(name, context=context, attributes=attributes)
+
+
+def end_span(span: Any, **attributes):
+    if span is None:
+        return
+    for key, value in attributes.items():
+        if value is not None:
+            span.set_attribute(key, value)
+    span.end()
+
+
+@contextlib.contextmanager
+def span(name: str, parent: Any = None, **attributes) -> Iterator[Any]:
+    """Runs the block in a span that is current for nested spans (no-op without tracing)."""
+    if _tracer is None:
+        yield None
+        return
+    current = start_span(name, parent, **attributes)
+    with otel_trace.use_span(current, end_on_exit=True):
+        yield current
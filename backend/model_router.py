@@ -0,0 +1,305 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from llm_client import LLMClient, LLMError
+
+# Multi-model routing
+# LLM_MODELS is an ordered list of models, optionally weighted
+# ("model-a:2,model-b"). Each request goes to the healthy model with the
+# lowest p50 latency divided by its weight; a model that keeps failing is
+# benched for ROUTER_COOLDOWN seconds, then probed again. If the chosen model hasn't
+# answered (or, when streaming, sent its first token) within the hedge
+# deadline, the request is also sent to the runner-up and the first answer
+# wins; the loser is cancelled. Replies to simple intents or short mails
+# use the "cheap" tier, which tries LLM_CHEAP_MODELS first.
+
+DEFAULT_MODEL = "mistralai/mistral-7b-instruct"
+LLM_MODELS = os.environ.get("LLM_MODELS", DEFAULT_MODEL)
+LLM_CHEAP_MODELS = os.environ.get("LLM_CHEAP_MODELS", "")
+# Hedge after the primary's p95 (never sooner than LLM_HEDGE_MIN_MS); LLM_HEDGE_DEFAULT_MS until it has history
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "1") != "0"
+LLM_HEDGE_MIN_MS = float(os.environ.get("LLM_HEDGE_MIN_MS", 1500))
+LLM_HEDGE_DEFAULT_MS = float(os.environ.get("LLM_HEDGE_DEFAULT_MS", 8000))
+ROUTER_WINDOW = int(os.environ.get("ROUTER_WINDOW", 100))
+ROUTER_MIN_SAMPLES = 5
+ROUTER_MAX_ERROR_RATE = float(os.environ.get("ROUTER_MAX_ERROR_RATE", 0.5))
+ROUTER_FAILURE_LIMIT = int(os.environ.get("ROUTER_FAILURE_LIMIT", 3))
+ROUTER_COOLDOWN = float(os.environ.get("ROUTER_COOLDOWN", 30))
+
+DEFAULT_TIER = "default"
+CHEAP_TIER = "cheap"
+LLM_CHEAP_INTENTS = {i.strip() for i in os.environ.get("LLM_CHEAP_INTENTS", "General,Meeting Request").split(",")}
+LLM_CHEAP_MAX_CHARS = int(os.environ.get("LLM_CHEAP_MAX_CHARS", 280))
+
+
+def parse_models(spec: str) -> List[Tuple[str, float]]:
+    """'a:2, b' -> [("a", 2.0), ("b", 1.0)]; a weight is a trailing ':<number>'."""
+    models = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.rpartition(":")
+        try:
+            models.append((name, float(weight)) if name else (item, 1.0))
+        except ValueError:
+            # "vendor/model:free" style suffixes are part of the name
+            models.append((item, 1.0))
+    return models
+
+
+def reply_tier(intent: str, email_text: str) -> str:
+    """Simple intents and short mails don't need the primary model."""
+    if intent in LLM_CHEAP_INTENTS or len((email_text or "").strip()) <= LLM_CHEAP_MAX_CHARS:
+        return CHEAP_TIER
+    return DEFAULT_TIER
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class ModelStats:
+    """Rolling latency and outcome window for one model and request kind."""
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)   # True = success
+        self.consecutive_failures = 0
+        self.last_failure = 0.0
+
+    def success(self, latency: float):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+
+    def censored(self, elapsed: float):
+        """A cancelled (hedged-out) request: its latency was at least `elapsed`."""
+        self.latencies.append(elapsed)
+
+    def failure(self, now: Optional[float] = None):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self.last_failure = time.time() if now is None else now
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def p(self, q: float) -> Optional[float]:
+        return percentile(list(self.latencies), q)
+
+    def healthy(self, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        if now - self.last_failure >= ROUTER_COOLDOWN:
+            # Benched models get probed again once the cooldown has passed
+            return True
+        failing = self.consecutive_failures >= ROUTER_FAILURE_LIMIT
+        erroring = len(self.outcomes) >= ROUTER_MIN_SAMPLES and self.error_rate > ROUTER_MAX_ERROR_RATE
+        return not (failing or erroring)
+
+    def as_dict(self) -> Dict[str, Any]:
+        p50, p95 = self.p(0.5), self.p(0.95)
+        return {
+            "requests": len(self.outcomes),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "healthy": self.healthy(),
+        }
+
+
+class ModelRouter:
+    """
+    Picks, hedges and fails over between models for LLMClient requests.
+    Same chat/stream methods as LLMClient, plus a `tier` argument; the
+    payload's "model" is filled in per attempt.
+    """
+
+    def __init__(self, client: LLMClient, models: Optional[List[Tuple[str, float]]] = None,
+                 cheap_models: Optional[List[Tuple[str, float]]] = None, hedge: bool = LLM_HEDGE):
+        self.client = client
+        self.models = models or parse_models(LLM_MODELS) or [(DEFAULT_MODEL, 1.0)]
+        self.cheap_models = parse_models(LLM_CHEAP_MODELS) if cheap_models is None else cheap_models
+        self.hedge = hedge
+        # ("chat" | "stream", model) -> stats; a stream's latency is its time to first token
+        self._stats: Dict[Tuple[str, str], ModelStats] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self) -> str:
+        return self.models[0][0]
+
+    def tier_models(self, tier: str = DEFAULT_TIER) -> str:
+        """Every model a request in `tier` may be answered by, for cache keys."""
+        names = [name for name, _ in self.models]
+        if tier == CHEAP_TIER:
+            names += [name for name, _ in self.cheap_models]
+        return ",".join(sorted(set(names)))
+
+    def stats(self, kind: str, model: str) -> ModelStats:
+        with self._lock:
+            stats = self._stats.get((kind, model))
+            if stats is None:
+                stats = self._stats[(kind, model)] = ModelStats()
+            return stats
+
+    def _rank(self, kind: str, models: List[Tuple[str, float]], now: float) -> List[str]:
+        def key(item):
+            index, (name, weight) = item
+            stats = self.stats(kind, name)
+            p50 = stats.p(0.5)
+            # Unmeasured models go first (in list order) so each gets measured
+            return (not stats.healthy(now), p50 / max(weight, 1e-6) if p50 is not None else 0.0, index)
+        return [name for _, (name, _) in sorted(enumerate(models), key=key)]
+
+    def candidates(self, tier: str = DEFAULT_TIER, kind: str = "chat") -> List[str]:
+        """Models to try for a request, best first."""
+        now = time.time()
+        ranked = self._rank(kind, self.models, now)
+        if tier == CHEAP_TIER and self.cheap_models:
+            cheap = [m for m in self._rank(kind, self.cheap_models, now) if self.stats(kind, m).healthy(now)]
+            ranked = cheap + [m for m in ranked if m not in cheap]
+        return ranked
+
+    def hedge_delay(self, kind: str, model: str) -> float:
+        stats = self.stats(kind, model)
+        if len(stats.latencies) < ROUTER_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_MS / 1000
+        return max(stats.p(0.95), LLM_HEDGE_MIN_MS / 1000)
+
+    async def _race(self, kind: str, models: List[str], attempt: Callable[[str, Optional[int], Callable[[], bool]], Any]):
+        """
+        Runs attempt(model, max_retries, commit) on the best model, hedging to
+        the next one after its deadline and falling over to it on errors.
+        An attempt calls commit() when its output starts flowing (streams);
+        from then on it is the only one that may finish. Attempts that lose
+        record their time so far as a censored latency sample, so a slow
+        model's percentiles aren't made of its few fast answers.
+        """
+        remaining = list(models)
+        pending: Dict[asyncio.Future, str] = {}
+        started: Dict[str, float] = {}
+        abandoned = set()
+        winner: Optional[str] = None
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def abandon(task: asyncio.Future, model: str):
+            if task not in abandoned and not task.done():
+                abandoned.add(task)
+                task.cancel()
+                self.stats(kind, model).censored(time.perf_counter() - started[model])
+
+        def launch():
+            model = remaining.pop(0)
+            started[model] = time.perf_counter()
+
+            def commit() -> bool:
+                nonlocal winner
+                if winner is None:
+                    winner = model
+                    self.stats(kind, model).success(time.perf_counter() - started[model])
+                    for task, other in pending.items():
+                        if other != model:
+                            abandon(task, other)
+                return winner == model
+
+            # Fail over instead of backing off while there is another model to try
+            retries = 0 if remaining else None
+            pending[asyncio.ensure_future(attempt(model, retries, commit))] = model
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and winner is None and remaining:
+                    first = next(iter(pending.values()))
+                    timeout = max(self.hedge_delay(kind, first) - (time.perf_counter() - started[first]), 0)
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+                for task in done:
+                    model = pending.pop(task)
+                    if task.cancelled():
+                        continue
+                    error = task.exception()
+                    if error is None:
+                        if winner is None:
+                            # Plain completions commit when they finish
+                            self.stats(kind, model).success(time.perf_counter() - started[model])
+                        if winner in (None, model):
+                            return task.result()
+                        continue
+                    self.stats(kind, model).failure()
+                    last_error = error
+                    if winner == model:
+                        # Broke mid-stream; its output is already out
+                        raise error
+                    if not pending and remaining:
+                        launch()
+        finally:
+            for task, model in pending.items():
+                abandon(task, model)
+        raise last_error or LLMError("No model available")
+
+    async def _chat(self, payload: Dict[str, Any], api_key: str, tier: str) -> Dict[str, Any]:
+        async def attempt(model, retries, commit):
+            return await self.client._chat({**payload, "model": model}, api_key, retries)
+        return await self._race("chat", self.candidates(tier, "chat"), attempt)
+
+    async def _stream(self, payload: Dict[str, Any], api_key: str, emit: Callable[[str], None], tier: str):
+        async def attempt(model, retries, commit):
+            await self.client._stream({**payload, "model": model}, api_key,
+                                      lambda delta: commit() and emit(delta), retries)
+        await self._race("stream", self.candidates(tier, "stream"), attempt)
+
+    async def chat(self, payload: Dict[str, Any], api_key: str, tier: str = DEFAULT_TIER) -> Dict[str, Any]:
+        return await asyncio.wrap_future(self.client.submit(self._chat(payload, api_key, tier)))
+
+    def chat_sync(self, payload: Dict[str, Any], api_key: str, tier: str = DEFAULT_TIER) -> Dict[str, Any]:
+        return self.client.submit(self._chat(payload, api_key, tier)).result()
+
+    def stream_sync(self, payload: Dict[str, Any], api_key: str, tier: str = DEFAULT_TIER) -> Iterator[str]:
+        return self.client.iter_sync(lambda emit: self._stream(payload, api_key, emit, tier))
+
+    def stream(self, payload: Dict[str, Any], api_key: str, tier: str = DEFAULT_TIER) -> AsyncIterator[str]:
+        return self.client.iter_async(lambda emit: self._stream(payload, api_key, emit, tier))
+
+    def tier(self, tier: str) -> "RoutedClient":
+        """An LLMClient look-alike bound to one tier (for reply_stream.stream_reply)."""
+        return RoutedClient(self, tier)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            "models": [name for name, _ in self.models],
+            "cheap_models": [name for name, _ in self.cheap_models],
+            "hedge": self.hedge,
+            "stats": {f"{kind}:{model}": s.as_dict() for (kind, model), s in sorted(stats.items())},
+        }
+
+
+class RoutedClient:
+    def __init__(self, router: ModelRouter, tier: str):
+        self.router = router
+        self.tier = tier
+
+    def chat_sync(self, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        return self.router.chat_sync(payload, api_key, self.tier)
+
+    def stream_sync(self, payload: Dict[str, Any], api_key: str) -> Iterator[str]:
+        return self.router.stream_sync(payload, api_key, self.tier)
+
+    def stream(self, payload: Dict[str, Any], api_key: str) -> AsyncIterator[str]:
+        return self.router.stream(payload, api_key, self.tier)
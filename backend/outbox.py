@@ -0,0 +1,326 @@
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import itertools
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Durable outbound queue
+# Every generated reply is written to SQLite before it is sent, keyed by an
+# idempotency key derived from the original Message-ID, so a reply survives
+# SMTP failures and crashes and is never queued twice for the same mail.
+# The cycle's send stage makes the first delivery attempt; OutboxSender.run()
+# retries the rest with exponential backoff, under a per-account rate limit.
+# Entries being sent are leased, so one left behind by a crash is picked up
+# again once its lease runs out.
+
+OUTBOX_DB = os.environ.get("OUTBOX_DB", "outbox.db")  # "" keeps the queue in memory (tests)
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_RETRY_BASE = float(os.environ.get("OUTBOX_RETRY_BASE", 30))
+OUTBOX_RETRY_MAX = float(os.environ.get("OUTBOX_RETRY_MAX", 3600))
+OUTBOX_RATE_PER_MINUTE = float(os.environ.get("OUTBOX_RATE_PER_MINUTE", 20))
+OUTBOX_LEASE_SECONDS = float(os.environ.get("OUTBOX_LEASE_SECONDS", 120))
+OUTBOX_POLL_SECONDS = float(os.environ.get("OUTBOX_POLL_SECONDS", 30))
+OUTBOX_BATCH = 50
+
+_memory_ids = itertools.count()
+
+
+def normalize_message_id(message_id: str) -> str:
+    return (message_id or "").strip().strip("<>").strip().lower()
+
+
+def idempotency_key(user_email: str, message_id: str, *fallback: str) -> str:
+    """
+    Stable key for "the reply to this mail": the account plus the original
+    Message-ID, or the fallback fields (sender, subject, body) when it has none.
+    """
+    mid = normalize_message_id(message_id)
+    source = f"mid:{mid}" if mid else "fields:" + "\x00".join(fallback)
+    return hashlib.sha256(f"{user_email.lower()}\x00{source}".encode("utf-8", "replace")).hexdigest()[:40]
+
+
+def reply_message_id(key: str, user_email: str) -> str:
+    """The reply's own Message-ID, derived from the key so a resend is recognizably the same mail."""
+    domain = user_email.rpartition("@")[2] or "localhost"
+    return f"<reply.{key[:32]}@{domain}>"
+
+
+def references_for(message_id: str, references: str = "") -> str:
+    """References header for a reply: the parent's References plus its Message-ID."""
+    ids = references.split()
+    if message_id and message_id not in ids:
+        ids.append(message_id.strip())
+    # RFC 5322 lets long threads be trimmed; keep the root and the latest ids
+    if len(ids) > 20:
+        ids = ids[:1] + ids[-19:]
+    return " ".join(ids)
+
+
+class RateLimiter:
+    """Token bucket per account: `rate_per_minute` sends, bursts up to the same number."""
+
+    def __init__(self, rate_per_minute: float = OUTBOX_RATE_PER_MINUTE):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(rate_per_minute, 1.0)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, now: Optional[float] = None) -> float:
+        """Takes a token and returns 0, or returns how long to wait for one."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+
+class Outbox:
+    COLUMNS = ["id", "user_email", "idem_key", "to_addr", "subject", "body", "in_reply_to", "refs",
+               "message_id", "status", "attempts", "next_attempt_at", "lease_until", "created_at",
+               "sent_at", "last_error"]
+
+    def __init__(self, path: Optional[str] = OUTBOX_DB):
+        self.path = path or f"file:outbox-{next(_memory_ids)}?mode=memory&cache=shared"
+        self._uri = not path
+        self._local = threading.local()
+        # Keeps a shared in-memory database alive for the Outbox's lifetime
+        self._keepalive = self._conn() if self._uri else None
+        self._ensure_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Per-thread connections, as in user_store.SQLiteUserStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, uri=self._uri)
+            conn.row_factory = sqlite3.Row
+            if not self._uri:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY, user_email TEXT NOT NULL, idem_key TEXT NOT NULL, "
+            "to_addr TEXT NOT NULL, subject TEXT, body TEXT NOT NULL, in_reply_to TEXT, refs TEXT, "
+            "message_id TEXT, status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, lease_until REAL, created_at REAL NOT NULL, sent_at REAL, "
+            "last_error TEXT, UNIQUE (user_email, idem_key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
+
+    def _write(self, sql: str, params: Tuple = ()) -> sqlite3.Cursor:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(sql, params)
+            conn.execute("COMMIT")
+            return cur
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, user_email: str, key: str, to_addr: str, subject: str, body: str,
+                in_reply_to: str = "", refs: str = "", now: Optional[float] = None) -> Tuple[Dict[str, Any], bool]:
+        """Queues a reply unless one with this key exists. Returns (entry, newly_queued)."""
+        now = time.time() if now is None else now
+        cur = self._write(
+            "INSERT OR IGNORE INTO outbox (user_email, idem_key, to_addr, subject, body, in_reply_to, refs, "
+            "message_id, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_email, key, to_addr, subject, body, in_reply_to, refs, reply_message_id(key, user_email), now, now),
+        )
+        entry = self.get_by_key(user_email, key)
+        return entry, cur.rowcount == 1
+
+    def get(self, entry_id: int) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_by_key(self, user_email: str, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT * FROM outbox WHERE user_email = ? AND idem_key = ?", (user_email, key)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, now: Optional[float] = None, limit: int = OUTBOX_BATCH,
+              entry_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Leases due entries (pending and due, or sending with an expired lease)
+        so no other sender picks them up. `entry_id` claims just that one.
+        """
+        now = time.time() if now is None else now
+        due = "((status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until < ?))"
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if entry_id is not None:
+                rows = conn.execute(f"SELECT * FROM outbox WHERE id = ? AND {due}", (entry_id, now, now)).fetchall()
+            else:
+                rows = conn.execute(
+                    f"SELECT * FROM outbox WHERE {due} ORDER BY next_attempt_at LIMIT ?", (now, now, limit)
+                ).fetchall()
+            conn.executemany("UPDATE outbox SET status = 'sending', lease_until = ? WHERE id = ?",
+                             [(now + OUTBOX_LEASE_SECONDS, row["id"]) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [dict(row, status="sending") for row in rows]
+
+    def mark_sent(self, entry_id: int, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        self._write("UPDATE outbox SET status = 'sent', sent_at = ?, attempts = attempts + 1, lease_until = NULL, "
+                    "last_error = NULL WHERE id = ?", (now, entry_id))
+
+    def mark_failed(self, entry_id: int, error: str, now: Optional[float] = None) -> str:
+        """Schedules a retry with exponential backoff, or gives up after OUTBOX_MAX_ATTEMPTS. Returns the new status."""
+        now = time.time() if now is None else now
+        entry = self.get(entry_id)
+        attempts = entry["attempts"] + 1
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            status, next_at = "failed", now
+        else:
+            status, next_at = "pending", now + min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+        self._write("UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, lease_until = NULL, "
+                    "last_error = ? WHERE id = ?", (status, attempts, next_at, error[:500], entry_id))
+        return status
+
+    def defer(self, entry_id: int, until: float):
+        """Puts a claimed entry back without counting an attempt (rate limited)."""
+        self._write("UPDATE outbox SET status = 'pending', next_attempt_at = ?, lease_until = NULL WHERE id = ?",
+                    (until, entry_id))
+
+    def next_due(self) -> Optional[float]:
+        row = self._conn().execute(
+            "SELECT MIN(CASE WHEN status = 'pending' THEN next_attempt_at ELSE lease_until END) "
+            "FROM outbox WHERE status IN ('pending', 'sending')"
+        ).fetchone()
+        return row[0]
+
+    def depth(self) -> Dict[str, Any]:
+        counts = {status: n for status, n in
+                  self._conn().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")}
+        oldest = self._conn().execute(
+            "SELECT MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')"
+        ).fetchone()[0]
+        return {
+            "pending": counts.get("pending", 0),
+            "sending": counts.get("sending", 0),
+            "sent": counts.get("sent", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_pending_age_s": round(time.time() - oldest, 1) if oldest else None,
+        }
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and conn is not self._keepalive:
+            conn.close()
+            self._local.conn = None
+
+
+class OutboxSender:
+    """
+    Delivers outbox entries through `send(entry, app_password) -> bool`.
+    deliver() is the single-entry path the cycle uses right after queueing;
+    run() is the background worker for retries and anything left behind.
+    """
+
+    def __init__(self, outbox: Outbox, send: Callable[[Dict[str, Any], str], bool],
+                 rate_per_minute: float = OUTBOX_RATE_PER_MINUTE):
+        self.outbox = outbox
+        self.send = send
+        self.limiter = RateLimiter(rate_per_minute)
+        self.latencies = deque(maxlen=500)   # seconds from enqueue to delivery
+        self.delivered = 0
+        self.retries = 0
+        self.dead = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def deliver(self, entry: Dict[str, Any], app_pass: Optional[str], now: Optional[float] = None) -> bool:
+        """One attempt at a claimed entry. True when it was sent."""
+        now = time.time() if now is None else now
+        if not app_pass:
+            self._failed(entry, "No credentials for account", now)
+            return False
+        wait = self.limiter.acquire(entry["user_email"], now)
+        if wait:
+            self.outbox.defer(entry["id"], now + wait)
+            return False
+        try:
+            sent = self.send(entry, app_pass)
+            error = None if sent else "SMTP send failed"
+        except Exception as e:
+            sent, error = False, str(e)
+        if sent:
+            self.outbox.mark_sent(entry["id"], time.time())
+            self.latencies.append(time.time() - entry["created_at"])
+            self.delivered += 1
+            return True
+        self._failed(entry, error, now)
+        return False
+
+    def _failed(self, entry: Dict[str, Any], error: str, now: float):
+        if self.outbox.mark_failed(entry["id"], error, now) == "failed":
+            self.dead += 1
+            print(f"📪 Giving up on reply to {entry['to_addr']} ({entry['user_email']}): {error}")
+        else:
+            self.retries += 1
+
+    def drain(self, credentials: Callable[[str], Optional[str]], now: Optional[float] = None) -> int:
+        """Delivers everything due; returns how many were sent."""
+        sent = 0
+        for entry in self.outbox.claim(now):
+            sent += self.deliver(entry, credentials(entry["user_email"]), now)
+        return sent
+
+    def wake(self):
+        """Thread-safe nudge for run() (something was queued for retry)."""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def run(self, credentials: Callable[[str], Optional[str]]):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.to_thread(self.drain, credentials)
+            except Exception as e:
+                print(f"❌ Outbox worker error: {e}")
+            next_due = await asyncio.to_thread(self.outbox.next_due)
+            delay = OUTBOX_POLL_SECONDS if next_due is None else min(max(next_due - time.time(), 0.05),
+                                                                     OUTBOX_POLL_SECONDS)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def metrics(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def pick(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000, 1)
+
+        return {
+            "depth": self.outbox.depth(),
+            "delivered": self.delivered,
+            "retries_scheduled": self.retries,
+            "dead_lettered": self.dead,
+            "delivery_latency_ms": {"p50": pick(0.5), "p95": pick(0.95)},
+        }
@@ -0,0 +1,46 @@
+import os
+from typing import Any, Dict, Optional
+
+# Adaptive polling intervals
+# With ADAPTIVE_POLLING=1 an account's next check follows its mail instead
+# of a fixed interval_minutes. An EWMA of the arrival rate (new messages
+# per minute between checks) picks the interval expected to find about
+# POLL_TARGET_MESSAGES new messages, never longer than the account's own
+# interval while mail is arriving. Each consecutive empty check doubles the
+# interval up to POLL_MAX_MINUTES, and a check that had to leave mail
+# behind comes back after POLL_MIN_MINUTES.
+
+ADAPTIVE_POLLING = os.environ.get("ADAPTIVE_POLLING", "0") == "1"
+POLL_MIN_MINUTES = float(os.environ.get("POLL_MIN_MINUTES", 2))
+POLL_MAX_MINUTES = float(os.environ.get("POLL_MAX_MINUTES", 240))
+POLL_TARGET_MESSAGES = float(os.environ.get("POLL_TARGET_MESSAGES", 3))
+# Weight of the latest check in the arrival-rate EWMA
+POLL_RATE_ALPHA = float(os.environ.get("POLL_RATE_ALPHA", 0.3))
+
+
+def next_poll(user: Dict[str, Any], arrivals: int, elapsed_minutes: Optional[float],
+              backlog: bool = False) -> Dict[str, Any]:
+    """
+    The polling fields to store after a check that found `arrivals` new
+    messages `elapsed_minutes` after the previous one (None for the first
+    check). `backlog` means the check stopped with mail still pending.
+    Returns {"arrival_rate", "empty_cycles", "poll_interval"}.
+    """
+    base = max(float(user.get("interval_minutes") or POLL_MIN_MINUTES), POLL_MIN_MINUTES)
+    previous = user.get("poll_interval") or base
+    rate = user.get("arrival_rate") or 0.0
+    if elapsed_minutes:
+        sample = arrivals / elapsed_minutes
+        rate = sample if not user.get("poll_interval") else POLL_RATE_ALPHA * sample + (1 - POLL_RATE_ALPHA) * rate
+    empty_cycles = 0 if arrivals else (user.get("empty_cycles") or 0) + 1
+
+    if backlog:
+        interval = POLL_MIN_MINUTES
+    elif arrivals:
+        interval = POLL_TARGET_MESSAGES / rate if rate > 0 else base
+        interval = min(max(interval, POLL_MIN_MINUTES), base)
+    else:
+        # Exponential backoff while the inbox stays idle
+        interval = min(previous * 2, POLL_MAX_MINUTES)
+    return {"arrival_rate": round(rate, 6), "empty_cycles": empty_cycles,
+            "poll_interval": round(max(interval, POLL_MIN_MINUTES), 2)}
@@ -0,0 +1,315 @@
+import os
+import re
+import time
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+# Streaming reply generation
+# Replies are requested as an SSE stream and cleaned as they arrive: <s>
+# tags, "Subject:" lines and "[Your Company Name]" placeholders never reach
+# the output, and generation is cut off at the sign-off, at anything that
+# looks like the model starting a second draft or echoing the prompt, or
+# after REPLY_MAX_TOKENS chunks. Breaking out of the stream closes the
+# connection, so the provider stops generating (and billing) right there.
+
+REPLY_MAX_TOKENS = int(os.environ.get("REPLY_MAX_TOKENS", 300))
+REPLY_SIGN_OFF = os.environ.get("REPLY_SIGN_OFF", "AI Agent")
+# Recent generations kept for the p50/p95 latency summary
+GENERATION_STATS_WINDOW = int(os.environ.get("GENERATION_STATS_WINDOW", 200))
+
+# A line starting like this means the reply is over (role labels, prompt echo, separators)
+STOP_LINES = re.compile(
+    r"^(?:(?:user|assistant|system|human)\s*:|incoming email body\b|draft a reply\b"
+    r"|(?:alternative|another|second) (?:reply|response|version)\b|-{3,}$|={3,}$)",
+    re.I,
+)
+# Chat-template and end-of-sequence markers; nothing after them is reply text
+_INLINE_STOP = re.compile(r"</s>|\[/?INST\]|<\|[a-z_]+\|>", re.I)
+_PLACEHOLDER = re.compile(r"[ \t]*\[(?:your|insert|recipient|sender|company|name|date|time)\b[^\]\n]*\]", re.I)
+# Line starts held back until the line is complete, since they may turn into something dropped
+_HOLD_PREFIXES = ("subject:", "user:", "assistant:", "system:", "human:", "incoming email body",
+                  "draft a reply", "alternative", "another", "second", "---", "===")
+# A "[" or "<" this close to the end may still become a placeholder or a marker
+_HOLD_BRACKET = 32
+
+
+class ReplyFilter:
+    """
+    Incremental cleaner for a streamed reply. feed() each delta and emit
+    what it returns; once `stop_reason` is set the rest of the stream can
+    be dropped. finish() returns whatever was held back at the end.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, sign_off: Optional[str] = None):
+        self.max_tokens = REPLY_MAX_TOKENS if max_tokens is None else max_tokens
+        self.sign_off = (REPLY_SIGN_OFF if sign_off is None else sign_off).lower()
+        self.tokens = 0
+        self.stop_reason: Optional[str] = None
+        self.parts: List[str] = []
+        self._buf = ""           # unreleased text of the current line
+        self._line_open = False  # part of the current line already emitted
+        self._gap = ""           # trailing whitespace/quote held until more text follows
+        self._started = False
+        self._quoted = False
+
+    @property
+    def done(self) -> bool:
+        return self.stop_reason is not None
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def feed(self, delta: str) -> str:
+        if self.done:
+            return ""
+        # Providers send about one token per SSE chunk
+        self.tokens += 1
+        self._buf += delta.replace("\r", "")
+        out = []
+        while "\n" in self._buf and not self.done:
+            line, self._buf = self._buf.split("\n", 1)
+            text = self._complete_line(line)
+            if text is None:
+                # Dropped lines take their line break with them
+                self._line_open = False
+                continue
+            out.append(text)
+            if not self.done:
+                self._newline()
+        if not self.done:
+            out.append(self._partial())
+        if not self.done and self.max_tokens and self.tokens >= self.max_tokens:
+            self.stop_reason = "max_tokens"
+        return "".join(out)
+
+    def finish(self) -> str:
+        out = ""
+        if self.stop_reason in (None, "max_tokens") and self._buf:
+            out = self._complete_line(self._buf) or ""
+        self._buf = ""
+        if self.stop_reason is None:
+            self.stop_reason = "complete"
+        tail = self._gap.rstrip()
+        if self._quoted and tail.endswith('"'):
+            tail = tail[:-1]
+        self._gap = ""
+        if tail.strip():
+            self.parts.append(tail)
+            out += tail
+        return out
+
+    # -- internals --
+
+    def _complete_line(self, line: str) -> Optional[str]:
+        """Cleaned text of a finished line, or None when the whole line is dropped."""
+        text, stopped = _clean(line)
+        if not self._line_open and not text.strip() and line.strip() and not stopped:
+            # The line was nothing but a placeholder ("[Your Name]")
+            return None
+        if not self._line_open:
+            rule = self._line_rule(text)
+            if rule == "drop":
+                return None
+            if rule == "stop":
+                self.stop_reason = "stop_pattern"
+                return ""
+            if rule == "sign_off":
+                out = self._emit(text.rstrip().rstrip('"') if self._quoted else text)
+                self.stop_reason = "sign_off"
+                return out
+        self._line_open = False
+        out = self._emit(text)
+        if stopped:
+            self.stop_reason = "stop_pattern"
+        return out
+
+    def _partial(self) -> str:
+        buf = self._buf
+        if not self._line_open and self._may_match_rule(buf):
+            return ""
+        cut = len(buf)
+        for bracket, closing in (("[", "]"), ("<", ">")):
+            at = buf.rfind(bracket)
+            if at >= 0 and closing not in buf[at:] and len(buf) - at < _HOLD_BRACKET:
+                cut = min(cut, at)
+        if cut < len(buf):
+            # ...with the space before it, which goes if the placeholder does
+            cut = len(buf[:cut].rstrip(" \t"))
+        if cut == 0:
+            return ""
+        text, stopped = _clean(buf[:cut])
+        if not text.strip() and not stopped and not self._line_open:
+            # Nothing visible yet; keep the line whole so a placeholder-only line can be dropped
+            return ""
+        self._buf = buf[cut:]
+        self._line_open = True
+        out = self._emit(text)
+        if stopped:
+            self.stop_reason = "stop_pattern"
+        return out
+
+    def _line_start(self, text: str) -> str:
+        text = text.replace("<s>", "").strip().lower()
+        return text.lstrip('"').lstrip() if not self._started else text
+
+    def _line_rule(self, text: str) -> Optional[str]:
+        start = self._line_start(text)
+        if start.startswith("subject:"):
+            return "drop"
+        if STOP_LINES.match(start):
+            return "stop"
+        if self.sign_off and start.rstrip('".,!').strip() == self.sign_off:
+            return "sign_off"
+        return None
+
+    def _may_match_rule(self, buf: str) -> bool:
+        start = self._line_start(buf)
+        if not start:
+            return True
+        prefixes = _HOLD_PREFIXES + ((self.sign_off,) if self.sign_off else ())
+        return any(p.startswith(start) or start.startswith(p) for p in prefixes)
+
+    def _newline(self):
+        self._line_open = False
+        if self._started:
+            self._gap += "\n"
+
+    def _emit(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+            if text.startswith('"'):
+                self._quoted = True
+                text = text[1:].lstrip()
+        elif self._gap.endswith((" ", "\t")):
+            # The space before a dropped placeholder was already held back
+            text = text.lstrip(" \t")
+        body = text.rstrip(' \t"')
+        if not body:
+            if self._started:
+                self._gap += text
+            return ""
+        # At most one blank line between paragraphs
+        gap = re.sub(r"\n[ \t\"]*\n(?:[ \t\"]*\n)+", "\n\n", self._gap) if self._started else ""
+        out = gap + body
+        self._gap = text[len(body):]
+        self._started = True
+        self.parts.append(out)
+        return out
+
+
+def _clean(text: str) -> Tuple[str, bool]:
+    """Drops <s> tags and placeholders; cuts at an inline stop marker."""
+    stopped = False
+    m = _INLINE_STOP.search(text)
+    if m:
+        text, stopped = text[:m.start()], True
+    text = _PLACEHOLDER.sub("", text.replace("<s>", ""))
+    return text, stopped
+
+
+class GenerationStats:
+    """Time to first token and total latency of the last N streamed replies."""
+
+    def __init__(self, window: int = GENERATION_STATS_WINDOW):
+        self._ttft = deque(maxlen=window)
+        self._total = deque(maxlen=window)
+        self._stops: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, metrics: Dict[str, Any]):
+        with self._lock:
+            if metrics.get("ttft_ms") is not None:
+                self._ttft.append(metrics["ttft_ms"])
+            self._total.append(metrics["total_ms"])
+            reason = metrics.get("stop_reason", "complete")
+            self._stops[reason] = self._stops.get(reason, 0) + 1
+
+    @staticmethod
+    def _percentile(values: List[float], q: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 1)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            ttft, total, stops = list(self._ttft), list(self._total), dict(self._stops)
+        return {
+            "replies": len(total),
+            "ttft_ms": {"p50": self._percentile(ttft, 0.5), "p95": self._percentile(ttft, 0.95)},
+            "total_ms": {"p50": self._percentile(total, 0.5), "p95": self._percentile(total, 0.95)},
+            "stop_reasons": stops,
+        }
+
+
+# Shared by the agent cycles and /draft
+generation_stats = GenerationStats()
+
+
+def _metrics(started: float, first: Optional[float], reply_filter: ReplyFilter) -> Dict[str, Any]:
+    now = time.perf_counter()
+    metrics = {
+        "ttft_ms": round((first - started) * 1000, 1) if first is not None else None,
+        "total_ms": round((now - started) * 1000, 1),
+        "tokens": reply_filter.tokens,
+        "stop_reason": reply_filter.stop_reason,
+    }
+    generation_stats.record(metrics)
+    return metrics
+
+
+def stream_reply(client, payload: Dict[str, Any], api_key: str, max_tokens: Optional[int] = None,
+                 on_delta: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Streams a reply through ReplyFilter, stopping the request as soon as the
+    filter is done. Returns {"reply", "ttft_ms", "total_ms", "tokens", "stop_reason"}.
+    """
+    reply_filter = ReplyFilter(max_tokens)
+    if reply_filter.max_tokens:
+        payload = {**payload, "max_tokens": reply_filter.max_tokens}
+    started, first = time.perf_counter(), None
+    deltas = client.stream_sync(payload, api_key)
+    try:
+        for delta in deltas:
+            if first is None:
+                first = time.perf_counter()
+            out = reply_filter.feed(delta)
+            if out and on_delta:
+                on_delta(out)
+            if reply_filter.done:
+                break
+    finally:
+        deltas.close()
+    out = reply_filter.finish()
+    if out and on_delta:
+        on_delta(out)
+    return {"reply": reply_filter.text(), **_metrics(started, first, reply_filter)}
+
+
+async def astream_reply(client, payload: Dict[str, Any], api_key: str,
+                        max_tokens: Optional[int] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Async stream_reply() for SSE endpoints: yields ("delta", text) events as
+    cleaned text becomes available, then one ("done", metrics) event.
+    """
+    reply_filter = ReplyFilter(max_tokens)
+    if reply_filter.max_tokens:
+        payload = {**payload, "max_tokens": reply_filter.max_tokens}
+    started, first = time.perf_counter(), None
+    deltas = client.stream(payload, api_key)
+    try:
+        async for delta in deltas:
+            if first is None:
+                first = time.perf_counter()
+            out = reply_filter.feed(delta)
+            if out:
+                yield "delta", out
+            if reply_filter.done:
+                break
+    finally:
+        await deltas.aclose()
+    out = reply_filter.finish()
+    if out:
+        yield "delta", out
+    yield "done", _metrics(started, first, reply_filter)
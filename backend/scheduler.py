@@ -0,0 +1,82 @@
+import time
+import heapq
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Due-time scheduler
+# Keeps a min-heap of (next_due_at, email) and sleeps until the earliest
+# deadline, so each wakeup only touches the users that are actually due.
+
+RETRY_DELAY_SECONDS = 60
+
+
+class DueScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        # Authoritative due time per user; heap entries that disagree are stale
+        # and get dropped when popped (lazy deletion).
+        self._due: Dict[str, float] = {}
+        # Due times of users handed out by pop_due, for measuring scheduling lag
+        self.popped_due: Dict[str, float] = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._due)
+
+    def load(self, schedule: List[Tuple[str, float]]):
+        """Bulk-loads (email, next_due_at) pairs, e.g. from the user store at startup."""
+        self._due = dict(schedule)
+        self._heap = [(due, email) for email, due in self._due.items()]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def reschedule(self, email: str, due_at: float):
+        """Sets (or moves) a user's next due time. O(log n)."""
+        if self._due.get(email) == due_at:
+            return
+        self._due[email] = due_at
+        heapq.heappush(self._heap, (due_at, email))
+        if self._heap[0] == (due_at, email):
+            self._wakeup.set()
+
+    def remove(self, email: str):
+        self._due.pop(email, None)
+
+    def next_deadline(self) -> Optional[float]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[str]:
+        """Removes and returns every user whose due time has passed."""
+        due = []
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= now:
+            due_at, email = heapq.heappop(self._heap)
+            del self._due[email]
+            self.popped_due[email] = due_at
+            due.append(email)
+            self._drop_stale()
+        return due
+
+    def _drop_stale(self):
+        while self._heap:
+            due_at, email = self._heap[0]
+            if self._due.get(email) == due_at:
+                return
+            heapq.heappop(self._heap)
+
+    async def run(self, callback: Callable[[List[str]], Awaitable[None]]):
+        """Sleeps until the earliest deadline (or a reschedule) and hands due users to `callback`."""
+        while True:
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            self._wakeup.clear()
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            due = self.pop_due(time.time())
+            if due:
+                await callback(due)
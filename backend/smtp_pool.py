@@ -0,0 +1,146 @@
+import os
+import time
+import socket
+import smtplib
+import threading
+from email.message import Message
+from typing import Any, Dict, List, Optional, Tuple
+
+# SMTP session pool
+# One authenticated connection per account, kept alive between replies and
+# checked with NOOP before reuse, instead of connect + STARTTLS + LOGIN per
+# message.
+
+SMTP_HEALTHCHECK_AFTER = float(os.environ.get("SMTP_HEALTHCHECK_AFTER", 30))
+SMTP_POOL_MAX_IDLE = float(os.environ.get("SMTP_POOL_MAX_IDLE", 240))
+
+# Errors that mean the connection is gone and a fresh one may succeed.
+# (SMTPException subclasses OSError, so these must be checked before it.)
+DISCONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)
+
+
+class SmtpPool:
+    def __init__(self, host: str, port: int = 587, starttls: bool = True, timeout: Optional[float] = None):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # email -> (smtp, password, last_used)
+        self._idle: Dict[str, Tuple[smtplib.SMTP, str, float]] = {}
+        self.connects = 0
+
+    def _connect(self, user: str, password: str) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout or socket._GLOBAL_DEFAULT_TIMEOUT)
+        try:
+            if self.starttls:
+                server.starttls()
+            server.login(user, password)
+        except Exception:
+            self._close(server)
+            raise
+        self.connects += 1
+        return server
+
+    @staticmethod
+    def _close(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _discard(self, server: Optional[smtplib.SMTP]) -> None:
+        if server is not None:
+            self._close(server)
+        return None
+
+    def _checkout(self, user: str, password: str) -> smtplib.SMTP:
+        with self._lock:
+            pooled = self._idle.pop(user, None)
+        if pooled:
+            server, pooled_password, last_used = pooled
+            idle_for = time.time() - last_used
+            if pooled_password == password and idle_for <= SMTP_POOL_MAX_IDLE:
+                if idle_for <= SMTP_HEALTHCHECK_AFTER or self._healthy(server):
+                    return server
+            self._close(server)
+        return self._connect(user, password)
+
+    def _checkin(self, user: str, password: str, server: smtplib.SMTP):
+        with self._lock:
+            extra = self._idle.get(user)
+            self._idle[user] = (server, password, time.time())
+        if extra:
+            self._close(extra[0])
+
+    @staticmethod
+    def _healthy(server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except OSError:
+            return False
+
+    def send_batch(self, user: str, password: str, messages: List[Message]) -> List[Dict[str, Any]]:
+        """
+        Sends every message over one pooled session. Returns one result per
+        message: {"to", "sent", "error"}. A dropped connection is re-opened
+        and the message retried once; a rejected message doesn't stop the batch.
+        """
+        results = []
+        server = None
+        auth_error = None
+        for msg in messages:
+            result = {"to": msg["To"], "sent": False, "error": None}
+            for attempt in range(2):
+                if auth_error is not None:
+                    result["error"] = auth_error
+                    break
+                try:
+                    if server is None:
+                        server = self._checkout(user, password)
+                    server.send_message(msg)
+                    result["sent"] = True
+                    result["error"] = None
+                    break
+                except smtplib.SMTPAuthenticationError as e:
+                    auth_error = str(e)
+                    result["error"] = auth_error
+                    break
+                except DISCONNECT_ERRORS as e:
+                    server = self._discard(server)
+                    result["error"] = str(e)
+                except smtplib.SMTPException as e:
+                    # Message-level rejection; the session is still usable
+                    result["error"] = str(e)
+                    break
+                except OSError as e:
+                    # Socket-level failure (reset, timeout)
+                    server = self._discard(server)
+                    result["error"] = str(e)
+            results.append(result)
+
+        if server is not None:
+            self._checkin(user, password, server)
+        return results
+
+    def send(self, user: str, password: str, msg: Message) -> Dict[str, Any]:
+        return self.send_batch(user, password, [msg])[0]
+
+    def evict_idle(self, max_idle: float = SMTP_POOL_MAX_IDLE) -> int:
+        cutoff = time.time() - max_idle
+        with self._lock:
+            expired = [u for u, (_, _, used) in self._idle.items() if used < cutoff]
+            closing = [self._idle.pop(u)[0] for u in expired]
+        for server in closing:
+            self._close(server)
+        return len(closing)
+
+    def close_all(self):
+        with self._lock:
+            closing = [server for server, _, _ in self._idle.values()]
+            self._idle.clear()
+        for server in closing:
+            self._close(server)
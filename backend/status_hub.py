@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+# Live account status for the extension
+# Every user's popup view (active, interval, last/next run, the cycle in
+# progress and its latest per-message actions) is kept in memory and pushed to
+# connected popups as Server-Sent Events. main.py updates it wherever it writes
+# a user row or runs a cycle, so GET /status/stream doesn't read the user
+# store. Events are encoded once per change and fanned out to that user's
+# connections only; a connection that falls behind drops its backlog and gets
+# a fresh snapshot instead. With several workers a cycle's live events only
+# reach popups connected to the worker running it; the stored fields (last
+# run, next due time) are refreshed from the store (see main.resync_schedule
+# and POST /status).
+
+STATUS_QUEUE_SIZE = int(os.environ.get("STATUS_QUEUE_SIZE", 64))
+STATUS_KEEPALIVE_SECONDS = float(os.environ.get("STATUS_KEEPALIVE_SECONDS", 15))
+STATUS_RECENT_ACTIONS = int(os.environ.get("STATUS_RECENT_ACTIONS", 20))
+# Log fields worth pushing; reply and body text stay server-side
+ACTION_FIELDS = ("subject", "sender", "intent", "action", "timestamp", "error")
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def next_run_label(snapshot: Dict[str, Any], now: Optional[float] = None) -> str:
+    """The popup's "Next Check" text, as POST /status has always phrased it."""
+    if snapshot.get("running"):
+        return "Running..."
+    if not snapshot.get("last_run"):
+        return "Pending..."
+    minutes_left = int((snapshot["next_due_at"] - (time.time() if now is None else now)) / 60)
+    return "Now/Soon" if minutes_left <= 0 else f"in {minutes_left} mins"
+
+
+class StatusHub:
+    """In-memory status snapshots plus per-user SSE subscribers. Safe to call from cycle threads."""
+
+    def __init__(self):
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._recent: Dict[str, deque] = {}
+        # email -> {(loop, queue)}; each connection belongs to the loop that serves it
+        self._subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._lock = threading.Lock()
+
+    # -- snapshots --
+
+    def load(self, users: Iterable[Dict[str, Any]]) -> int:
+        """Seeds snapshots from stored user rows (startup). Returns how many."""
+        count = 0
+        for user in users:
+            self.set_user(user, publish=False)
+            count += 1
+        return count
+
+    @staticmethod
+    def _stored(user: Dict[str, Any]) -> Dict[str, Any]:
+        return {"active": bool(user.get("active")), "interval": user.get("interval_minutes", 30),
+                "last_run": user.get("last_run"), "next_due_at": user.get("next_due_at") or 0.0}
+
+    def set_user(self, user: Dict[str, Any], publish: bool = True):
+        """Takes the stored fields from a (freshly written) user row."""
+        with self._lock:
+            snapshot = self._status.setdefault(user["email"], self._blank(user["email"]))
+            snapshot.update(self._stored(user))
+        if publish:
+            self.publish(user["email"], "status", self.get(user["email"]))
+
+    def refresh(self, user: Dict[str, Any]) -> bool:
+        """
+        Takes a user row that another worker may have written; publishes only
+        if the stored fields changed. Returns whether they did.
+        """
+        fields = self._stored(user)
+        with self._lock:
+            snapshot = self._status.get(user["email"])
+            if snapshot is not None and all(snapshot[k] == v for k, v in fields.items()):
+                return False
+        self.set_user(user)
+        return True
+
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            snapshot = self._status.get(email)
+            if snapshot is None:
+                return None
+            snapshot = dict(snapshot, recent=list(self._recent.get(email, ())))
+        snapshot["next_run"] = next_run_label(snapshot)
+        return snapshot
+
+    def __contains__(self, email: str) -> bool:
+        return email in self._status
+
+    def _blank(self, email: str) -> Dict[str, Any]:
+        return {"email": email, "active": False, "interval": 30, "last_run": None, "next_due_at": 0.0,
+                "running": False, "cycle_started_at": None, "last_cycle": None, "last_fetch": None}
+
+    def _change(self, email: str, **fields) -> Optional[Dict[str, Any]]:
+        """Updates a known user's snapshot; returns a copy, or None for unknown users."""
+        with self._lock:
+            snapshot = self._status.get(email)
+            if snapshot is None:
+                return None
+            snapshot.update(fields)
+            return dict(snapshot)
+
+    # -- cycle events --
+
+    def cycle_started(self, email: str):
+        started = time.time()
+        if self._change(email, running=True, cycle_started_at=started):
+            with self._lock:
+                self._recent[email] = deque(maxlen=STATUS_RECENT_ACTIONS)
+            self.publish(email, "cycle_started", {"started_at": started})
+
+    def action(self, email: str, log_entry: Dict[str, Any]):
+        """One handled message (a run_agent_cycle log entry); called from the cycle's threads."""
+        data = {k: log_entry[k] for k in ACTION_FIELDS if k in log_entry}
+        with self._lock:
+            if email not in self._status:
+                return
+            self._recent.setdefault(email, deque(maxlen=STATUS_RECENT_ACTIONS)).append(data)
+        self.publish(email, "action", data)
+
+    def cycle_finished(self, email: str, actions: int, error: Optional[str] = None,
+                       last_fetch: Optional[Dict[str, int]] = None, next_due_at: Optional[float] = None):
+        summary = {"finished_at": time.time(), "actions": actions, "error": error}
+        fields = {"running": False, "last_cycle": summary, "last_fetch": last_fetch}
+        if next_due_at is not None:
+            fields["next_due_at"] = next_due_at
+        snapshot = self._change(email, **fields)
+        if snapshot is not None:
+            self.publish(email, "cycle_finished", {**summary, "next_due_at": snapshot["next_due_at"]})
+
+    # -- subscribers --
+
+    def publish(self, email: str, event: str, data: Any):
+        with self._lock:
+            subscribers = list(self._subscribers.get(email, ()))
+        if not subscribers:
+            return
+        message = sse(event, data)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, email, queue, message)
+            except RuntimeError:
+                # That connection's loop is gone
+                self._unsubscribe(email, (loop, queue))
+
+    def _offer(self, email: str, queue: asyncio.Queue, message: str):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Too slow to keep up: skip to the current state
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(sse("status", self.get(email)))
+
+    def _unsubscribe(self, email: str, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(email)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[email]
+
+    async def stream(self, email: str, keepalive: float = STATUS_KEEPALIVE_SECONDS) -> AsyncIterator[str]:
+        """SSE text for one connection: the current snapshot, then every change."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(STATUS_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(email, set()).add(subscriber)
+        try:
+            yield sse("status", self.get(email))
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber[1].get(), keepalive)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+        finally:
+            self._unsubscribe(email, subscriber)
+
+    def subscribed(self) -> List[str]:
+        """Users with a connected popup."""
+        with self._lock:
+            return list(self._subscribers)
+
+    def connections(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
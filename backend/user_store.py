@@ -0,0 +1,232 @@
+import os
+import json
+import sqlite3
+import threading
+import datetime
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+# User "Database"
+# One row per account, read and written individually instead of
+# rewriting the whole users.json on every request.
+
+USER_DB = os.environ.get("USER_DB", "users.db")
+LEGACY_DB_FILE = "users.json"
+DEFAULT_INTERVAL = 30
+
+# Column name -> SQL type. New columns are added here and picked up by
+# _ensure_schema() on existing databases.
+COLUMNS = {
+    "email": "TEXT PRIMARY KEY",
+    "app_password": "TEXT NOT NULL DEFAULT ''",
+    "openrouter_key": "TEXT NOT NULL DEFAULT ''",
+    "active": "INTEGER NOT NULL DEFAULT 0",
+    "interval_minutes": f"INTEGER NOT NULL DEFAULT {DEFAULT_INTERVAL}",
+    "last_run": "TEXT",
+    "next_due_at": "REAL NOT NULL DEFAULT 0",
+    # Incremental IMAP sync position (see mail_sync.py)
+    "uidvalidity": "INTEGER NOT NULL DEFAULT 0",
+    "last_uid": "INTEGER NOT NULL DEFAULT 0",
+    # Adaptive polling (see polling.py); a poll_interval of 0 means interval_minutes
+    "arrival_rate": "REAL NOT NULL DEFAULT 0",
+    "empty_cycles": "INTEGER NOT NULL DEFAULT 0",
+    "poll_interval": "REAL NOT NULL DEFAULT 0",
+}
+BOOL_COLUMNS = {"active"}
+
+
+def compute_next_due(last_run: Optional[str], interval_minutes: int) -> float:
+    """Epoch seconds at which a user is next due. 0 means 'never run, due now'."""
+    if not last_run:
+        return 0.0
+    last_dt = datetime.datetime.fromisoformat(last_run)
+    return (last_dt + datetime.timedelta(minutes=interval_minutes)).timestamp()
+
+
+class UserStore(ABC):
+    """Interface for user storage backends."""
+
+    @abstractmethod
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def upsert(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def update(self, email: str, **fields) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def due_users(self, now: float, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def active_schedule(self) -> List[Tuple[str, float]]:
+        ...
+
+    @abstractmethod
+    def all_users(self) -> Iterator[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+
+class SQLiteUserStore(UserStore):
+    """SQLite (WAL mode) store with per-row reads and transactional updates."""
+
+    def __init__(self, path: str = USER_DB):
+        self.path = path
+        self._local = threading.local()
+        self._ensure_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared across threads; the agent cycle
+        # runs in a worker thread while endpoints run on the event loop.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        conn = self._conn()
+        cols = ", ".join(f"{name} {sql}" for name, sql in COLUMNS.items())
+        conn.execute(f"CREATE TABLE IF NOT EXISTS users ({cols})")
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(users)")}
+        for name, sql in COLUMNS.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE users ADD COLUMN {name} {sql}")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_active_due ON users (active, next_due_at)"
+        )
+
+    @staticmethod
+    def _to_dict(row) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        user = {k: row[k] for k in row.keys() if k in COLUMNS}
+        for name in BOOL_COLUMNS:
+            if name in user:
+                user[name] = bool(user[name])
+        return user
+
+    @staticmethod
+    def _to_row(user: Dict[str, Any]) -> Dict[str, Any]:
+        row = {k: v for k, v in user.items() if k in COLUMNS}
+        for name in BOOL_COLUMNS:
+            if name in row:
+                row[name] = int(bool(row[name]))
+        return row
+
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        cur = self._conn().execute("SELECT * FROM users WHERE email = ?", (email,))
+        return self._to_dict(cur.fetchone())
+
+    def upsert(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = self._to_dict(
+                conn.execute("SELECT * FROM users WHERE email = ?", (user["email"],)).fetchone()
+            ) or {}
+            merged = {**current, **user}
+            merged["next_due_at"] = compute_next_due(
+                merged.get("last_run"), merged.get("poll_interval") or merged.get("interval_minutes", DEFAULT_INTERVAL)
+            )
+            row = self._to_row(merged)
+            names = ", ".join(row)
+            marks = ", ".join("?" for _ in row)
+            conn.execute(
+                f"INSERT OR REPLACE INTO users ({names}) VALUES ({marks})",
+                tuple(row.values()),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self._to_dict(merged)
+
+    def update(self, email: str, **fields) -> Optional[Dict[str, Any]]:
+        """Updates one user's row. Returns the new row, or None if unknown."""
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown user fields: {sorted(unknown)}")
+        if self.get(email) is None:
+            return None
+        return self.upsert({**fields, "email": email})
+
+    def due_users(self, now: float, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Served by idx_users_active_due: cost depends on the due rows only.
+        cur = self._conn().execute(
+            "SELECT * FROM users WHERE active = 1 AND next_due_at <= ? "
+            "ORDER BY next_due_at LIMIT ?",
+            (now, -1 if limit is None else limit),
+        )
+        return [self._to_dict(row) for row in cur.fetchall()]
+
+    def active_schedule(self) -> List[Tuple[str, float]]:
+        """(email, next_due_at) for every active user, to seed the scheduler."""
+        cur = self._conn().execute(
+            "SELECT email, next_due_at FROM users WHERE active = 1 ORDER BY next_due_at"
+        )
+        return [(row["email"], row["next_due_at"]) for row in cur.fetchall()]
+
+    def all_users(self) -> Iterator[Dict[str, Any]]:
+        """Every user row, streamed (to seed in-memory status at startup)."""
+        for row in self._conn().execute("SELECT * FROM users"):
+            yield self._to_dict(row)
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def migrate_from_json(store: UserStore, json_path: str = LEGACY_DB_FILE) -> int:
+    """
+    Imports users from the legacy users.json file into the store.
+    Existing rows win; the JSON file is renamed to *.bak afterwards so the
+    import runs only once. Returns the number of users imported.
+    """
+    if not os.path.exists(json_path):
+        return 0
+    with open(json_path, 'r') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError:
+            data = {}
+
+    imported = 0
+    for email, user in data.items():
+        if store.get(email) is not None:
+            continue
+        store.upsert({**user, "email": email})
+        imported += 1
+
+    os.replace(json_path, json_path + ".bak")
+    return imported
+
+
+def open_user_store(url: Optional[str] = None) -> UserStore:
+    """
+    Opens the configured store. `url` (or $USER_STORE) selects the backend:
+    'sqlite:///path/to/users.db' or a bare path, both SQLite.
+    """
+    url = url or os.environ.get("USER_STORE") or USER_DB
+    if url.startswith("sqlite:///"):
+        return SQLiteUserStore(url[len("sqlite:///"):])
+    if "://" in url:
+        raise ValueError(f"Unsupported user store: {url}")
+    return SQLiteUserStore(url)
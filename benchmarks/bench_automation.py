@@ -0,0 +1,117 @@
+"""
+Automated-mail detection: precision, recall and latency on a labelled corpus.
+
+Usage: python benchmarks/bench_automation.py [--corpus tests/fixtures/automation_corpus.jsonl] [--repeat 200]
+
+"legacy" is the old check: no-reply substrings on the sender, then the old
+promotional keyword rule over body + sender. "headers" is
+automation.header_reason() alone; "detector" adds the per-account sender
+reputation, learning (as the agent does) from each message's outcome in
+corpus order. "no body" is the share of messages decided without reading
+the body; us/msg is the cost of that decision (legacy's grows with the
+body, the header checks' doesn't).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from email.utils import parseaddr
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "backend"))
+
+from automation import AutomationDetector, SenderReputation, header_reason
+from intent_rules import IntentMatcher, DEFAULT_CATEGORIES, matcher
+
+PROMO = "Promotional/Notification"
+LEGACY_NOREPLY = ["noreply", "no-reply", "do-not-reply", "donotreply", "mailer-daemon", "notification"]
+# The promotional keywords before header detection took over notifications
+LEGACY_PROMO = [
+    "unsubscribe", "newsletter", "offer", "discount", "sale", "welcome", "verify", "alert", "security",
+    "code", "login", "update", "marketing", "noreply", "no-reply", "notification", "statement", "receipt",
+]
+legacy_matcher = IntentMatcher([{**DEFAULT_CATEGORIES[0], "keywords": LEGACY_PROMO}] + DEFAULT_CATEGORIES[1:])
+USER = "me@example.com"
+
+
+def load_corpus(path: str):
+    msgs = []
+    with open(path) as f:
+        for line in f:
+            row = json.loads(line)
+            msgs.append(SimpleNamespace(
+                from_=parseaddr(row["from"])[1].lower(),
+                headers={k.lower(): (v,) for k, v in row["headers"].items()},
+                body=row["body"],
+                automated=row["label"] == "automated",
+            ))
+    return msgs
+
+
+def legacy(msg) -> bool:
+    if any(p in msg.from_ for p in LEGACY_NOREPLY):
+        return True
+    return legacy_matcher.classify(msg.body, msg.from_)["intent"] == PROMO
+
+
+def run_detector(msgs, use_reputation: bool):
+    detector = AutomationDetector(SenderReputation(path=""))
+    verdicts, no_body = [], 0
+    for msg in msgs:
+        if use_reputation:
+            reason = detector.reason(msg, USER)
+        else:
+            reason = header_reason(msg.headers, msg.from_)
+        if reason:
+            no_body += 1
+            verdicts.append(True)
+        else:
+            # Survivors go on to body classification, as in the agent
+            verdicts.append(matcher.classify(msg.body, msg.from_)["intent"] == PROMO)
+        # Learned as in agent_logic._sender_outcomes: header verdicts and people only
+        if use_reputation and reason != "Sender Reputation" and (reason or not verdicts[-1]):
+            detector.learn(USER, [(msg.from_, verdicts[-1])])
+    return verdicts, no_body, detector
+
+
+def scores(msgs, verdicts):
+    tp = sum(1 for m, v in zip(msgs, verdicts) if v and m.automated)
+    fp = sum(1 for m, v in zip(msgs, verdicts) if v and not m.automated)
+    fn = sum(1 for m, v in zip(msgs, verdicts) if not v and m.automated)
+    return tp / max(tp + fp, 1), tp / max(tp + fn, 1), fp
+
+
+def per_message_us(fn, msgs, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for msg in msgs:
+            fn(msg)
+    return (time.perf_counter() - start) / (repeat * len(msgs)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "tests", "fixtures", "automation_corpus.jsonl"))
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    msgs = load_corpus(args.corpus)
+    print(f"{len(msgs)} messages, {sum(m.automated for m in msgs)} automated")
+    print(f"{'impl':>9} {'precision':>10} {'recall':>7} {'false +':>8} {'no body':>8} {'us/msg':>7}")
+
+    legacy_verdicts = [legacy(m) for m in msgs]
+    p, r, fp = scores(msgs, legacy_verdicts)
+    print(f"{'legacy':>9} {p:>10.2f} {r:>7.2f} {fp:>8} {'0%':>8} {per_message_us(legacy, msgs, args.repeat):>7.1f}")
+
+    for name, use_reputation in (("headers", False), ("detector", True)):
+        verdicts, no_body, detector = run_detector(msgs, use_reputation)
+        p, r, fp = scores(msgs, verdicts)
+        # Latency of the header/reputation decision itself, with the learned table
+        us = per_message_us(lambda m: detector.reason(m, USER), msgs, args.repeat)
+        print(f"{name:>9} {p:>10.2f} {r:>7.2f} {fp:>8} {no_body / len(msgs):>8.0%} {us:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
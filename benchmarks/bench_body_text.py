@@ -0,0 +1,77 @@
+"""
+Body preparation: classifying the raw body versus the streaming normalizer.
+
+Usage: python benchmarks/bench_body_text.py [--emails 300] [--body-kb 200]
+
+Bodies are synthetic HTML newsletters of roughly --body-kb KB (no text part,
+like most marketing mail). "raw" is the old path: strip() the HTML, classify
+all of it and prompt with its first MAX_EMAIL_PREVIEW characters. "stream"
+runs body_text.extract_text() first, so its cost stops growing with the
+body once BODY_TEXT_LIMIT characters of text are out. Also reports how
+much of the prompt excerpt is markup.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from intent_rules import matcher
+from body_text import extract_text
+
+MAX_EMAIL_PREVIEW = 600
+HEAD = (
+    "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><style>"
+    + "td.c{font-family:Arial,sans-serif;font-size:14px;line-height:20px;color:#333}" * 40
+    + "</style></head><body><table width=\"100%\" cellpadding=\"0\" cellspacing=\"0\">"
+)
+ROW = (
+    "<tr><td class=\"c\" style=\"padding:0 24px\">Lorem ipsum dolor sit amet, consectetur adipiscing elit, "
+    "sed do eiusmod tempor&nbsp;incididunt ut labore &amp; dolore magna aliqua.</td></tr>\n"
+)
+TAIL = "<tr><td>Can we set up a meeting next week?</td></tr></table></body></html>"
+
+
+def make_body(body_kb: int) -> str:
+    repeats = max(1, (body_kb * 1024 - len(HEAD)) // len(ROW))
+    return HEAD + ROW * repeats + TAIL
+
+
+def raw_path(html: str):
+    body = html.strip()
+    matcher.classify(body, "news@example.com")
+    return body[:MAX_EMAIL_PREVIEW]
+
+
+def stream_path(html: str):
+    body = extract_text(None, html)
+    matcher.classify(body, "news@example.com")
+    return body[:MAX_EMAIL_PREVIEW]
+
+
+def markup_share(excerpt: str) -> float:
+    """Share of the prompt excerpt that is markup or CSS rather than readable text."""
+    readable = extract_text(None, excerpt) if excerpt.lstrip().startswith("<") else excerpt
+    return 1 - len(readable) / max(len(excerpt), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--emails", type=int, default=300)
+    parser.add_argument("--body-kb", type=int, default=200)
+    args = parser.parse_args()
+
+    body = make_body(args.body_kb)
+    print(f"{args.emails} emails x {len(body) // 1024} KB HTML")
+    print(f"{'path':>8} {'total (s)':>10} {'us/email':>10} {'markup in prompt':>17}")
+    for name, fn in (("raw", raw_path), ("stream", stream_path)):
+        start = time.perf_counter()
+        for _ in range(args.emails):
+            excerpt = fn(body)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>8} {elapsed:>10.3f} {elapsed / args.emails * 1e6:>10.1f} {markup_share(excerpt):>16.0%}")
+
+
+if __name__ == "__main__":
+    main()
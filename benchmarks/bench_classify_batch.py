@@ -0,0 +1,104 @@
+"""
+LLM intent classification: one request per email versus batched requests.
+
+Usage: python benchmarks/bench_classify_batch.py [--emails 100] [--batch-size 10] [--latency-ms 300]
+
+Runs email_agent's classifiers against the local mock OpenRouter, which
+answers after --latency-ms and reports tokens as chars / 4. Both modes run
+sequentially, like the CLI does.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "backend"))
+sys.path.append(os.path.join(ROOT, "tests"))
+
+# Both modes must really call the mock, so no persistent cache
+os.environ["LLM_CACHE_DB"] = ""
+import email_agent
+from llm_client import LLMClient
+from mock_openrouter import MockOpenRouter
+
+SAMPLES = [
+    ("Hi, could we find 30 minutes next week to go over the proposal? Tuesday or Wednesday works.", "Meeting Request"),
+    ("The export button has been throwing an error since this morning, can someone take a look?", "Support Query"),
+    ("Our spring sale starts today: 30% off everything. Unsubscribe at any time.", "Promotional/Notification"),
+    ("Could you send me the pricing sheet for the enterprise plan and the onboarding timeline?", "Information Request"),
+    ("Great seeing you at the conference, let's keep in touch.", "General"),
+]
+
+# (text, true intent) for the current run; the mock answers from it
+LABELS = {}
+
+
+def responder(payload: dict) -> str:
+    # Answers with the true label, in whichever shape the prompt asked for
+    content = payload["messages"][-1]["content"]
+    label = LABELS
+    try:
+        items = json.loads(content)
+    except ValueError:
+        items = None
+    if isinstance(items, list):
+        return json.dumps([{"id": it["id"], "intent": label.get(it["text"], "General"), "confidence": 0.9}
+                           for it in items])
+    return json.dumps({"intent": label.get(content, "General"), "confidence": 0.9})
+
+
+def tokens(requests, start):
+    used = requests[start:]
+    prompt = sum(sum(len(m["content"]) for m in r["payload"]["messages"]) for r in used) // 4
+    return len(used), prompt
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--emails", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=email_agent.CLASSIFY_BATCH_SIZE)
+    parser.add_argument("--token-budget", type=int, default=email_agent.CLASSIFY_TOKEN_BUDGET)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    random.seed(3)
+    emails, expected = [], []
+    for i in range(args.emails):
+        text, intent = random.choice(SAMPLES)
+        emails.append(f"[{i}] {text}")
+        expected.append(intent)
+        LABELS[emails[-1][:email_agent.MAX_EMAIL_PREVIEW]] = intent
+
+    server = MockOpenRouter(latency=args.latency_ms / 1000, responder=responder).start()
+    email_agent.llm_client = LLMClient(server.url)
+    email_agent.OPENROUTER_API_KEY = "bench-key"
+
+    rows = []
+    try:
+        for name, run in (
+            ("unbatched", lambda: [email_agent.classify_intent_llm(e) for e in emails]),
+            ("batched", lambda: email_agent.classify_intents_llm_batch(emails, args.batch_size, args.token_budget)),
+        ):
+            start_requests = len(server.requests)
+            start = time.perf_counter()
+            results = run()
+            elapsed = time.perf_counter() - start
+            calls, prompt_tokens = tokens(server.requests, start_requests)
+            correct = sum(r["intent"] == e for r, e in zip(results, expected))
+            rows.append((name, calls, elapsed, args.emails / elapsed, prompt_tokens / args.emails, correct))
+    finally:
+        email_agent.llm_client.close()
+        server.stop()
+
+    print(f"{args.emails} emails, batch size {args.batch_size}, {args.latency_ms:.0f} ms per call")
+    print(f"{'mode':>10} {'calls':>6} {'time (s)':>9} {'emails/s':>9} {'prompt tok/email':>17} {'correct':>8}")
+    for name, calls, elapsed, rate, per_email, correct in rows:
+        print(f"{name:>10} {calls:>6} {elapsed:>9.2f} {rate:>9.1f} {per_email:>17.1f} {correct:>8}")
+
+
+if __name__ == "__main__":
+    main()
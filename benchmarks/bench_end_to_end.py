@@ -0,0 +1,412 @@
+"""
+End-to-end agent throughput against local stand-ins for Gmail and OpenRouter.
+
+Usage: python benchmarks/bench_end_to_end.py [--users 1 100 10000] [--messages 5]
+           [--mode cycle scheduler] [--llm-latency-ms 50] [--llm-error-rate 0.0]
+           [--imap-delay-ms 0] [--concurrency 10] [--out results.json] [--compare baseline.json]
+
+A child process runs the fake IMAP server (tests/fake_imap.py) seeded with
+synthetic mailboxes, an aiosmtpd sink and the mock OpenRouter
+(tests/mock_openrouter.py) with the given latency and error rate, so the
+CPU and memory reported here are the agent's alone. For each user count:
+
+  cycle      run_agent_cycle() once per user from --concurrency threads
+  scheduler  the backend's DueScheduler + active_user_job with every user
+             due at once (cycle slots, per-host limits, history and user
+             store writes included)
+
+Each run reports messages/s, p50/p95/p99 cycle latency, CPU seconds and
+utilisation, and RSS; scheduler runs add the lag from "due" to cycle start.
+Results go to a JSON file (default benchmarks/results/e2e-<commit>.json);
+--compare prints the change against an earlier file. Pooled IMAP/SMTP
+sessions are evicted after --session-idle seconds (the backend's 25 minutes
+would keep 10k users' sockets open for the whole run).
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import platform
+import argparse
+import warnings
+import contextlib
+import resource
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "backend"))
+sys.path.append(os.path.join(ROOT, "tests"))
+
+PASSWORD = "secret"
+API_KEY = "sk-or-bench"
+
+# (sender, subject, body, extra headers): replies, a meeting, general mail,
+# a newsletter and a no-reply notification, so triage, the LLM and SMTP all see traffic
+MIX = [
+    ("Dana Cole <dana@customer.example>", "Export broken",
+     "The export button has been throwing an error since this morning, can someone take a look?", {}),
+    ("Lee Park <lee@partner.example>", "Proposal review",
+     "Hi, could we find 30 minutes next week to go over the proposal? Tuesday or Wednesday works.", {}),
+    ("Sam Ortiz <sam@friend.example>", "Good to meet you",
+     "Great seeing you at the conference, let's keep in touch and share notes soon.", {}),
+    ("Deals <deals@shop.example>", "Spring sale", "Our spring sale starts today: 30% off everything.",
+     {"List-Unsubscribe": "<mailto:unsubscribe@shop.example>", "Precedence": "bulk"}),
+    ("noreply@service.example", "Your receipt", "Thanks for your purchase. This mailbox is not monitored.", {}),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# -- stand-ins (child process) ------------------------------------------------
+
+class CountingSink:
+    def __init__(self):
+        self.count = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.count += 1
+        return "250 Message accepted"
+
+
+def serve_standins(conn, llm_latency: float, llm_error_rate: float, imap_delay: float):
+    """Child process: runs the stand-ins and answers seed/stats/stop requests on `conn`."""
+    warnings.filterwarnings("ignore", message="Session.login_data")
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.smtp import AuthResult
+    from fake_imap import FakeImapServer, FakeMailbox, make_message
+    from mock_openrouter import MockOpenRouter
+
+    imap = FakeImapServer({}, delay=imap_delay).start()
+    llm = MockOpenRouter(latency=llm_latency, error_rate=llm_error_rate).start()
+    sink = CountingSink()
+    smtp = Controller(sink, hostname="127.0.0.1", port=free_port(),
+                      authenticator=lambda *a: AuthResult(success=True), auth_require_tls=False)
+    smtp.start()
+    conn.send({"imap_port": imap.port, "llm_url": llm.url, "smtp_port": smtp.port})
+
+    llm_requests = 0
+    while True:
+        command, *args = conn.recv()
+        if command == "seed":
+            users, messages = args
+            start = time.perf_counter()
+            for user in users:
+                mailbox = FakeMailbox()
+                for i in range(messages):
+                    sender, subject, body, headers = MIX[i % len(MIX)]
+                    mailbox.add(make_message(sender, subject, body, to=user, headers=headers))
+                with imap.lock:
+                    imap.users[user] = PASSWORD
+                    imap.mailboxes[user] = mailbox
+            conn.send(time.perf_counter() - start)
+        elif command == "stats":
+            with llm.lock:
+                # The mock keeps every payload; only the count matters here
+                llm_requests += len(llm.requests)
+                llm.requests.clear()
+            conn.send({"llm_requests": llm_requests, "smtp_messages": sink.count, "imap_logins": imap.logins})
+        elif command == "stop":
+            smtp.stop()
+            llm.stop()
+            imap.stop()
+            conn.send(None)
+            return
+
+
+# -- measurement --------------------------------------------------------------
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+    pick = lambda q: round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 1)
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1] * 1000, 1)}
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+class Run:
+    """Wall/CPU/RSS and stand-in counters around one benchmark run."""
+
+    def __init__(self, standins, mode: str, users: int, messages: int):
+        self.standins = standins
+        self.result = {"mode": mode, "users": users, "messages_per_user": messages}
+        self.latencies = []
+        self.lags = []
+        self.processed = 0
+        self.errors = Counter()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.before = self.standins.stats()
+        self.rss = rss_mb()
+        self.cpu = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def cycle_done(self, latency: float, logs):
+        with self.lock:
+            self.latencies.append(latency)
+            self.processed += sum(1 for entry in logs if "action" in entry)
+            for entry in logs:
+                if "action" not in entry or "error" in entry:
+                    self.errors[str(entry.get("error") or entry.get("action"))[:120]] += 1
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu
+        after = self.standins.stats()
+        self.result.update({
+            "wall_s": round(wall, 3),
+            "cycles": len(self.latencies),
+            "messages": self.processed,
+            "msgs_per_s": round(self.processed / wall, 1) if wall else None,
+            "cycle_ms": percentiles(self.latencies),
+            "cpu_s": round(cpu, 3),
+            "cpu_util": round(cpu / wall, 3) if wall else None,
+            "rss_mb": round(rss_mb(), 1),
+            "rss_growth_mb": round(rss_mb() - self.rss, 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "errors": sum(self.errors.values()),
+            "top_errors": dict(self.errors.most_common(5)),
+            "llm_requests": after["llm_requests"] - self.before["llm_requests"],
+            "replies_sent": after["smtp_messages"] - self.before["smtp_messages"],
+            "imap_logins": after["imap_logins"] - self.before["imap_logins"],
+        })
+        if self.lags:
+            self.result["scheduler_lag_ms"] = percentiles(self.lags)
+
+
+class Standins:
+    def __init__(self, args):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=serve_standins, daemon=True,
+                                   args=(child, args.llm_latency_ms / 1000, args.llm_error_rate,
+                                         args.imap_delay_ms / 1000))
+        self.process.start()
+        self.ports = self.conn.recv()
+
+    def _call(self, *command):
+        self.conn.send(command)
+        return self.conn.recv()
+
+    def seed(self, users, messages: int) -> float:
+        return self._call("seed", users, messages)
+
+    def stats(self):
+        return self._call("stats")
+
+    def stop(self):
+        self._call("stop")
+        self.process.join(5)
+
+
+def evict_sessions(agent_logic, max_idle: float, stop: threading.Event):
+    while not stop.wait(max(max_idle / 2, 0.1)):
+        agent_logic.imap_pool.evict_idle(max_idle)
+        agent_logic.smtp_pool.evict_idle(max_idle)
+
+
+# -- modes --------------------------------------------------------------------
+
+def bench_cycle(agent_logic, standins, users, messages: int, concurrency: int):
+    with Run(standins, "cycle", len(users), messages) as run:
+        def one(user):
+            start = time.perf_counter()
+            logs, _ = agent_logic.run_agent_cycle(user, PASSWORD, API_KEY)
+            run.cycle_done(time.perf_counter() - start, logs)
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(one, users))
+    return run.result
+
+
+async def bench_scheduler(main, standins, users, messages: int):
+    """Every user due now; runs the real scheduler until each has finished one cycle."""
+    conn = main.store._conn()
+    conn.execute("BEGIN")
+    conn.execute("DELETE FROM users")
+    conn.executemany("INSERT INTO users (email, app_password, openrouter_key, active, interval_minutes) "
+                     "VALUES (?, ?, ?, 1, 30)", [(user, PASSWORD, API_KEY) for user in users])
+    conn.execute("COMMIT")
+
+    with Run(standins, "scheduler", len(users), messages) as run:
+        cycle = main.run_agent_cycle
+        due_at = time.perf_counter()
+        finished = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def timed_cycle(*args):
+            start = time.perf_counter()
+            logs, timestamp = cycle(*args)
+            run.lags.append(start - due_at)
+            run.cycle_done(time.perf_counter() - start, logs)
+            if len(run.latencies) == len(users):
+                loop.call_soon_threadsafe(finished.set)
+            return logs, timestamp
+
+        main.run_agent_cycle = timed_cycle
+        main.scheduler.load(main.store.active_schedule())
+        scheduler = asyncio.create_task(main.scheduler.run(main.active_user_job))
+        try:
+            await finished.wait()
+            # Let the last cycles save their results
+            while main.cycle_tasks:
+                await asyncio.sleep(0.01)
+        finally:
+            scheduler.cancel()
+            main.run_agent_cycle = cycle
+            main.scheduler.load([])
+    return run.result
+
+
+# -- results ------------------------------------------------------------------
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=ROOT).returncode != 0
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_runs(runs):
+    print(f"{'mode':>10} {'users':>6} {'msgs':>7} {'msg/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'cpu s':>7} {'cpu %':>6} {'rss MB':>7} {'errors':>6}")
+    for r in runs:
+        c = r["cycle_ms"]
+        print(f"{r['mode']:>10} {r['users']:>6} {r['messages']:>7} {r['msgs_per_s']:>8} {c['p50']:>8} "
+              f"{c['p95']:>8} {c['p99']:>8} {r['cpu_s']:>7} {r['cpu_util'] * 100:>6.0f} {r['rss_mb']:>7} "
+              f"{r['errors']:>6}")
+
+
+def print_comparison(runs, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = {(r["mode"], r["users"]): r for r in baseline["runs"]}
+    print(f"\nvs {baseline_path} ({baseline.get('commit')}):")
+    print(f"{'mode':>10} {'users':>6} {'msg/s':>16} {'p95 ms':>18} {'cpu s':>16}")
+    for r in runs:
+        b = old.get((r["mode"], r["users"]))
+        if b is None:
+            continue
+
+        def change(new, before):
+            if new is None or not before:
+                return f"{new}"
+            return f"{new} ({(new - before) / before:+.0%})"
+
+        print(f"{r['mode']:>10} {r['users']:>6} {change(r['msgs_per_s'], b['msgs_per_s']):>16} "
+              f"{change(r['cycle_ms']['p95'], b['cycle_ms']['p95']):>18} {change(r['cpu_s'], b['cpu_s']):>16}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end agent benchmark against local stand-ins.")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 100, 10000])
+    parser.add_argument("--messages", type=int, default=5, help="unread messages per mailbox")
+    parser.add_argument("--mode", nargs="+", choices=["cycle", "scheduler"], default=["cycle", "scheduler"])
+    parser.add_argument("--llm-latency-ms", type=float, default=50)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--imap-delay-ms", type=float, default=0)
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("MAX_CONCURRENT_CYCLES", 10)),
+                        help="parallel cycles in cycle mode (scheduler mode uses MAX_CONCURRENT_CYCLES)")
+    parser.add_argument("--session-idle", type=float, default=5.0)
+    parser.add_argument("--verbose", action="store_true", help="keep the agent's per-message output")
+    parser.add_argument("--out", help="results file (default benchmarks/results/e2e-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    standins = Standins(args)
+    tmp = tempfile.mkdtemp()
+    # Point the backend at the stand-ins and throwaway state before importing it
+    os.environ.update({
+        "IMAP_SERVER": "127.0.0.1", "IMAP_PORT": str(standins.ports["imap_port"]), "IMAP_SSL": "0",
+        "SMTP_SERVER": "127.0.0.1", "SMTP_PORT": str(standins.ports["smtp_port"]), "SMTP_STARTTLS": "0",
+        "OPENROUTER_URL": standins.ports["llm_url"], "LLM_MAX_RETRIES": os.environ.get("LLM_MAX_RETRIES", "1"),
+        # Every message is one of five templates, so a reply cache would hide the LLM entirely
+        "LLM_CACHE_DB": "", "OUTBOX_RATE_PER_MINUTE": "0",
+        # On disk like production (the in-memory shared-cache mode is for tests and locks under load)
+        "REPUTATION_DB": os.path.join(tmp, "reputation.db"), "OUTBOX_DB": os.path.join(tmp, "outbox.db"),
+        "USER_STORE": os.path.join(tmp, "users.db"), "HISTORY_DB": os.path.join(tmp, "history.db"),
+    })
+    import agent_logic
+    stop = threading.Event()
+    threading.Thread(target=evict_sessions, args=(agent_logic, args.session_idle, stop), daemon=True).start()
+
+    runs = []
+    # The agent prints a few lines per message; at 10k users that is the bottleneck
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    try:
+        plan = [(mode, n) for mode in args.mode for n in args.users]
+        for mode, n in plan:
+            # Fresh mailboxes per run, so nothing is already read or replied to
+            users = [f"u{i}.{mode}.{n}@bench.example" for i in range(n)]
+            seeded = standins.seed(users, args.messages)
+            print(f"🏁 {mode}: {n} users x {args.messages} messages (seeded in {seeded:.1f}s)")
+            if mode == "cycle":
+                with quiet:
+                    runs.append(bench_cycle(agent_logic, standins, users, args.messages, args.concurrency))
+        if "scheduler" in args.mode:
+            import main as backend
+
+            async def scheduler_runs():
+                # One event loop for all sizes: the backend's semaphores bind to the first loop they wait on
+                for mode, n in plan:
+                    if mode == "scheduler":
+                        users = [f"u{i}.{mode}.{n}@bench.example" for i in range(n)]
+                        runs.append(await bench_scheduler(backend, standins, users, args.messages))
+            with quiet:
+                asyncio.run(scheduler_runs())
+    finally:
+        stop.set()
+        agent_logic.imap_pool.close_all()
+        agent_logic.smtp_pool.close_all()
+        standins.stop()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": vars(args),
+        "runs": runs,
+    }
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"e2e-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print_runs(runs)
+    print(f"\nSaved {out}")
+    if args.compare:
+        print_comparison(runs, args.compare)
+
+
+if __name__ == "__main__":
+    main()
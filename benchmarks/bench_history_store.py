@@ -0,0 +1,98 @@
+"""
+History lookups at scale.
+
+Usage: python benchmarks/bench_history_store.py [--records 1000000] [--users 100]
+
+Fills a temporary history database, then times the lookups /history serves:
+sender lookup, intent count for a week, a deep cursor page and a full-text
+search, each for one account.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from history_store import HistoryStore
+
+INTENTS = ["Support Query", "Meeting Request", "General", "Promotional/Notification"]
+COMMON = ("account login password invoice meeting friday schedule broken error refund order shipping "
+          "thanks lunch report quarterly budget contract renewal access reset").split()
+# Long tail of rarer words, so text search selectivity looks like real mail
+VOCAB = COMMON + [f"term{i}" for i in range(20000)]
+START = datetime.datetime(2024, 1, 1)
+
+
+def fill(store: HistoryStore, records: int, users: int, batch: int = 10000):
+    rng = random.Random(5)
+    for offset in range(0, records, batch):
+        by_user = {}
+        for i in range(offset, min(records, offset + batch)):
+            user = f"user{rng.randrange(users)}@example.com"
+            by_user.setdefault(user, []).append({
+                "timestamp": (START + datetime.timedelta(seconds=i * 30)).isoformat(),
+                "sender": f"Contact {rng.randrange(2000)} <c{rng.randrange(2000)}@example.org>",
+                "subject": " ".join(rng.choices(COMMON, k=4)),
+                "intent": rng.choice(INTENTS),
+                "action": "Replied",
+                "email_text": " ".join(rng.choices(COMMON, k=10) + rng.choices(VOCAB, k=30)),
+                "reply": "Thank you for your email.",
+            })
+        for user, entries in by_user.items():
+            store.record_many(user, entries)
+
+
+def timed(fn, repeat: int = 20):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        store = HistoryStore(os.path.join(tmpdir, "history.db"))
+        start = time.perf_counter()
+        fill(store, args.records, args.users)
+        print(f"inserted {args.records} records in {time.perf_counter() - start:.1f}s (fts={store.fts})")
+
+        user = "user7@example.com"
+        some_sender = store.query(user, limit=1)[0][0]["sender"]
+        week_start = (START + datetime.timedelta(days=30)).timestamp()
+
+        def deep_page():
+            cursor = None
+            for _ in range(20):
+                _, cursor = store.query(user, limit=50, cursor=cursor)
+            return cursor
+
+        cases = [
+            ("sender lookup", lambda: len(store.query(user, sender=some_sender)[0])),
+            ("intent count, 1 week", lambda: store.count(user, intent="Support Query",
+                                                         since=week_start, until=week_start + 7 * 86400)),
+            ("page 20 via cursor", lambda: bool(deep_page())),
+            ("full-text 'refund term1234'", lambda: len(store.query(user, text="refund term1234")[0])),
+        ]
+        print(f"{'lookup':>28} {'ms':>8}  result")
+        for name, fn in cases:
+            ms, result = timed(fn)
+            print(f"{name:>28} {ms:>8.2f}  {result}")
+        store.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
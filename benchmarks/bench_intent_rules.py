@@ -0,0 +1,90 @@
+"""
+Keyword classification: per-list substring scans versus the compiled matcher.
+
+Usage: python benchmarks/bench_intent_rules.py [--emails 500] [--body-kb 40] [--extra-keywords 0]
+
+Bodies are synthetic HTML mails of roughly --body-kb KB. The old approach
+costs one full scan per keyword; --extra-keywords pads every category with
+that many more keywords (as a larger INTENT_KEYWORDS_FILE would) to show how
+each implementation scales.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from intent_rules import IntentMatcher, DEFAULT_CATEGORIES
+
+FILLER = (
+    "<td style=\"padding:0;font-family:Arial\">Lorem ipsum dolor sit amet, consectetur adipiscing "
+    "elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.</td>\n"
+)
+TAILS = [
+    "Could we set up a meeting next week?",
+    "The dashboard is broken since yesterday, please help.",
+    "Thanks again for dinner.",
+    "Click here to unsubscribe from this newsletter.",
+]
+
+
+def pad_categories(extra: int):
+    return [
+        {**c, "keywords": c["keywords"] + [f"{c['intent'][:4].lower()}kw{i}" for i in range(extra)]}
+        for c in DEFAULT_CATEGORIES
+    ]
+
+
+def make_legacy(categories):
+    promo, meeting, support = (c["keywords"] for c in categories)
+
+    def legacy_classify(text: str, sender: str):
+        text_lower = text.lower()
+        sender_lower = sender.lower()
+        if any(k in text_lower for k in promo) or any(k in sender_lower for k in promo):
+            return "Promotional/Notification"
+        if any(k in text_lower for k in meeting):
+            return "Meeting Request"
+        if any(k in text_lower for k in support):
+            return "Support Query"
+        return "General"
+    return legacy_classify
+
+
+def make_corpus(n: int, body_kb: int):
+    random.seed(7)
+    repeats = max(1, body_kb * 1024 // len(FILLER))
+    body = FILLER * repeats
+    return [(body + random.choice(TAILS), f"person{i}@example.com") for i in range(n)]
+
+
+def timeit(fn, corpus):
+    start = time.perf_counter()
+    for text, sender in corpus:
+        fn(text, sender)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--body-kb", type=int, default=40)
+    parser.add_argument("--extra-keywords", type=int, default=0)
+    args = parser.parse_args()
+
+    categories = pad_categories(args.extra_keywords)
+    corpus = make_corpus(args.emails, args.body_kb)
+    legacy = timeit(make_legacy(categories), corpus)
+    compiled = timeit(IntentMatcher(categories).classify, corpus)
+
+    keywords = sum(len(c["keywords"]) for c in categories)
+    print(f"{args.emails} emails x ~{args.body_kb} KB, {keywords} keywords")
+    print(f"{'impl':>10} {'total (s)':>10} {'us/email':>10}")
+    for name, elapsed in (("legacy", legacy), ("compiled", compiled)):
+        print(f"{name:>10} {elapsed:>10.3f} {elapsed / args.emails * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+memory.json read-modify-write versus the append-only interaction log.
+
+Usage: python benchmarks/bench_interaction_log.py [--records 2000]
+
+Writes --records interactions both ways into a temp directory and reports
+the total time and the time of the last 100 writes (which is where the old
+approach, rewriting the whole file every time, degrades).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from interaction_log import InteractionLog
+
+
+def legacy_save(path: str, record: dict):
+    # Copy of the old email_agent.save_to_memory
+    data = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            content = f.read()
+            if content.strip():
+                data = json.loads(content)
+    data.append(record)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def make_record(i: int) -> dict:
+    return {
+        "timestamp": "2025-12-30T07:45:04.742956",
+        "sender": f"person{i}@example.com",
+        "subject": f"Question {i}",
+        "email_text": "i am having trouble logging into my account. can you help me reset my password?",
+        "intent": "Support Query",
+        "confidence": 0.9,
+        "generated_reply": "Thank you for reaching out. " * 20,
+    }
+
+
+def run(save, n: int):
+    start = time.perf_counter()
+    tail_start = None
+    for i in range(n):
+        if i == n - 100:
+            tail_start = time.perf_counter()
+        save(make_record(i))
+    end = time.perf_counter()
+    return end - start, end - (tail_start or start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=2000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        legacy_path = os.path.join(tmpdir, "memory.json")
+        legacy = run(lambda r: legacy_save(legacy_path, r), args.records)
+        log = InteractionLog(os.path.join(tmpdir, "memory"))
+        appended = run(log.append, args.records)
+        log.close()
+        start = time.perf_counter()
+        count = sum(1 for _ in log.read())
+        read_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print(f"{args.records} records")
+    print(f"{'impl':>12} {'total (s)':>10} {'last 100 (ms/rec)':>18}")
+    for name, (total, tail) in (("memory.json", legacy), ("append log", appended)):
+        print(f"{name:>12} {total:>10.3f} {tail / 100 * 1000:>18.3f}")
+    print(f"streamed {count} records back in {read_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Throughput of leased user assignment as worker processes are added.
+
+Usage: python benchmarks/bench_leases.py [--workers 1 2 4 8] [--users 2000] [--slots 10] [--work-ms 50]
+
+Every worker process sees every user as due (as each uvicorn worker's
+scheduler does) and, like main.claim_backlog, leases only as many users as it
+has free cycle slots, re-checks that nobody ran them meanwhile, runs a
+simulated cycle (--work-ms of sleep, i.e. waiting on IMAP/LLM) and releases
+the lease. Reports users/s and speedup per worker count, and the number of
+users run more than once, which must be 0.
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from leases import LeaseStore
+
+
+def worker(path: str, name: str, users: int, slots: int, work: float, start_at: float):
+    leases = LeaseStore(path, worker_id=name)
+    runs = sqlite3.connect(path, timeout=30, isolation_level=None)
+    runs.execute("PRAGMA busy_timeout=30000")
+    backlog = [f"user{i}@example.com" for i in range(users)]
+    running = {}
+
+    def cycle(email):
+        time.sleep(work)
+        return email
+
+    time.sleep(max(start_at - time.time(), 0))
+    with ThreadPoolExecutor(slots) as pool:
+        while backlog or running:
+            # Fill every free slot before waiting, as main.claim_backlog does
+            while backlog and len(running) < slots:
+                free = slots - len(running)
+                candidates, backlog = backlog[:free], backlog[free:]
+                claimed, _ = leases.claim(candidates)
+                for email in claimed:
+                    # The store re-check (main.ran_since): another worker may have finished it
+                    if runs.execute("SELECT 1 FROM runs WHERE email = ?", (email,)).fetchone():
+                        leases.release(email)
+                        continue
+                    running[pool.submit(cycle, email)] = email
+            if not running:
+                continue
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                email = running.pop(future)
+                runs.execute("INSERT INTO runs (email, worker) VALUES (?, ?)", (email, name))
+                leases.release(email)
+    leases.close()
+    runs.close()
+
+
+def bench(workers: int, users: int, slots: int, work: float):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.db")
+        LeaseStore(path).close()
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE runs (email TEXT, worker TEXT)")
+        conn.commit()
+
+        ctx = multiprocessing.get_context("spawn")
+        # Start together once every process is up
+        start_at = time.time() + 1.0 + 0.2 * workers
+        procs = [ctx.Process(target=worker, args=(path, f"w{i}", users, slots, work, start_at))
+                 for i in range(workers)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.time() - start_at
+
+        total = conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+        duplicates = conn.execute(
+            "SELECT COUNT(*) FROM (SELECT email FROM runs GROUP BY email HAVING COUNT(*) > 1)"
+        ).fetchone()[0]
+        conn.close()
+    return elapsed, total, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--slots", type=int, default=10, help="cycle slots per worker (MAX_CONCURRENT_CYCLES)")
+    parser.add_argument("--work-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'runs':>6} {'seconds':>8} {'users/s':>8} {'speedup':>8} {'duplicates':>11}")
+    base = None
+    for n in args.workers:
+        elapsed, total, duplicates = bench(n, args.users, args.slots, args.work_ms / 1000)
+        rate = total / elapsed
+        base = base or rate
+        print(f"{n:>8} {total:>6} {elapsed:>8.2f} {rate:>8.0f} {rate / base:>7.1f}x {duplicates:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Pooled SMTP sessions versus a fresh connect + login per reply.
+
+Usage: python benchmarks/bench_smtp_pool.py [--messages 50] [--rtt-ms 20]
+
+Runs against a local aiosmtpd sink. --rtt-ms delays EHLO, AUTH and every
+MAIL/RCPT/DATA reply to approximate a remote server's round-trip time.
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import smtplib
+import argparse
+from email.mime.text import MIMEText
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from smtp_pool import SmtpPool
+
+USER = "bench@example.com"
+PASSWORD = "secret"
+
+
+class SlowSink:
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.count = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.rtt)
+        session.host_name = hostname
+        return responses
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        await asyncio.sleep(self.rtt)
+        envelope.mail_from = address
+        return "250 OK"
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        await asyncio.sleep(self.rtt)
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.rtt)
+        self.count += 1
+        return "250 Message accepted"
+
+
+def make_authenticator(rtt: float):
+    def authenticator(server, session, envelope, mechanism, auth_data):
+        time.sleep(rtt)  # runs on the server's loop thread, like a slow auth backend
+        return AuthResult(success=True)
+    return authenticator
+
+
+def make_msg(i: int):
+    msg = MIMEText(f"Reply body {i}\n" * 20)
+    msg['Subject'] = "Re: benchmark"
+    msg['From'] = USER
+    msg['To'] = f"rcpt{i}@example.com"
+    return msg
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_fresh(port: int, n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        with smtplib.SMTP("127.0.0.1", port) as server:
+            server.login(USER, PASSWORD)
+            server.send_message(make_msg(i))
+    return time.perf_counter() - start
+
+
+def bench_pooled(port: int, n: int) -> float:
+    pool = SmtpPool("127.0.0.1", port, starttls=False)
+    start = time.perf_counter()
+    results = pool.send_batch(USER, PASSWORD, [make_msg(i) for i in range(n)])
+    elapsed = time.perf_counter() - start
+    assert all(r["sent"] for r in results)
+    pool.close_all()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--rtt-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    rtt = args.rtt_ms / 1000
+    handler = SlowSink(rtt)
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port(),
+                            authenticator=make_authenticator(rtt), auth_require_tls=False)
+    controller.start()
+    try:
+        fresh = bench_fresh(controller.port, args.messages)
+        pooled = bench_pooled(controller.port, args.messages)
+    finally:
+        controller.stop()
+
+    print(f"{args.messages} messages, simulated RTT {args.rtt_ms:.0f} ms")
+    print(f"{'mode':>10} {'total (s)':>10} {'ms/msg':>8} {'msg/s':>8}")
+    for name, elapsed in (("fresh", fresh), ("pooled", pooled)):
+        print(f"{name:>10} {elapsed:>10.3f} {elapsed / args.messages * 1000:>8.1f} {args.messages / elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
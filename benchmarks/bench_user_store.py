@@ -0,0 +1,87 @@
+"""
+Per-request latency of the user store versus the old users.json load/save.
+
+Usage: python benchmarks/bench_user_store.py [--sizes 100 1000 10000]
+
+Each "request" mirrors an endpoint like /toggle: read one user, update one
+field. The legacy path parses and rewrites the whole file, so its cost grows
+with the user count; the SQLite store should stay flat.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from user_store import SQLiteUserStore
+
+
+def make_user(i: int):
+    return {
+        "email": f"user{i}@example.com",
+        "app_password": "x" * 16,
+        "openrouter_key": "sk-or-" + "y" * 40,
+        "active": True,
+        "interval_minutes": 30,
+        "last_run": "2025-01-01T00:00:00",
+    }
+
+
+def bench_legacy(path: str, n: int, requests: int) -> float:
+    with open(path, 'w') as f:
+        json.dump({u["email"]: u for u in map(make_user, range(n))}, f, indent=2)
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        email = f"user{random.randrange(n)}@example.com"
+        with open(path, 'r') as f:
+            db = json.load(f)
+        db[email]["active"] = not db[email]["active"]
+        with open(path, 'w') as f:
+            json.dump(db, f, indent=2)
+    return (time.perf_counter() - start) / requests
+
+
+def bench_store(path: str, n: int, requests: int) -> float:
+    store = SQLiteUserStore(path)
+    conn = store._conn()
+    conn.execute("BEGIN")
+    for i in range(n):
+        u = make_user(i)
+        conn.execute(
+            "INSERT INTO users (email, app_password, openrouter_key, active, interval_minutes, last_run) "
+            "VALUES (?, ?, ?, 1, ?, ?)",
+            (u["email"], u["app_password"], u["openrouter_key"], u["interval_minutes"], u["last_run"]),
+        )
+    conn.execute("COMMIT")
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        email = f"user{random.randrange(n)}@example.com"
+        user = store.get(email)
+        store.update(email, active=not user["active"])
+    elapsed = (time.perf_counter() - start) / requests
+    store.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'users.json (ms/req)':>22} {'sqlite (ms/req)':>18}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            legacy = bench_legacy(os.path.join(tmp, f"users_{n}.json"), n, args.requests)
+            sqlite = bench_store(os.path.join(tmp, f"users_{n}.db"), n, args.requests)
+            print(f"{n:>8} {legacy * 1000:>22.3f} {sqlite * 1000:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,46 @@ import os
 import sys
 import json
 import time
-import requests
 import datetime
-import smtplib
 from email.mime.text import MIMEText
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
-from imap_tools import MailBox, AND
+from imap_tools import MailBox
+
+# Shared helpers live in backend/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from smtp_pool import SmtpPool
+from llm_client import LLMClient, LLMError
+from model_router import ModelRouter, DEFAULT_TIER, reply_tier
+from intent_rules import matcher as intent_matcher
+from llm_cache import open_llm_cache, cache_key
+from interaction_log import open_interaction_log, InteractionLog
+from mail_sync import new_sync_state, pending_uids, mark_seen, advance
+from mail_fetch import FetchStats, fetch_batches
+from automation import AutomationDetector, is_noreply_address
+from body_text import message_text
+from intent_model import load_model, INTENT_MODEL_THRESHOLD
+from reply_stream import stream_reply
 
 # Load environment variables
 load_dotenv()
 
 # Configuration
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
-MODEL_NAME = "mistralai/mistral-7b-instruct"
-MEMORY_FILE = "memory.json"
+OPENROUTER_URL = os.environ.get("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+MEMORY_FILE = "memory.json"  # Legacy format, imported into MEMORY_DIR on first use
+MEMORY_DIR = os.environ.get("MEMORY_LOG_DIR", "memory")
+SYNC_STATE_FILE = "sync_state.json"  # Per-account UIDVALIDITY / last processed UID
 MAX_EMAIL_PREVIEW = 600 # Reduced from 2000 for speed
+# Batched LLM classification: emails per request, and a rough cap on the
+# prompt tokens (~4 chars each) the packed emails may use
+CLASSIFY_BATCH_SIZE = int(os.environ.get("CLASSIFY_BATCH_SIZE", 10))
+CLASSIFY_TOKEN_BUDGET = int(os.environ.get("CLASSIFY_TOKEN_BUDGET", 3000))
+# Bump when a prompt changes so cached answers aren't reused
+CLASSIFY_PROMPT_VERSION = "classify-v1"
+REPLY_PROMPT_VERSION = "cli-reply-v2"
+# Stream replies with a token budget and stop at the sign-off (reply_stream.py)
+REPLY_STREAMING = os.environ.get("REPLY_STREAMING", "1") != "0"
 
 # Email Configuration
 EMAIL_USER = os.environ.get("EMAIL_USER")
@@ -27,19 +50,26 @@ IMAP_SERVER = os.environ.get("IMAP_SERVER", "imap.gmail.com")
 SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
 
-def call_openrouter(messages: list) -> Dict[str, Any]:
+# Keeps the SMTP login alive across replies in one run
+smtp_pool = SmtpPool(SMTP_SERVER, SMTP_PORT)
+# Reuses HTTP connections to OpenRouter; retries 429/5xx with backoff
+llm_client = LLMClient(OPENROUTER_URL)
+# Spreads requests over LLM_MODELS by health/latency; hedges slow ones
+model_router = ModelRouter(llm_client)
+MODEL_NAME = model_router.primary
+# Repeated bodies reuse earlier classifications/replies (LLM_CACHE_DB="" disables)
+llm_cache = open_llm_cache()
+# Local hashed n-gram intent model (INTENT_MODEL_FILE); None until one is trained
+local_model = load_model()
+# Header rules + sender reputation learned from earlier runs (REPUTATION_DB)
+automation = AutomationDetector()
+
+def call_openrouter(messages: list, tier: str = DEFAULT_TIER) -> Dict[str, Any]:
     """Helper to call OpenRouter API."""
     if not OPENROUTER_API_KEY:
         print("Error: OPENROUTER_API_KEY environment variable not set.")
         sys.exit(1)
 
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://localhost", 
-        "X-Title": "EmailAgent"
-    }
-    
     payload = {
         "model": MODEL_NAME,
         "messages": messages,
@@ -47,22 +77,43 @@ def call_openrouter(messages: list) -> Dict[str, Any]:
     }
     
     try:
-        response = requests.post(OPENROUTER_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return model_router.chat_sync(payload, OPENROUTER_API_KEY, tier)
+    except LLMError as e:
         print(f"API Request Failed: {e}")
         return {}
 
+INTENTS = ["Meeting Request", "Support Query", "Information Request", "Promotional/Notification", "General"]
+
+CLASSIFY_RULES = (
+    "You are an email classifier. Your goal is to filter out spam and automated emails. "
+    "Classify the email into exactly one category: "
+    "'Meeting Request', 'Support Query', 'Information Request', 'Promotional/Notification', 'General'. "
+    "\nRULES:\n"
+    "1. Use 'Promotional/Notification' for ALL newsletters, marketing, automated welcome emails, 'Get Started' guides, status updates, and system alerts. If no human action is explicitly requested, it is Promotional.\n"
+    "2. Use 'General' ONLY if it appears to be a personal email from a human that requires a reply but fits no other category.\n"
+)
+
+def parse_llm_json(response_data: Dict[str, Any]) -> Any:
+    """Extracts and decodes the JSON content of a chat completion."""
+    if not response_data:
+        raise ValueError("No response from API")
+    content = response_data['choices'][0]['message']['content']
+    # Sanitize markdown code blocks if present
+    content_clean = content.replace("```json", "").replace("```", "").strip()
+    return json.loads(content_clean)
+
+def _classify_cache_key(email_text: str) -> str:
+    return cache_key("classify", email_text[:MAX_EMAIL_PREVIEW], model_router.tier_models(DEFAULT_TIER),
+                     CLASSIFY_PROMPT_VERSION)
+
 def classify_intent_llm(email_text: str) -> Dict[str, Any]:
     """Classifies email intent using LLM."""
-    system_prompt = (
-        "You are an email classifier. Your goal is to filter out spam and automated emails. "
-        "Classify the email into exactly one category: "
-        "'Meeting Request', 'Support Query', 'Information Request', 'Promotional/Notification', 'General'. "
-        "\nRULES:\n"
-        "1. Use 'Promotional/Notification' for ALL newsletters, marketing, automated welcome emails, 'Get Started' guides, status updates, and system alerts. If no human action is explicitly requested, it is Promotional.\n"
-        "2. Use 'General' ONLY if it appears to be a personal email from a human that requires a reply but fits no other category.\n"
+    if llm_cache is not None:
+        cached = llm_cache.get(_classify_cache_key(email_text))
+        if cached is not None:
+            return cached
+
+    system_prompt = CLASSIFY_RULES + (
         "3. Output ONLY valid JSON: {\"intent\": \"<Category>\", \"confidence\": <0.0-1.0>}"
     )
     
@@ -74,17 +125,80 @@ def classify_intent_llm(email_text: str) -> Dict[str, Any]:
     response_data = call_openrouter(messages)
     
     try:
-        if not response_data:
-            raise ValueError("No response from API")
-            
-        content = response_data['choices'][0]['message']['content']
-        # Sanitize markdown code blocks if present
-        content_clean = content.replace("```json", "").replace("```", "").strip()
-        classification = json.loads(content_clean)
-        return classification
-    except (KeyError, json.JSONDecodeError, ValueError) as e:
+        classification = parse_llm_json(response_data)
+    except (KeyError, IndexError, TypeError, json.JSONDecodeError, ValueError) as e:
         print(f"Warning: Intent classification failed ({e}). Defaulting to General.")
         return {"intent": "General", "confidence": 0.0}
+    if llm_cache is not None:
+        llm_cache.put(_classify_cache_key(email_text), classification)
+    return classification
+
+def plan_batches(email_texts: List[str], batch_size: int = CLASSIFY_BATCH_SIZE,
+                 token_budget: int = CLASSIFY_TOKEN_BUDGET) -> List[List[int]]:
+    """Groups email indexes into batches bounded by count and estimated prompt tokens."""
+    batches, current, used = [], [], 0
+    for i, text in enumerate(email_texts):
+        tokens = len(text[:MAX_EMAIL_PREVIEW]) // 4 + 1
+        if current and (len(current) >= batch_size or used + tokens > token_budget):
+            batches.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def classify_intents_llm_batch(email_texts: List[str], batch_size: int = CLASSIFY_BATCH_SIZE,
+                               token_budget: int = CLASSIFY_TOKEN_BUDGET) -> List[Dict[str, Any]]:
+    """
+    Classifies many emails with one LLM call per batch, so the system prompt
+    is paid once per batch instead of once per email. Returns one
+    classification per input, in order. Items the model drops or mangles
+    (or a whole batch whose reply isn't a JSON array) are re-classified one
+    by one with classify_intent_llm.
+    """
+    system_prompt = CLASSIFY_RULES + (
+        "3. You will receive a JSON array of emails, each {\"id\": <int>, \"text\": \"...\"}. "
+        "Classify every email independently.\n"
+        "4. Output ONLY a valid JSON array with one object per email: "
+        "[{\"id\": <int>, \"intent\": \"<Category>\", \"confidence\": <0.0-1.0>}]"
+    )
+    results: List[Any] = [None] * len(email_texts)
+    if llm_cache is not None:
+        for i, text in enumerate(email_texts):
+            results[i] = llm_cache.get(_classify_cache_key(text))
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    for batch in plan_batches([email_texts[i] for i in pending], batch_size, token_budget):
+        batch = [pending[i] for i in batch]
+        if len(batch) > 1:
+            packed = [{"id": i, "text": email_texts[i][:MAX_EMAIL_PREVIEW]} for i in batch]
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": json.dumps(packed, ensure_ascii=False)}
+            ]
+            try:
+                items = parse_llm_json(call_openrouter(messages))
+                if not isinstance(items, list):
+                    raise ValueError("Expected a JSON array")
+                for item in items:
+                    if not isinstance(item, dict) or item.get("id") not in batch or item.get("intent") not in INTENTS:
+                        continue
+                    try:
+                        confidence = float(item.get("confidence", 0.0))
+                    except (TypeError, ValueError):
+                        continue
+                    results[item["id"]] = {"intent": item["intent"], "confidence": confidence}
+                    if llm_cache is not None:
+                        llm_cache.put(_classify_cache_key(email_texts[item["id"]]), results[item["id"]])
+            except (KeyError, IndexError, TypeError, json.JSONDecodeError, ValueError) as e:
+                print(f"Warning: Batch classification failed ({e}). Falling back to per-email calls.")
+
+        for i in batch:
+            if results[i] is None:
+                results[i] = classify_intent_llm(email_texts[i])
+
+    return results
 
 def decide_strategy(intent: str) -> str:
     """Decides response strategy based on intent."""
@@ -98,6 +212,16 @@ def decide_strategy(intent: str) -> str:
 
 def generate_reply_llm(email_text: str, intent: str, strategy: str, sender_name: str) -> str:
     """Generates a professional reply using LLM."""
+    tier = reply_tier(intent, email_text)
+    key = None
+    if llm_cache is not None:
+        # Any model of the tier may answer (routing, failover, hedging)
+        key = cache_key("reply", email_text[:MAX_EMAIL_PREVIEW], model_router.tier_models(tier), REPLY_PROMPT_VERSION,
+                        intent=intent, strategy=strategy, sender_name=sender_name)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached
+
     system_prompt = (
         "You are a professional email assistant. "
         f"The email intent is '{intent}'. "
@@ -119,7 +243,10 @@ def generate_reply_llm(email_text: str, intent: str, strategy: str, sender_name:
         {"role": "user", "content": f"Incoming Email Body:\n{email_text[:MAX_EMAIL_PREVIEW]}\n\nDraft a reply:"}
     ]
     
-    response_data = call_openrouter(messages)
+    if REPLY_STREAMING:
+        return stream_reply_llm(messages, key, tier)
+
+    response_data = call_openrouter(messages, tier)
     
     try:
         if not response_data:
@@ -134,85 +261,239 @@ def generate_reply_llm(email_text: str, intent: str, strategy: str, sender_name:
             
         if not content:
              return "Thank you for your update. Best regards, AI Agent"
-             
+
+        if key is not None:
+            llm_cache.put(key, content)
         return content
     except (KeyError, IndexError):
         return "Error: Could not generate reply."
 
+def stream_reply_llm(messages: list, key: str = None, tier: str = DEFAULT_TIER) -> str:
+    """Streaming variant of the reply call; artifacts are stripped as tokens arrive."""
+    if not OPENROUTER_API_KEY:
+        print("Error: OPENROUTER_API_KEY environment variable not set.")
+        sys.exit(1)
+    payload = {"model": MODEL_NAME, "messages": messages, "temperature": 0.1}
+    try:
+        result = stream_reply(model_router.tier(tier), payload, OPENROUTER_API_KEY)
+    except LLMError as e:
+        print(f"API Request Failed: {e}")
+        return "Thank you for your response. Please let us know how you would like to proceed. Best regards, AI Agent"
+    print(f"   ✍️  Reply streamed in {result['total_ms']:.0f} ms "
+          f"(first token {result['ttft_ms']} ms, {result['tokens']} tokens, {result['stop_reason']})")
+    if not result["reply"]:
+        return "Thank you for your update. Best regards, AI Agent"
+    if key is not None:
+        llm_cache.put(key, result["reply"])
+    return result["reply"]
+
+_memory_log = None
+
+def get_memory_log() -> InteractionLog:
+    """The append-only interaction log, opened (and memory.json imported) on first use."""
+    global _memory_log
+    if _memory_log is None:
+        _memory_log = open_interaction_log(MEMORY_DIR, MEMORY_FILE)
+    return _memory_log
+
 def save_to_memory(record: Dict[str, Any]):
-    """Stores interaction in memory.json."""
-    data = []
-    if os.path.exists(MEMORY_FILE):
-        try:
-            with open(MEMORY_FILE, 'r') as f:
-                content = f.read()
-                if content.strip():
-                    data = json.loads(content)
-        except (IOError, json.JSONDecodeError):
-            data = []
-            
-    data.append(record)
-    
+    """Appends an interaction to the memory log."""
     try:
-        with open(MEMORY_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-    except IOError as e:
+        get_memory_log().append(record)
+    except (IOError, OSError) as e:
         print(f"Error saving to memory: {e}")
 
-def send_email(to_email: str, subject: str, body: str):
-    """Sends the reply via SMTP."""
+def read_memory():
+    """Streams all stored interactions, oldest first."""
+    return get_memory_log().read()
+
+def close_memory():
+    global _memory_log
+    if _memory_log is not None:
+        _memory_log.close()
+        _memory_log = None
+
+def load_sync_state(user: str) -> Dict[str, int]:
+    """This account's incremental sync position (see backend/mail_sync.py)."""
+    try:
+        with open(SYNC_STATE_FILE, 'r') as f:
+            return json.load(f).get(user, new_sync_state())
+    except (IOError, json.JSONDecodeError):
+        return new_sync_state()
+
+def save_sync_state(user: str, state: Dict[str, int]):
+    try:
+        with open(SYNC_STATE_FILE, 'r') as f:
+            data = json.load(f)
+    except (IOError, json.JSONDecodeError):
+        data = {}
+    data[user] = state
+    # Write-then-rename so a crash never leaves a half-written file
+    tmp = SYNC_STATE_FILE + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, SYNC_STATE_FILE)
+
+def send_email(to_email: str, subject: str, body: str) -> bool:
+    """Sends the reply via SMTP. Returns whether it was sent."""
     if not EMAIL_USER or not EMAIL_PASS:
         print("Skipping email send: Credentials not found.")
-        return
+        return False
 
     msg = MIMEText(body)
     msg['Subject'] = f"Re: {subject}"
     msg['From'] = EMAIL_USER
     msg['To'] = to_email
 
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASS)
-            server.send_message(msg)
+    result = smtp_pool.send(EMAIL_USER, EMAIL_PASS, msg)
+    if result["sent"]:
         print(f"✅ Reply sent to {to_email}")
-    except Exception as e:
-        print(f"❌ Failed to send email: {e}")
+    else:
+        print(f"❌ Failed to send email: {result['error']}")
+    return result["sent"]
 
 def is_noreply(sender: str) -> bool:
     """Checks if the sender is a no-reply address."""
-    sender_lower = sender.lower()
-    noreply_patterns = ["noreply", "no-reply", "do-not-reply", "donotreply", "mailer-daemon", "notification"]
-    return any(pattern in sender_lower for pattern in noreply_patterns)
+    return is_noreply_address(sender)
 
 def classify_intent_rules(text: str, sender: str, subject: str) -> Dict[str, Any]:
     """Classifies email intent using fast keyword rules (No LLM)."""
-    text_lower = text.lower()
-    subject_lower = subject.lower()
-    sender_lower = sender.lower()
-    
-    # 1. Promotional / Automated
-    promo_keywords = [
-        "unsubscribe", "newsletter", "offer", "discount", "sale", "welcome", 
-        "verify", "alert", "security", "code", "login", "update", "marketing",
-        "noreply", "no-reply", "notification", "statement", "receipt"
-    ]
-    if any(k in text_lower for k in promo_keywords) or \
-       any(k in sender_lower for k in promo_keywords):
-        return {"intent": "Promotional/Notification", "confidence": 1.0}
+    # One precompiled scan (see backend/intent_rules.py); keyword lists are
+    # configurable via INTENT_KEYWORDS_FILE. Precedence:
+    # 1. Promotional / Automated  2. Meeting Request  3. Support Query  4. General
+    return intent_matcher.classify(text, sender)
+
+def classify_intents(email_texts: List[str], senders: List[str],
+                     threshold: float = INTENT_MODEL_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    Tiered classification: keyword rules, then the local model (one
+    vectorized pass) for texts no keyword matched, then the LLM (batched)
+    only for those the model scored below `threshold`. Each result says
+    which tier decided it. Without a trained model the rules' answer stands.
+    """
+    results = []
+    for text, sender in zip(email_texts, senders):
+        results.append({**classify_intent_rules(text, sender, ""), "tier": "rules"})
+    undecided = [i for i, r in enumerate(results) if not r["hits"]]
+    if local_model is None or not undecided:
+        return results
+
+    escalate = []
+    for i, guess in zip(undecided, local_model.classify_batch([email_texts[i] for i in undecided])):
+        if guess["confidence"] >= threshold:
+            results[i] = {**guess, "tier": "model"}
+        else:
+            escalate.append(i)
+    if escalate:
+        for i, answer in zip(escalate, classify_intents_llm_batch([email_texts[i] for i in escalate])):
+            results[i] = {**answer, "tier": "llm"}
+    return results
+
+# process_message()'s `reason` when automation.reason() hasn't been run yet
+_UNCHECKED = object()
+
+def classify_fetched(msgs, reasons: Dict[str, Any]) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    """
+    uid -> (clean text, classification) for the fetched messages that will
+    reach classification, in one classify_intents() call so the local model
+    and the LLM see the whole batch.
+    """
+    todo = []
+    for msg in msgs:
+        if getattr(msg, "unreadable", False) is True or is_noreply(msg.from_) or reasons.get(msg.uid):
+            continue
+        text = message_text(msg)
+        if text:
+            todo.append((msg, text))
+    if not todo:
+        return {}
+    results = classify_intents([text for _, text in todo], [msg.from_ for msg, _ in todo])
+    return {msg.uid: (text, result) for (msg, text), result in zip(todo, results)}
+
+def process_message(msg, reason=_UNCHECKED, classified: Optional[Tuple[str, Dict[str, Any]]] = None) -> bool:
+    """
+    Handles one email. Returns False if it should be retried next run.
+    `classified` is classify_fetched()'s entry for it, when it was batched.
+    """
+    print(f"\n📧 Processing: {msg.subject} from {msg.from_}")
+
+    if getattr(msg, "unreadable", False) is True:
+        print("⚠️ Message could not be read, leaving it unread.")
+        return False
+
+    if is_noreply(msg.from_):
+        print(f"🚫 Skipping no-reply sender: {msg.from_}")
+        return True
 
-    # 2. Meeting Request
-    meeting_keywords = ["meeting", "zoom", "teams", "calendly", "schedule", "availability", "meet"]
-    if any(k in text_lower for k in meeting_keywords):
-        return {"intent": "Meeting Request", "confidence": 0.9}
+    if reason is _UNCHECKED:
+        reason = automation.reason(msg, EMAIL_USER)
+    if reason:
+        print(f"🚫 Skipping automated mail ({reason})")
+        if reason != "Sender Reputation":
+            automation.learn(EMAIL_USER, [(msg.from_, True)])
+        return True
 
-    # 3. Support Query
-    support_keywords = ["help", "issue", "problem", "error", "fail", "broken", "bug", "support", "ticket"]
-    if any(k in text_lower for k in support_keywords):
-        return {"intent": "Support Query", "confidence": 0.9}
+    # 1. Perception: plain text without markup or quoted replies, capped at BODY_TEXT_LIMIT
+    email_text_clean = classified[0] if classified else message_text(msg)
+    if not email_text_clean:
+        print("Empty body, skipping.")
+        return True
+    
+    # 2. Reasoning (rules -> local model -> LLM)
+    classification = classified[1] if classified else classify_intents([email_text_clean], [msg.from_])[0]
+    intent = classification.get("intent", "General")
+    confidence = classification.get("confidence", 0.0)
+    
+    # OUTPUT ONLY
+    print(f"   🎯 Classification: {intent} ({confidence}, {classification['tier']})")
 
-    # 4. Fallback
-    return {"intent": "General", "confidence": 0.5}
+    # If it is NOT promotional, we should propose a reply
+    if intent in ["General", "Meeting Request", "Support Query", "Information Request"]:
+        print("\n   💡 Valuable email detected. Analyzing body and drafting reply...")
+        
+        # 3. Decision
+        strategy = decide_strategy(intent)
+        
+        # Extract name from sender (e.g. "John Doe <john@doe.com>" -> "John Doe")
+        sender_name = msg.from_values.name if msg.from_values and msg.from_values.name else "there"
+        
+        # 4. Action (Drafting)
+        reply_body = generate_reply_llm(email_text_clean, intent, strategy, sender_name)
+        
+        # Approval Step
+        print("\n" + "-"*40)
+        print(f"📝 Proposed Reply to: {msg.from_}")
+        print(f"Subject: Re: {msg.subject}")
+        print(f"Body:\n{reply_body}")
+        print("-" * 40)
+        
+        user_approval = input("❓ Send this reply? (y/N): ").lower().strip()
+        if user_approval == 'y':
+            if not send_email(msg.from_, msg.subject, reply_body):
+                # Left unread so the next run offers it again
+                return False
+            generated_reply_result = reply_body
+        else:
+            print("❌ Reply skipped by user.")
+            generated_reply_result = "[SKIPPED BY USER] " + reply_body
+    else:
+        generated_reply_result = "N/A (Promotional/Ignored)"
+    
+    # 5. Memory (Log the classification)
+    record = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "sender": msg.from_,
+        "subject": msg.subject,
+        "email_text": email_text_clean[:200], 
+        "intent": intent,
+        "confidence": confidence,
+        "generated_reply": generated_reply_result
+    }
+    save_to_memory(record)
+    # A promotional verdict may be a keyword false positive, so only people count
+    if intent != "Promotional/Notification":
+        automation.learn(EMAIL_USER, [(msg.from_, False)])
+    return True
 
 def process_emails():
     """Main loop to fetch and process unread emails."""
@@ -234,79 +515,38 @@ def process_emails():
 
     print(f"Connecting to {IMAP_SERVER} as {EMAIL_USER}...")
     
+    state = load_sync_state(EMAIL_USER)
     try:
         with MailBox(IMAP_SERVER).login(EMAIL_USER, EMAIL_PASS) as mailbox:
-            # Fetch LATEST UNSEEN messages first (limit to 20 for speed)
-            print("Fetching latest 20 unread emails...")
-            msgs = mailbox.fetch(AND(seen=False), limit=20, reverse=True)
-            
-            for msg in msgs:
-                print(f"\n📧 Processing: {msg.subject} from {msg.from_}")
+            # Only unread mail above the last processed UID, oldest first, in bulk batches
+            candidates, highest_uid = pending_uids(mailbox, state)
+            print(f"Fetching {len(candidates)} new unread emails...")
+            handled = set()
+            stats = FetchStats()
 
-                if is_noreply(msg.from_):
-                    print(f"🚫 Skipping no-reply sender: {msg.from_}")
-                    continue
-                
-                # 1. Perception
-                email_text = msg.text or msg.html
-                if not email_text:
-                    print("Empty body, skipping.")
-                    continue
-                
-                # Normalize
-                email_text_clean = email_text.strip()
-                if not email_text_clean:
-                    continue
-                
-                # 2. Reasoning (Rule-based)
-                classification = classify_intent_rules(email_text_clean, msg.from_, msg.subject)
-                intent = classification.get("intent", "General")
-                confidence = classification.get("confidence", 0.0)
-                
-                # OUTPUT ONLY
-                print(f"   🎯 Classification: {intent} ({confidence})")
-
-                # If it is NOT promotional, we should propose a reply
-                if intent in ["General", "Meeting Request", "Support Query", "Information Request"]:
-                    print("\n   💡 Valuable email detected. Analyzing body and drafting reply...")
-                    
-                    # 3. Decision
-                    strategy = decide_strategy(intent)
-                    
-                    # Extract name from sender (e.g. "John Doe <john@doe.com>" -> "John Doe")
-                    sender_name = msg.from_values.name if msg.from_values and msg.from_values.name else "there"
-                    
-                    # 4. Action (Drafting)
-                    reply_body = generate_reply_llm(email_text_clean, intent, strategy, sender_name)
-                    
-                    # Approval Step
-                    print("\n" + "-"*40)
-                    print(f"📝 Proposed Reply to: {msg.from_}")
-                    print(f"Subject: Re: {msg.subject}")
-                    print(f"Body:\n{reply_body}")
-                    print("-" * 40)
-                    
-                    user_approval = input("❓ Send this reply? (y/N): ").lower().strip()
-                    if user_approval == 'y':
-                        send_email(msg.from_, msg.subject, reply_body)
-                        generated_reply_result = reply_body
-                    else:
-                        print("❌ Reply skipped by user.")
-                        generated_reply_result = "[SKIPPED BY USER] " + reply_body
-                else:
-                    generated_reply_result = "N/A (Promotional/Ignored)"
-                
-                # 5. Memory (Log the classification)
-                record = {
-                    "timestamp": datetime.datetime.now().isoformat(),
-                    "sender": msg.from_,
-                    "subject": msg.subject,
-                    "email_text": email_text_clean[:200], 
-                    "intent": intent,
-                    "confidence": confidence,
-                    "generated_reply": generated_reply_result
-                }
-                save_to_memory(record)
+            try:
+                # Headers first; bodies only for mail that isn't dropped on its headers
+                # Header verdicts, computed once for the body fetch and for processing
+                reasons = {}
+
+                def needs_body(m):
+                    reasons[m.uid] = automation.reason(m, EMAIL_USER)
+                    return reasons[m.uid] is None
+
+                for batch in fetch_batches(mailbox, candidates, needs_body, stats=stats):
+                    # The whole batch is classified before the first reply is drafted
+                    classified = classify_fetched(batch, reasons)
+                    for msg in batch:
+                        if process_message(msg, reasons.pop(msg.uid, _UNCHECKED), classified.get(msg.uid)):
+                            handled.add(int(msg.uid))
+            finally:
+                print(f"\n📦 Fetched {stats.fetched_bytes} bytes "
+                      f"({stats.header_bytes} headers, {stats.body_bytes} bodies for {stats.bodies} messages), "
+                      f"skipped {stats.as_dict()['skipped_bytes']}")
+                # Flag only what was dealt with; the rest stays unread for next run
+                mark_seen(mailbox, sorted(handled))
+                advance(state, candidates, handled, highest_uid)
+                save_sync_state(EMAIL_USER, state)
                 
     except Exception as e:
         print(f"❌ critical error in email loop: {e}")
@@ -317,6 +557,12 @@ def main():
         return
         
     process_emails()
+    smtp_pool.close_all()
+    llm_client.close()
+    close_memory()
+    if llm_cache is not None:
+        stats = llm_cache.stats()
+        print(f"🗃️ LLM cache: {stats['hits']} hits, {stats['misses']} misses")
 
 if __name__ == "__main__":
     main()
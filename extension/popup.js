@@ -1,5 +1,10 @@
 const API_URL = "http://127.0.0.1:8000";
 
+// Live status pushed by the server (GET /status/stream); replaces polling POST /status
+let statusSource = null;
+let statusTimer = null;
+let currentStatus = null;
+
 document.addEventListener('DOMContentLoaded', async () => {
     // Check local storage for session
     const stored = await chrome.storage.local.get("email");
@@ -14,6 +19,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     document.getElementById('toggleBtn').addEventListener('click', handleToggle);
     document.getElementById('logout').addEventListener('click', handleLogout);
     document.getElementById('saveSettings').addEventListener('click', handleSettings);
+    document.getElementById('draftBtn').addEventListener('click', handleDraft);
 
     document.getElementById('helpLink').addEventListener('click', () => {
         chrome.tabs.create({ url: "https://myaccount.google.com/apppasswords" });
@@ -34,8 +40,8 @@ async function handleSettings() {
             body: JSON.stringify({ email: stored.email, interval: interval })
         });
         if (res.ok) {
+            // The new schedule arrives over the status stream
             showMessage("Settings saved!");
-            showStatus(stored.email); // Refresh view
         } else {
             const err = await res.json();
             showMessage(err.detail || "Failed to save settings.");
@@ -102,8 +108,7 @@ async function handleToggle() {
             body: JSON.stringify({ email: stored.email, active: newState })
         });
         if (res.ok) {
-            // Re-fetch full status to update timers and UI correctly
-            showStatus(stored.email);
+            // The status stream pushes the new state
         } else if (res.status === 404) {
             // User deleted from server, force re-login
             showMessage("Session expired. Please login again.");
@@ -119,7 +124,68 @@ async function handleToggle() {
     }
 }
 
+async function handleDraft() {
+    const stored = await chrome.storage.local.get("email");
+    const text = document.getElementById('draftInput').value.trim();
+    if (!stored.email || !text) return;
+
+    const btn = document.getElementById('draftBtn');
+    const output = document.getElementById('draftOutput');
+    const metrics = document.getElementById('draftMetrics');
+    output.innerText = "";
+    metrics.innerText = "";
+    btn.disabled = true;
+    try {
+        const res = await fetch(`${API_URL}/draft`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ email: stored.email, text: text })
+        });
+        if (!res.ok) {
+            const err = await res.json();
+            showMessage(err.detail || "Could not generate a draft.");
+            return;
+        }
+        // Server-Sent Events over a POST body: read the stream and split on blank lines
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let end;
+            while ((end = buffer.indexOf("\n\n")) >= 0) {
+                handleDraftEvent(buffer.slice(0, end), output, metrics);
+                buffer = buffer.slice(end + 2);
+            }
+        }
+    } catch (e) {
+        showMessage("Server connection failed.");
+    } finally {
+        btn.disabled = false;
+    }
+}
+
+function handleDraftEvent(raw, output, metrics) {
+    let event = "message";
+    let data = "";
+    for (const line of raw.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+    }
+    const value = data ? JSON.parse(data) : null;
+    if (event === "delta") {
+        output.innerText += value;
+    } else if (event === "done") {
+        metrics.innerText = `first token ${Math.round(value.ttft_ms)} ms · total ${Math.round(value.total_ms)} ms · ${value.tokens} tokens`;
+    } else if (event === "error") {
+        showMessage(value);
+    }
+}
+
 async function handleLogout() {
+    closeStatusStream();
     await chrome.storage.local.remove("email");
     showLogin();
 }
@@ -127,22 +193,82 @@ async function handleLogout() {
 async function showStatus(email) {
     document.getElementById('loginForm').style.display = 'none';
     document.getElementById('statusCard').style.display = 'block';
+    document.getElementById('draftCard').style.display = 'block';
     document.getElementById('userDisplay').innerText = email;
 
-    // Fetch current status
-    try {
-        const res = await fetch(`${API_URL}/status?email=${encodeURIComponent(email)}`, { method: 'POST' });
-        if (res.status === 404) {
-            // Invalid session
-            console.log("User not found on server, logging out.");
-            await handleLogout();
-            return;
+    openStatusStream(email);
+}
+
+function openStatusStream(email) {
+    closeStatusStream();
+    const source = new EventSource(`${API_URL}/status/stream?email=${encodeURIComponent(email)}`);
+    statusSource = source;
+    let connected = false;
+
+    source.addEventListener('status', (e) => {
+        connected = true;
+        currentStatus = JSON.parse(e.data);
+        updateStatusUI(currentStatus);
+    });
+    source.addEventListener('cycle_started', () => {
+        if (!currentStatus) return;
+        currentStatus.running = true;
+        currentStatus.recent = [];
+        updateStatusUI(currentStatus);
+    });
+    source.addEventListener('action', (e) => {
+        if (!currentStatus) return;
+        currentStatus.recent = (currentStatus.recent || []).concat([JSON.parse(e.data)]);
+        updateStatusUI(currentStatus);
+    });
+    source.addEventListener('cycle_finished', (e) => {
+        if (!currentStatus) return;
+        const data = JSON.parse(e.data);
+        currentStatus.running = false;
+        currentStatus.last_cycle = data;
+        currentStatus.next_due_at = data.next_due_at;
+        updateStatusUI(currentStatus);
+    });
+    source.onerror = async () => {
+        if (!connected) {
+            // Never got a snapshot: the account is unknown to the server (or it is down)
+            const res = await fetch(`${API_URL}/status?email=${encodeURIComponent(email)}`, { method: 'POST' }).catch(() => null);
+            if (res && res.ok && !(await res.json()).email) {
+                console.log("User not found on server, logging out.");
+                await handleLogout();
+                return;
+            }
         }
-        const data = await res.json();
-        updateStatusUI(data);
-    } catch (e) {
+        // EventSource reconnects by itself after a dropped connection
         document.getElementById('statusText').innerText = "Server Disconnected";
-    }
+    };
+
+    // Next Check counts down locally; no requests needed
+    statusTimer = setInterval(() => currentStatus && updateStatusUI(currentStatus), 30000);
+}
+
+function closeStatusStream() {
+    if (statusSource) statusSource.close();
+    if (statusTimer) clearInterval(statusTimer);
+    statusSource = null;
+    statusTimer = null;
+    currentStatus = null;
+}
+
+function nextRunText(data) {
+    if (data.running) return "Running...";
+    if (!data.last_run) return "Pending...";
+    const minutesLeft = Math.floor((data.next_due_at * 1000 - Date.now()) / 60000);
+    return minutesLeft <= 0 ? "Now/Soon" : `in ${minutesLeft} mins`;
+}
+
+function cycleText(data) {
+    const handled = (data.recent || []).length;
+    if (data.running) return `checking mail... ${handled} handled`;
+    if (!data.last_cycle) return "--";
+    if (data.last_cycle.error) return `error: ${data.last_cycle.error}`;
+    const replied = (data.recent || []).filter(a => a.action === "Replied").length;
+    return `${data.last_cycle.actions} messages, ${replied} replied`;
 }
 
 function updateStatusUI(data) {
@@ -152,7 +278,8 @@ function updateStatusUI(data) {
 
     // Update Timers
     document.getElementById('lastRun').innerText = data.last_run ? new Date(data.last_run).toLocaleTimeString() : "Never";
-    document.getElementById('nextRun').innerText = data.next_run || "--";
+    document.getElementById('nextRun').innerText = nextRunText(data);
+    document.getElementById('cycleText').innerText = cycleText(data);
     document.getElementById('intervalSelect').value = data.interval || 30;
 
     if (isActive) {
@@ -169,6 +296,7 @@ function updateStatusUI(data) {
 function showLogin() {
     document.getElementById('loginForm').style.display = 'flex';
     document.getElementById('statusCard').style.display = 'none';
+    document.getElementById('draftCard').style.display = 'none';
     document.getElementById('email').value = '';
     document.getElementById('app_password').value = '';
     document.getElementById('api_key').value = '';
@@ -0,0 +1,26 @@
+"""
+Shared test setup: puts backend/, the repo root and tests/ on sys.path and
+points every store the agent modules open at import time somewhere
+throwaway. Import it before any backend module.
+"""
+import os
+import sys
+import tempfile
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS_DIR)
+
+for path in (os.path.join(ROOT, "backend"), ROOT, TESTS_DIR):
+    if path not in sys.path:
+        sys.path.append(path)
+
+# Every LLM call must reach the (mocked) API, so no persistent cache
+os.environ.setdefault("LLM_CACHE_DB", "")
+# ...no sender reputation carried over from earlier runs
+os.environ.setdefault("REPUTATION_DB", "")
+# ...an in-memory outbox with no send rate limit
+os.environ.setdefault("OUTBOX_DB", "")
+os.environ.setdefault("OUTBOX_RATE_PER_MINUTE", "0")
+# ...and throwaway user/history databases for main
+os.environ.setdefault("USER_STORE", os.path.join(tempfile.mkdtemp(), "users.db"))
+os.environ.setdefault("HISTORY_DB", os.path.join(tempfile.mkdtemp(), "history.db"))
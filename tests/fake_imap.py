@@ -0,0 +1,445 @@
+"""
+Minimal in-process IMAP4rev1 server for tests and benchmarks.
+
+Supports what the agent uses: LOGIN, SELECT/EXAMINE, NOOP, IDLE, UID SEARCH
+(ALL/SEEN/UNSEEN/UID sets), UID FETCH (UID, FLAGS, RFC822.SIZE, BODY[...]
+sections incl. HEADER, HEADER.FIELDS, TEXT, numeric parts and <partial>
+ranges, BODYSTRUCTURE), UID STORE, EXPUNGE and LOGOUT. Plain TCP only.
+"""
+import re
+import email
+import email.utils
+import socket
+import threading
+import socketserver
+from typing import Dict, List, Optional
+
+
+class FakeMessage:
+    def __init__(self, uid: int, raw: bytes, flags=()):
+        self.uid = uid
+        self.raw = raw
+        self.flags = set(flags)
+        self.obj = email.message_from_bytes(raw)
+
+
+class FakeMailbox:
+    def __init__(self, uidvalidity: int = 1):
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages: List[FakeMessage] = []
+
+    def add(self, raw: bytes, seen: bool = False) -> int:
+        msg = FakeMessage(self.uidnext, raw, {"\\Seen"} if seen else ())
+        self.uidnext += 1
+        self.messages.append(msg)
+        return msg.uid
+
+
+def _tokenize(text: str) -> list:
+    """Splits IMAP arguments, keeping quoted strings and (...)/[...] groups whole."""
+    tokens, i, n = [], 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch == " ":
+            i += 1
+        elif ch == '"':
+            j = i + 1
+            buf = []
+            while j < n and text[j] != '"':
+                if text[j] == "\\":
+                    j += 1
+                buf.append(text[j])
+                j += 1
+            tokens.append("".join(buf))
+            i = j + 1
+        else:
+            depth, j = 0, i
+            while j < n and (depth or text[j] != " "):
+                if text[j] in "([":
+                    depth += 1
+                elif text[j] in ")]":
+                    depth -= 1
+                j += 1
+            tokens.append(text[i:j])
+            i = j
+    return tokens
+
+
+def _in_set(uid: int, spec: str, max_uid: int) -> bool:
+    for part in spec.split(","):
+        if ":" in part:
+            lo, hi = part.split(":")
+            lo = max_uid if lo == "*" else int(lo)
+            hi = max_uid if hi == "*" else int(hi)
+            if min(lo, hi) <= uid <= max(lo, hi):
+                return True
+        elif (max_uid if part == "*" else int(part)) == uid:
+            return True
+    return False
+
+
+def _part(obj, path: str):
+    """Returns the MIME part addressed by an IMAP section path like '1' or '2.1'."""
+    for index in path.split("."):
+        if obj.is_multipart():
+            obj = obj.get_payload()[int(index) - 1]
+        elif index != "1":
+            raise KeyError(path)
+    return obj
+
+
+def _bodystructure(obj) -> str:
+    if obj.is_multipart():
+        children = "".join(_bodystructure(p) for p in obj.get_payload())
+        return f'({children} "{obj.get_content_subtype().upper()}")'
+    maintype, subtype = obj.get_content_maintype(), obj.get_content_subtype()
+    charset = obj.get_content_charset()
+    params = f'("CHARSET" "{charset}")' if charset else "NIL"
+    cte = (obj.get("Content-Transfer-Encoding") or "7BIT").upper()
+    payload = obj.get_payload(decode=False)
+    size = len(payload.encode() if isinstance(payload, str) else payload or b"")
+    disposition = "NIL"
+    if obj.get_content_disposition():
+        disposition = f'("{obj.get_content_disposition().upper()}" NIL)'
+    base = f'("{maintype.upper()}" "{subtype.upper()}" {params} NIL NIL "{cte}" {size}'
+    if maintype == "text":
+        lines = payload.count("\n") if isinstance(payload, str) else 0
+        return f"{base} {lines} NIL {disposition} NIL)"
+    return f"{base} NIL {disposition} NIL)"
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.user = None
+        self.mailbox: Optional[FakeMailbox] = None
+        self.known_exists = 0
+        self.write_lock = threading.Lock()
+        self.idle_tag = None
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+        self.server.fake.bytes_sent += len(data)
+
+    def handle(self):
+        fake = self.server.fake
+        with fake.lock:
+            fake.sessions.add(self)
+        self.send("* OK [CAPABILITY IMAP4rev1 IDLE UIDPLUS] fake imap ready\r\n")
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                line = line.decode().rstrip("\r\n")
+                if self.idle_tag is not None:
+                    if line.upper() == "DONE":
+                        with fake.lock:
+                            fake.idlers.discard(self)
+                        self.send(f"{self.idle_tag} OK IDLE terminated\r\n")
+                        self.idle_tag = None
+                    continue
+                if not line:
+                    continue
+                tag, _, rest = line.partition(" ")
+                cmd, _, args = rest.partition(" ")
+                cmd = cmd.upper()
+                with fake.lock:
+                    fake.commands.append(cmd if cmd != "UID" else "UID " + args.split(" ", 1)[0].upper())
+                if fake.delay:
+                    threading.Event().wait(fake.delay)
+                if not self.dispatch(tag, cmd, args):
+                    return
+        except (ConnectionError, OSError):
+            return
+        finally:
+            with fake.lock:
+                fake.idlers.discard(self)
+                fake.sessions.discard(self)
+
+    def dispatch(self, tag: str, cmd: str, args: str) -> bool:
+        fake = self.server.fake
+        if cmd == "CAPABILITY":
+            self.send("* CAPABILITY IMAP4rev1 IDLE UIDPLUS\r\n")
+            self.send(f"{tag} OK CAPABILITY completed\r\n")
+        elif cmd == "LOGIN":
+            user, password = _tokenize(args)[:2]
+            if fake.users.get(user) != password:
+                self.send(f"{tag} NO [AUTHENTICATIONFAILED] Invalid credentials\r\n")
+            else:
+                with fake.lock:
+                    fake.logins += 1
+                self.user = user
+                self.send(f"{tag} OK LOGIN completed\r\n")
+        elif cmd in ("SELECT", "EXAMINE"):
+            if self.user is None:
+                self.send(f"{tag} BAD not authenticated\r\n")
+                return True
+            self.mailbox = fake.mailboxes[self.user]
+            with fake.lock:
+                self.known_exists = len(self.mailbox.messages)
+                self.send(
+                    "* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)\r\n"
+                    f"* {self.known_exists} EXISTS\r\n"
+                    "* 0 RECENT\r\n"
+                    f"* OK [UIDVALIDITY {self.mailbox.uidvalidity}] UIDs valid\r\n"
+                    f"* OK [UIDNEXT {self.mailbox.uidnext}] Predicted next UID\r\n"
+                )
+            self.send(f"{tag} OK [READ-WRITE] {cmd} completed\r\n")
+        elif cmd == "NOOP":
+            self.report_exists()
+            self.send(f"{tag} OK NOOP completed\r\n")
+        elif cmd == "IDLE":
+            self.idle_tag = tag
+            with fake.lock:
+                fake.idlers.add(self)
+            self.send("+ idling\r\n")
+            self.report_exists()
+        elif cmd == "UID":
+            sub, _, sub_args = args.partition(" ")
+            sub = sub.upper()
+            if sub == "SEARCH":
+                self.uid_search(tag, sub_args)
+            elif sub == "FETCH":
+                self.uid_fetch(tag, sub_args)
+            elif sub == "STORE":
+                self.uid_store(tag, sub_args)
+            else:
+                self.send(f"{tag} BAD unsupported UID {sub}\r\n")
+        elif cmd == "EXPUNGE":
+            with fake.lock:
+                for seq in range(len(self.mailbox.messages), 0, -1):
+                    if "\\Deleted" in self.mailbox.messages[seq - 1].flags:
+                        del self.mailbox.messages[seq - 1]
+                        self.send(f"* {seq} EXPUNGE\r\n")
+                self.known_exists = len(self.mailbox.messages)
+            self.send(f"{tag} OK EXPUNGE completed\r\n")
+        elif cmd == "LOGOUT":
+            self.send("* BYE logging out\r\n")
+            self.send(f"{tag} OK LOGOUT completed\r\n")
+            return False
+        else:
+            self.send(f"{tag} BAD unsupported command {cmd}\r\n")
+        return True
+
+    def report_exists(self):
+        if self.mailbox is None:
+            return
+        with self.server.fake.lock:
+            count = len(self.mailbox.messages)
+            if count != self.known_exists:
+                self.known_exists = count
+                self.send(f"* {count} EXISTS\r\n")
+
+    def uid_search(self, tag: str, args: str):
+        tokens = _tokenize(args)
+        if tokens and tokens[0].upper() == "CHARSET":
+            tokens = tokens[2:]
+        # Flatten a single parenthesised AND group
+        flat = []
+        for tok in tokens:
+            flat.extend(_tokenize(tok[1:-1]) if tok.startswith("(") else [tok])
+
+        with self.server.fake.lock:
+            messages = list(self.mailbox.messages)
+        max_uid = messages[-1].uid if messages else 0
+        result = []
+        for msg in messages:
+            ok, i = True, 0
+            while i < len(flat):
+                key = flat[i].upper()
+                if key == "UNSEEN":
+                    ok &= "\\Seen" not in msg.flags
+                elif key == "SEEN":
+                    ok &= "\\Seen" in msg.flags
+                elif key == "UID":
+                    i += 1
+                    ok &= _in_set(msg.uid, flat[i], max_uid)
+                elif key != "ALL":
+                    ok &= _in_set(msg.uid, flat[i], max_uid) if re.match(r"^[\d:*,]+$", key) else True
+                i += 1
+            if ok:
+                result.append(str(msg.uid))
+        self.send(f"* SEARCH {' '.join(result)}\r\n".replace("SEARCH \r\n", "SEARCH\r\n"))
+        self.send(f"{tag} OK SEARCH completed\r\n")
+
+    def uid_fetch(self, tag: str, args: str):
+        spec, _, items = args.partition(" ")
+        items = items.strip()
+        if items.startswith("("):
+            items = items[1:-1]
+        wanted = _tokenize(items)
+        with self.server.fake.lock:
+            messages = list(enumerate(self.mailbox.messages, 1))
+        max_uid = messages[-1][1].uid if messages else 0
+        for seq, msg in messages:
+            if not _in_set(msg.uid, spec, max_uid):
+                continue
+            head = [f"UID {msg.uid}"]
+            literals = []
+            for item in wanted:
+                upper = item.upper()
+                if upper == "UID":
+                    continue
+                elif upper == "FLAGS":
+                    continue
+                elif upper == "RFC822.SIZE":
+                    head.append(f"RFC822.SIZE {len(msg.raw)}")
+                elif upper == "BODYSTRUCTURE":
+                    head.append(f"BODYSTRUCTURE {_bodystructure(msg.obj)}")
+                elif upper.startswith("BODY"):
+                    literals.append(self.section(msg, item))
+            if any(w.upper().startswith("BODY[") for w in wanted):
+                msg.flags.add("\\Seen")
+            if any(w.upper() == "FLAGS" for w in wanted):
+                head.insert(1, f"FLAGS ({' '.join(sorted(msg.flags))})")
+
+            if not literals:
+                self.send(f"* {seq} FETCH ({' '.join(head)})\r\n")
+                continue
+            # First literal shares the line with the plain items
+            name, data = literals[0]
+            out = f"* {seq} FETCH ({' '.join(head)} {name} {{{len(data)}}}\r\n".encode() + data
+            for name, data in literals[1:]:
+                out += f" {name} {{{len(data)}}}\r\n".encode() + data
+            self.send(out + b")\r\n")
+        self.send(f"{tag} OK FETCH completed\r\n")
+
+    def section(self, msg: FakeMessage, item: str):
+        m = re.match(r"BODY(?:\.PEEK)?\[(?P<section>[^\]]*)\](?:<(?P<start>\d+)\.(?P<length>\d+)>)?", item, re.I)
+        section = m.group("section")
+        upper = section.upper()
+        header_bytes, _, text_bytes = msg.raw.partition(b"\r\n\r\n")
+        if not text_bytes and b"\r\n\r\n" not in msg.raw:
+            header_bytes, _, text_bytes = msg.raw.partition(b"\n\n")
+        if upper == "":
+            data = msg.raw
+        elif upper == "HEADER":
+            data = header_bytes + b"\r\n\r\n"
+        elif upper == "TEXT":
+            data = text_bytes
+        elif upper.startswith("HEADER.FIELDS"):
+            names = {n.lower() for n in _tokenize(section[section.index("(") + 1:-1])}
+            lines = []
+            for key, value in msg.obj.items():
+                if key.lower() in names:
+                    lines.append(f"{key}: {value}")
+            data = ("\r\n".join(lines) + "\r\n\r\n").encode()
+        else:
+            part = _part(msg.obj, section)
+            payload = part.get_payload(decode=False)
+            data = payload.encode() if isinstance(payload, str) else bytes(payload or b"")
+        name = f"BODY[{section}]"
+        if m.group("start") is not None:
+            start = int(m.group("start"))
+            data = data[start:start + int(m.group("length"))]
+            name += f"<{start}>"
+        return name, data
+
+    def uid_store(self, tag: str, args: str):
+        spec, mode, flags = _tokenize(args)[:3]
+        flag_set = set(_tokenize(flags.strip("()")))
+        with self.server.fake.lock:
+            messages = list(enumerate(self.mailbox.messages, 1))
+            max_uid = messages[-1][1].uid if messages else 0
+            for seq, msg in messages:
+                if not _in_set(msg.uid, spec, max_uid):
+                    continue
+                if mode.upper().startswith("+"):
+                    msg.flags |= flag_set
+                elif mode.upper().startswith("-"):
+                    msg.flags -= flag_set
+                else:
+                    msg.flags = set(flag_set)
+                self.send(f"* {seq} FETCH (UID {msg.uid} FLAGS ({' '.join(sorted(msg.flags))}))\r\n")
+        self.send(f"{tag} OK STORE completed\r\n")
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeImapServer:
+    """
+    Usage:
+        server = FakeImapServer({"me@example.com": "secret"}).start()
+        server.deliver("me@example.com", raw_bytes)
+        MailBoxUnencrypted(server.host, server.port).login(...)
+        server.stop()
+    """
+
+    def __init__(self, users: Dict[str, str], delay: float = 0.0):
+        self.users = dict(users)
+        self.mailboxes = {user: FakeMailbox() for user in users}
+        self.lock = threading.RLock()
+        self.idlers = set()
+        self.sessions = set()
+        self.logins = 0
+        self.commands: List[str] = []
+        self.bytes_sent = 0
+        self.delay = delay
+        self._server = None
+
+    def start(self) -> "FakeImapServer":
+        self._server = _ThreadingServer(("127.0.0.1", 0), _Handler)
+        self._server.fake = self
+        self.host, self.port = self._server.server_address
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self.drop_connections()
+
+    def add_user(self, user: str, password: str):
+        with self.lock:
+            self.users[user] = password
+            self.mailboxes.setdefault(user, FakeMailbox())
+
+    def deliver(self, user: str, raw: bytes, seen: bool = False) -> int:
+        """Adds a message and pushes EXISTS to any IDLE sessions of that user."""
+        with self.lock:
+            uid = self.mailboxes[user].add(raw, seen)
+            idlers = [h for h in self.idlers if h.user == user]
+        for handler in idlers:
+            try:
+                handler.report_exists()
+            except OSError:
+                pass
+        return uid
+
+    def drop_connections(self):
+        """Simulates the server closing every open session (e.g. idle timeout)."""
+        with self.lock:
+            sessions = list(self.sessions)
+            self.idlers.clear()
+        for handler in sessions:
+            try:
+                handler.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def make_message(sender: str, subject: str, body: str, to: str = "me@example.com",
+                 headers: Optional[Dict[str, str]] = None, html: Optional[str] = None) -> bytes:
+    """Builds a raw RFC 5322 message for seeding fake mailboxes."""
+    from email.message import EmailMessage
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg["Message-ID"] = email.utils.make_msgid(domain="example.com")
+    for key, value in (headers or {}).items():
+        msg[key] = value
+    msg.set_content(body)
+    if html is not None:
+        msg.add_alternative(html, subtype="html")
+    return msg.as_bytes().replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
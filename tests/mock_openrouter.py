@@ -0,0 +1,152 @@
+"""
+Local stand-in for the OpenRouter chat completions endpoint.
+
+    server = MockOpenRouter(latency=0.05, error_rate=0.1).start()
+    client = LLMClient(url=server.url)
+
+`responder(payload) -> str` decides the assistant message content (default:
+a short canned reply). `script` is an optional list of status codes returned
+before falling back to normal behaviour (e.g. [429, 503] to test retries).
+`per_model` overrides latency and/or status for individual models, e.g.
+{"slow/model": {"latency": 2}, "down/model": {"status": 503}}.
+Requests with `"stream": true` get the content back as SSE chunks of
+roughly one token each, `chunk_delay` seconds apart, cut off at the
+payload's max_tokens.
+"""
+import re
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+
+def default_responder(payload: dict) -> str:
+    return "Thank you for your email. Could you share your availability?\n\nBest regards,\nAI Agent"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        payload = json.loads(body or b"{}")
+        with mock.lock:
+            mock.requests.append({"payload": payload, "headers": dict(self.headers)})
+            mock.connections.add(self.client_address)
+            mock.inflight += 1
+            mock.peak_inflight = max(mock.peak_inflight, mock.inflight)
+            status = mock.script.pop(0) if mock.script else 200
+        model = mock.per_model.get(payload.get("model"), {})
+        status = model.get("status", status)
+        latency = model.get("latency", mock.latency)
+        try:
+            if latency:
+                time.sleep(latency)
+            if status == 200 and mock.error_rate and random.random() < mock.error_rate:
+                status = 503
+            if status != 200:
+                self.send_json(status, {"error": {"code": status, "message": "mock error"}})
+                return
+            content = mock.responder(payload)
+            prompt_tokens = sum(len(m.get("content", "")) for m in payload.get("messages", [])) // 4
+            if payload.get("stream"):
+                self.send_stream(content, payload, prompt_tokens)
+                return
+            completion_tokens = len(content) // 4
+            self.send_json(200, {
+                "id": "mock-1",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            })
+        finally:
+            with mock.lock:
+                mock.inflight -= 1
+
+    def send_stream(self, content: str, payload: dict, prompt_tokens: int):
+        mock = self.server.mock
+        max_tokens = payload.get("max_tokens")
+        # ~one token per chunk: each word with its leading whitespace
+        tokens = re.findall(r"\s*\S+|\s+$", content)
+        finish = "stop"
+        if max_tokens and len(tokens) > max_tokens:
+            tokens, finish = tokens[:max_tokens], "length"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for i, token in enumerate(tokens):
+                if mock.chunk_delay and i:
+                    time.sleep(mock.chunk_delay)
+                chunk = {"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                with mock.lock:
+                    mock.chunks_sent += 1
+            done = {"choices": [{"index": 0, "delta": {}, "finish_reason": finish}]}
+            if (payload.get("stream_options") or {}).get("include_usage"):
+                done["usage"] = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                                 "total_tokens": prompt_tokens + len(tokens)}
+            self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (early termination)
+            with mock.lock:
+                mock.aborted_streams += 1
+
+    def send_json(self, status: int, data: dict):
+        out = json.dumps(data).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (a cancelled hedge)
+            self.close_connection = True
+
+
+class MockOpenRouter:
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0,
+                 responder: Optional[Callable[[dict], str]] = None, script: Optional[List[int]] = None,
+                 chunk_delay: float = 0.0, per_model: Optional[Dict[str, dict]] = None):
+        self.latency = latency
+        self.per_model = dict(per_model or {})
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.responder = responder or default_responder
+        self.script = list(script or [])
+        self.lock = threading.Lock()
+        self.requests: List[dict] = []
+        self.connections = set()
+        self.inflight = 0
+        self.peak_inflight = 0
+        self.chunks_sent = 0
+        self.aborted_streams = 0
+        self._server = None
+
+    def start(self) -> "MockOpenRouter":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        host, port = self._server.server_address
+        self.url = f"http://{host}:{port}/api/v1/chat/completions"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
@@ -1,12 +1,12 @@
 import unittest
-import sys
 import os
 import json
+import shutil
+import tempfile
 from unittest.mock import patch, MagicMock
 
-# Add parent directory to path to import email_agent
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
 import email_agent
 
 class TestEmailAgent(unittest.TestCase):
@@ -26,19 +26,17 @@ class TestEmailAgent(unittest.TestCase):
             "Acknowledge receipt and ask how we can help."
         )
 
-    @patch('email_agent.requests.post')
-    def test_classify_intent_llm_success(self, mock_post):
+    @patch('email_agent.model_router.chat_sync')
+    def test_classify_intent_llm_success(self, mock_chat):
         """Test intent classification with valid LLM response."""
         # Mock successful API response
-        mock_response = MagicMock()
-        mock_response.json.return_value = {
+        mock_chat.return_value = {
             "choices": [{
                 "message": {
                     "content": '{"intent": "Support Query", "confidence": 0.95}'
                 }
             }]
         }
-        mock_post.return_value = mock_response
 
         # Need to mock API KEY if not set
         with patch('email_agent.OPENROUTER_API_KEY', 'test_key'):
@@ -47,18 +45,16 @@ class TestEmailAgent(unittest.TestCase):
         self.assertEqual(result['intent'], "Support Query")
         self.assertEqual(result['confidence'], 0.95)
 
-    @patch('email_agent.requests.post')
-    def test_classify_intent_llm_malformed_json(self, mock_post):
+    @patch('email_agent.model_router.chat_sync')
+    def test_classify_intent_llm_malformed_json(self, mock_chat):
         """Test graceful failure on malformed JSON."""
-        mock_response = MagicMock()
-        mock_response.json.return_value = {
+        mock_chat.return_value = {
             "choices": [{
                 "message": {
                     "content": 'This is not JSON'
                 }
             }]
         }
-        mock_post.return_value = mock_response
 
         with patch('email_agent.OPENROUTER_API_KEY', 'test_key'):
             # Should print warning (captured if needed) and return General
@@ -67,31 +63,127 @@ class TestEmailAgent(unittest.TestCase):
         self.assertEqual(result['intent'], "General")
         self.assertEqual(result['confidence'], 0.0)
 
+    @patch('email_agent.model_router.chat_sync')
+    def test_classify_batch_one_call(self, mock_chat):
+        """Test a batch is classified with a single request, results in input order."""
+        mock_chat.return_value = {
+            "choices": [{
+                "message": {
+                    "content": '```json\n[{"id": 1, "intent": "Support Query", "confidence": 0.8},'
+                               ' {"id": 0, "intent": "Meeting Request", "confidence": 0.9}]\n```'
+                }
+            }]
+        }
+
+        with patch('email_agent.OPENROUTER_API_KEY', 'test_key'):
+            results = email_agent.classify_intents_llm_batch(["Can we meet?", "Login is broken"])
+
+        self.assertEqual(mock_chat.call_count, 1)
+        self.assertEqual(results[0], {"intent": "Meeting Request", "confidence": 0.9})
+        self.assertEqual(results[1], {"intent": "Support Query", "confidence": 0.8})
+
+    @patch('email_agent.model_router.chat_sync')
+    def test_classify_batch_falls_back_per_item(self, mock_chat):
+        """Test malformed or missing batch items are re-classified one by one."""
+        def reply(content):
+            return {"choices": [{"message": {"content": content}}]}
+        mock_chat.side_effect = [
+            # Item 1 missing, item 2 has an unknown intent
+            reply('[{"id": 0, "intent": "General", "confidence": 0.7},'
+                  ' {"id": 2, "intent": "Spam", "confidence": 1}]'),
+            reply('{"intent": "Support Query", "confidence": 0.6}'),
+            reply('{"intent": "Promotional/Notification", "confidence": 0.9}'),
+            # Whole batch unparseable
+            reply('Sorry, I cannot help with that.'),
+            reply('{"intent": "Meeting Request", "confidence": 0.9}'),
+            reply('{"intent": "General", "confidence": 0.5}'),
+        ]
+
+        with patch('email_agent.OPENROUTER_API_KEY', 'test_key'):
+            results = email_agent.classify_intents_llm_batch(["a", "b", "c", "d", "e"], batch_size=3)
+
+        self.assertEqual(mock_chat.call_count, 6)
+        self.assertEqual([r["intent"] for r in results],
+                         ["General", "Support Query", "Promotional/Notification", "Meeting Request", "General"])
+
+    def test_plan_batches(self):
+        """Test batches are capped by size and by estimated token budget."""
+        self.assertEqual(email_agent.plan_batches(["x"] * 5, batch_size=2, token_budget=1000),
+                         [[0, 1], [2, 3], [4]])
+        # ~100 tokens each (400 chars); the budget fits two
+        self.assertEqual(email_agent.plan_batches(["y" * 400] * 3, batch_size=10, token_budget=250),
+                         [[0, 1], [2]])
+        # A single email over budget still gets its own batch
+        self.assertEqual(email_agent.plan_batches(["z" * 400], batch_size=10, token_budget=10), [[0]])
+
+    def test_failed_send_is_retried(self):
+        """Test an approved reply that fails to send leaves the email for the next run."""
+        msg = MagicMock(subject="Login", from_="ann@example.com", text="I cannot log in, please help", html="")
+        msg.from_values.name = "Ann"
+        with patch('email_agent.generate_reply_llm', return_value="We are on it."), \
+             patch('email_agent.send_email', return_value=False), \
+             patch('email_agent.save_to_memory') as save, \
+             patch('builtins.input', return_value="y"):
+            self.assertFalse(email_agent.process_message(msg))
+            save.assert_not_called()
+            with patch('email_agent.send_email', return_value=True):
+                self.assertTrue(email_agent.process_message(msg))
+            save.assert_called_once()
+
+    def test_fetched_batch_is_classified_once(self):
+        """Test one classify_intents call covers a fetched batch, skipping mail dropped on its headers."""
+        def mail(uid, sender, text):
+            msg = MagicMock(uid=uid, from_=sender, text=text, html="", unreadable=False)
+            msg.from_values.name = ""
+            return msg
+
+        batch = [mail("1", "ann@example.com", "Can we meet on Monday?"), mail("2", "noreply@shop.com", "Sale"),
+                 mail("3", "list@example.com", "Digest"), mail("4", "bob@example.com", "My login is broken")]
+        with patch('email_agent.classify_intents', wraps=email_agent.classify_intents) as classify:
+            classified = email_agent.classify_fetched(batch, {"3": "Mailing List", "4": None})
+        classify.assert_called_once()
+        self.assertEqual(sorted(classified), ["1", "4"])
+        self.assertEqual(classified["1"][1]["intent"], "Meeting Request")
+        with patch('email_agent.classify_intents') as classify, \
+             patch('email_agent.save_to_memory'), patch('email_agent.automation'), \
+             patch('email_agent.generate_reply_llm', return_value="Sure."), patch('builtins.input', return_value="n"):
+            self.assertTrue(email_agent.process_message(batch[0], None, classified["1"]))
+        classify.assert_not_called()
+
     def test_save_to_memory(self):
-        """Test that memory file is created and updated."""
-        test_file = "test_memory.json"
-        
-        # Patch the MEMORY_FILE constant
-        with patch('email_agent.MEMORY_FILE', test_file):
-            if os.path.exists(test_file):
-                os.remove(test_file)
-            
-            email_agent.save_to_memory(
-                "test email",
-                {"intent": "Test", "confidence": 1.0},
-                "test reply"
-            )
-            
-            self.assertTrue(os.path.exists(test_file))
-            
-            with open(test_file, 'r') as f:
-                data = json.load(f)
-                
-            self.assertEqual(len(data), 1)
+        """Test that records are appended to the memory log and read back."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with patch('email_agent.MEMORY_DIR', os.path.join(tmpdir, "memory")), \
+                 patch('email_agent.MEMORY_FILE', os.path.join(tmpdir, "memory.json")):
+                email_agent.save_to_memory({"email_text": "test email", "intent": "Test", "confidence": 1.0})
+                email_agent.save_to_memory({"email_text": "second", "intent": "Test", "confidence": 1.0})
+                data = list(email_agent.read_memory())
+                email_agent.close_memory()
+
+            self.assertEqual(len(data), 2)
             self.assertEqual(data[0]['email_text'], "test email")
-            
-            # Clean up
-            os.remove(test_file)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_memory_imports_legacy_json(self):
+        """Test an existing memory.json is imported once, then kept as .bak."""
+        tmpdir = tempfile.mkdtemp()
+        legacy = os.path.join(tmpdir, "memory.json")
+        with open(legacy, 'w') as f:
+            json.dump([{"email_text": "old one"}, {"email_text": "old two"}], f, indent=2)
+        try:
+            with patch('email_agent.MEMORY_DIR', os.path.join(tmpdir, "memory")), \
+                 patch('email_agent.MEMORY_FILE', legacy):
+                email_agent.save_to_memory({"email_text": "new"})
+                data = [r["email_text"] for r in email_agent.read_memory()]
+                email_agent.close_memory()
+
+            self.assertEqual(data, ["old one", "old two", "new"])
+            self.assertFalse(os.path.exists(legacy))
+            self.assertTrue(os.path.exists(legacy + ".bak"))
+        finally:
+            shutil.rmtree(tmpdir)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import time
+import threading
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+import agent_logic
+from imap_pool import ImapPool
+from fake_imap import FakeImapServer, make_message
+
+USER = "me@example.com"
+PASSWORD = "secret"
+
+class TestAgentPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeImapServer({USER: PASSWORD}).start()
+        self.pool = ImapPool(self.server.host, self.server.port, ssl=False, timeout=5)
+        self.pool_patch = patch('agent_logic.imap_pool', self.pool)
+        self.pool_patch.start()
+
+    def tearDown(self):
+        self.pool_patch.stop()
+        self.pool.close_all()
+        self.server.stop()
+
+    def deliver(self, sender, subject, body):
+        self.server.deliver(USER, make_message(sender, subject, body))
+
+    def test_llm_calls_overlap_and_log_order_is_kept(self):
+        """Test replies are drafted in parallel while logs stay in fetch order."""
+        for i in range(4):
+            self.deliver(f"Person {i} <p{i}@example.com>", f"Question {i}", "Can we meet next week?")
+        self.deliver("noreply@service.com", "Ignored", "hello")
+
+        active, peak = [], []
+        lock = threading.Lock()
+
+        def slow_reply(body, intent, strategy, sender_name, api_key, user_email=None):
+            with lock:
+                active.append(sender_name)
+                peak.append(len(active))
+            time.sleep(0.2)
+            with lock:
+                active.remove(sender_name)
+            return f"Hi {sender_name}"
+
+        start = time.time()
+        with patch('agent_logic.generate_reply_llm', slow_reply), \
+             patch('agent_logic.send_email', return_value=True):
+            logs, _ = agent_logic.run_agent_cycle(USER, PASSWORD, "key")
+        elapsed = time.time() - start
+
+        # Oldest first (ascending UID), one entry per message
+        self.assertEqual([l["subject"] for l in logs],
+                         ["Question 0", "Question 1", "Question 2", "Question 3", "Ignored"])
+        self.assertEqual(logs[-1]["action"], "Ignored (No-Reply)")
+        self.assertTrue(all(l["action"] == "Replied" for l in logs[:-1]))
+        self.assertGreater(max(peak), 1)
+        self.assertLess(elapsed, 0.6)
+
+    def test_send_failure_is_logged(self):
+        """Test a failed send leaves that reply queued for retry, and the rest go out."""
+        self.deliver("a@example.com", "First", "Please help with this bug")
+        self.deliver("b@example.com", "Second", "Please help with this bug")
+
+        def flaky_send(to, subject, body, user_email, app_pass, **headers):
+            return to != "b@example.com"
+
+        with patch('agent_logic.generate_reply_llm', return_value="Looking into it."), \
+             patch('agent_logic.send_email', flaky_send):
+            logs, _ = agent_logic.run_agent_cycle(USER, PASSWORD, "key")
+
+        self.assertEqual([(l["subject"], l["action"]) for l in logs],
+                         [("First", "Replied"), ("Second", "Reply Queued")])
+        queued = agent_logic.outbox.claim(now=time.time() + 3600)
+        self.assertIn("b@example.com", [entry["to_addr"] for entry in queued])
+        self.assertNotIn("a@example.com", [entry["to_addr"] for entry in queued])
+
+    def test_imap_error_is_appended_after_processed_messages(self):
+        """Test the return shape when the mailbox can't be opened."""
+        logs, timestamp = agent_logic.run_agent_cycle(USER, "wrong", "key")
+        self.assertEqual(len(logs), 1)
+        self.assertIn("error", logs[0])
+        self.assertTrue(timestamp)
+
+    def test_only_header_verdicts_count_as_automated(self):
+        """Test keyword (promotional) and reputation verdicts aren't learned as automated."""
+        logs = [
+            {"sender": "a@x.com", "action": "Ignored (Automated)", "automated": "Mailing List"},
+            {"sender": "b@x.com", "action": "Ignored (Automated)", "automated": "Sender Reputation"},
+            {"sender": "c@x.com", "action": "Ignored (Promotional)", "intent": "Promotional/Notification"},
+            {"sender": "d@x.com", "action": "Replied", "intent": "General"},
+            {"sender": "e@x.com", "action": "Replied", "intent": "General", "error": "boom"},
+        ]
+        self.assertEqual(list(agent_logic._sender_outcomes(logs)), [("a@x.com", True), ("d@x.com", False)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+# Add backend directory to path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "backend"))
+
+from automation import AutomationDetector, SenderReputation, header_reason, is_noreply_address
+
+USER = "me@example.com"
+CORPUS = os.path.join(ROOT, "tests", "fixtures", "automation_corpus.jsonl")
+
+def message(sender, **headers):
+    return SimpleNamespace(from_=sender, headers={k.lower().replace("_", "-"): (v,) for k, v in headers.items()})
+
+class TestAutomationDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "reputation.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_header_rules(self):
+        """Test each standard header marks a message automated, and their absence doesn't."""
+        self.assertEqual(header_reason(message("a@x.com", Auto_Submitted="auto-replied").headers, "a@x.com"),
+                         "Auto-Submitted")
+        self.assertIsNone(header_reason(message("a@x.com", Auto_Submitted="no").headers, "a@x.com"))
+        self.assertEqual(header_reason(message("a@x.com", Precedence="Bulk").headers, "a@x.com"), "Precedence")
+        self.assertEqual(header_reason(message("a@x.com", List_Id="<dev.x.com>").headers, "a@x.com"), "Mailing List")
+        self.assertEqual(header_reason(message("a@x.com", X_Auto_Response_Suppress="All").headers, "a@x.com"),
+                         "X-Auto-Response-Suppress")
+        self.assertIsNone(header_reason({}, "Bob <bob@x.com>"))
+
+    def test_noreply_matches_whole_words(self):
+        """Test no-reply detection doesn't fire on substrings of a person's address."""
+        for addr in ("noreply@x.com", "Shop <info-no-reply@x.com>", "donotreply@gov.x", "notifications@github.com",
+                     "mailer-daemon@x.com"):
+            self.assertTrue(is_noreply_address(addr), addr)
+        for addr in ("liam.noreplyfan@x.com", "renotify.fan@x.com", "bob@noreply-inc.com"):
+            self.assertFalse(is_noreply_address(addr), addr)
+
+    def test_reputation_is_learned_and_persisted(self):
+        """Test a sender becomes automated after enough automated outcomes, and it survives a restart."""
+        detector = AutomationDetector(SenderReputation(self.path, min_messages=3, threshold=0.9))
+        msg = message("Billing <billing@saas.example>")
+        detector.learn(USER, [(msg.from_, True), (msg.from_, True)])
+        self.assertIsNone(detector.reason(msg, USER))
+        detector.learn(USER, [(msg.from_, True)])
+        self.assertEqual(detector.reason(msg, USER), "Sender Reputation")
+        # Per account
+        self.assertIsNone(detector.reason(msg, "other@example.com"))
+        detector.reputation.close()
+
+        reloaded = SenderReputation(self.path, min_messages=3, threshold=0.9)
+        self.assertTrue(reloaded.is_automated(USER, "billing@saas.example"))
+        reloaded.record_many(USER, [("billing@saas.example", False)])
+        self.assertFalse(reloaded.is_automated(USER, "billing@saas.example"))
+        reloaded.close()
+
+    def test_labelled_corpus(self):
+        """Test precision/recall of header detection + reputation on the fixture corpus."""
+        detector = AutomationDetector(SenderReputation(path=""))
+        tp = fp = fn = 0
+        with open(CORPUS) as f:
+            for line in f:
+                row = json.loads(line)
+                msg = message(row["from"])
+                msg.headers = {k.lower(): (v,) for k, v in row["headers"].items()}
+                reason = detector.reason(msg, USER)
+                # As agent_logic._sender_outcomes: header verdicts count as automated, and
+                # mail the (stand-in) body classifier doesn't call promotional as human
+                if reason and reason != "Sender Reputation":
+                    detector.learn(USER, [(msg.from_, True)])
+                elif not reason and "receipt" not in row["body"]:
+                    detector.learn(USER, [(msg.from_, False)])
+                automated = row["label"] == "automated"
+                tp += bool(reason) and automated
+                fp += bool(reason) and not automated
+                fn += not reason and automated
+        self.assertEqual(fp, 0)
+        # Receipts without automation headers are left to the body classifier
+        self.assertGreaterEqual(tp / (tp + fn), 0.55)
+
+    def test_flagged_sender_can_recover(self):
+        """Test a flagged sender's mail is rechecked now and then, and one human outcome unflags them."""
+        detector = AutomationDetector(SenderReputation(path="", min_messages=3, threshold=0.9), recheck_every=3)
+        msg = message("Ann <ann@example.com>")
+        detector.learn(USER, [(msg.from_, True)] * 30)
+        reasons = [detector.reason(msg, USER) for _ in range(3)]
+        self.assertEqual(reasons, ["Sender Reputation", "Sender Reputation", None])
+        # The rechecked message turned out to be from a person
+        detector.learn(USER, [(msg.from_, False)])
+        self.assertEqual(detector.reputation.counts(USER, msg.from_), (0, 1))
+        self.assertIsNone(detector.reason(msg, USER))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import sys
+import os
+
+# Add backend directory to path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from body_text import extract_text, normalize_stream
+
+NEWSLETTER = (
+    "<!DOCTYPE html><html><head><title>Weekly</title><style>td {color: red}</style></head>"
+    "<body><span style=\"display:none\">&zwnj;&nbsp;&#847;</span>"
+    "<table><tr><td>Hi&nbsp;Ann,</td></tr><tr><td>Your&nbsp;build &amp; deploy <b>failed</b>.</td></tr></table>"
+    "<script>track()</script></body></html>"
+)
+
+class TestBodyText(unittest.TestCase):
+
+    def test_html_markup_and_entities(self):
+        """Test styles, scripts and tags are dropped and entities decoded."""
+        self.assertEqual(extract_text(html=NEWSLETTER), "Hi Ann,\nYour build & deploy failed.")
+
+    def test_html_in_text_part(self):
+        """Test a text part that is really HTML is treated as HTML."""
+        self.assertEqual(extract_text(text=NEWSLETTER, html=""), "Hi Ann,\nYour build & deploy failed.")
+
+    def test_quoted_reply_chain_is_dropped(self):
+        """Test quoted lines and everything after the attribution line go."""
+        text = ("Friday works for me.\n> Can we meet?\n\nOn Mon, Jan 6, 2025 at 9:00 AM Bob <\n"
+                "bob@example.com> wrote:\n> Earlier message")
+        self.assertEqual(extract_text(text=text), "Friday works for me.")
+        html = '<div>Sounds good</div><div class="gmail_quote">On Mon Bob wrote:<blockquote>old</blockquote></div>'
+        self.assertEqual(extract_text(html=html), "Sounds good")
+        outlook = "Approved.\n\n-----Original Message-----\nFrom: Bob\nPlease approve"
+        self.assertEqual(extract_text(text=outlook), "Approved.")
+
+    def test_stops_consuming_at_limit(self):
+        """Test the normalizer stops reading chunks once it has enough text."""
+        consumed = []
+
+        def chunks():
+            for i in range(1000):
+                consumed.append(i)
+                yield "<p>" + "word " * 100 + "</p>"
+
+        text = normalize_stream(chunks(), html=True, limit=1200)
+        self.assertLessEqual(len(text), 1200)
+        self.assertLess(len(consumed), 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import time
+import asyncio
+import threading
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+
+import main
+
+class TestCycleDispatch(unittest.TestCase):
+
+    def setUp(self):
+        main.store._conn().execute("DELETE FROM users")
+        main.leases._conn().execute("DELETE FROM leases")
+        for i in range(4):
+            main.store.upsert({
+                "email": f"u{i}@example.com", "app_password": "pw",
+                "openrouter_key": "k", "active": True, "interval_minutes": 30
+            })
+
+    def run_job(self, emails, wait=0.5):
+        async def scenario():
+            await main.active_user_job(emails)
+            await asyncio.sleep(wait)
+        asyncio.run(scenario())
+
+    def test_users_run_concurrently_and_save_individually(self):
+        """Test due users are dispatched in parallel and each result is saved."""
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def fake_cycle(email, app_pass, api_key, deadline=None, sync_state=None, on_action=None):
+            sync_state.update(uidvalidity=7, last_uid=100 + int(email[1]))
+            with lock:
+                active.append(email)
+                peak.append(len(active))
+            time.sleep(0.2)
+            with lock:
+                active.remove(email)
+            return [], f"2025-01-01T00:00:0{email[1]}"
+
+        start = time.time()
+        with patch('main.run_agent_cycle', fake_cycle):
+            self.run_job([f"u{i}@example.com" for i in range(4)])
+        self.assertGreater(max(peak), 1)
+        self.assertLess(time.time() - start, 0.8 + 0.5)
+        for i in range(4):
+            user = main.store.get(f"u{i}@example.com")
+            self.assertEqual(user["last_run"], f"2025-01-01T00:00:0{i}")
+            self.assertEqual((user["uidvalidity"], user["last_uid"]), (7, 100 + i))
+
+    def test_timeout_never_overlaps_cycles(self):
+        """Test a timed-out user stays marked running until its thread ends."""
+        calls = []
+
+        def slow_cycle(email, app_pass, api_key, deadline=None, sync_state=None, on_action=None):
+            calls.append(email)
+            time.sleep(0.3)
+            return [], "2025-01-01T00:00:00"
+
+        async def scenario():
+            await main.active_user_job(["u0@example.com"])
+            await asyncio.sleep(0.15)
+            self.assertIn("u0@example.com", main.running_users)
+            # Due again while the first thread is still running: must not start
+            await main.active_user_job(["u0@example.com"])
+            await asyncio.sleep(0.3)
+            self.assertNotIn("u0@example.com", main.running_users)
+
+        with patch('main.run_agent_cycle', slow_cycle), \
+             patch('main.CYCLE_TIMEOUT_SECONDS', 0.1):
+            asyncio.run(scenario())
+        self.assertEqual(calls, ["u0@example.com"])
+        self.assertIsNone(main.store.get("u0@example.com")["last_run"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+import datetime
+import tempfile
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+
+from fastapi.testclient import TestClient
+import main
+from history_store import HistoryStore
+
+USER = "me@example.com"
+BASE = datetime.datetime(2025, 1, 6, 9, 0)
+
+def entry(i, sender, intent, text, days=0):
+    return {
+        "timestamp": (BASE + datetime.timedelta(days=days, minutes=i)).isoformat(),
+        "sender": sender, "subject": f"Subject {i}", "intent": intent,
+        "action": "Replied", "email_text": text, "reply": f"Reply {i}",
+    }
+
+class TestHistoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = HistoryStore(os.path.join(self.tmpdir, "history.db"))
+        self.store.record_many(USER, [
+            entry(0, "Ann <ann@example.com>", "Support Query", "I cannot log into my account", days=0),
+            entry(1, "bob@example.com", "Meeting Request", "Can we meet on Friday?", days=1),
+            entry(2, "ANN@example.com", "Support Query", "Password reset link is broken", days=2),
+            entry(3, "carl@example.com", "General", "Thanks for lunch", days=3),
+            {"error": "Cycle deadline reached"},
+        ])
+        self.store.record(USER, entry(0, "ann@example.com", "General", "other account", days=3) | {"subject": "x"})
+        self.store.record("other@example.com", entry(9, "ann@example.com", "Support Query", "log in trouble"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_sender_lookup_ignores_display_name_and_case(self):
+        """Test 'what did we reply to this sender' matches on the bare address."""
+        items, _ = self.store.query(USER, sender="Ann <Ann@Example.com>")
+        self.assertEqual([i["email_text"] for i in items],
+                         ["other account", "Password reset link is broken", "I cannot log into my account"])
+        self.assertEqual(items[1]["reply"], "Reply 2")
+
+    def test_intent_and_time_count(self):
+        """Test counting an intent inside a time window, per account."""
+        since = (BASE + datetime.timedelta(days=1)).timestamp()
+        self.assertEqual(self.store.count(USER, intent="Support Query"), 2)
+        self.assertEqual(self.store.count(USER, intent="Support Query", since=since), 1)
+        self.assertEqual(self.store.count("other@example.com"), 1)
+
+    def test_full_text_search(self):
+        """Test text search over email bodies."""
+        items, _ = self.store.query(USER, text='broken "link')
+        self.assertEqual([i["subject"] for i in items], ["Subject 2"])
+        # Blank text is no filter at all
+        self.assertEqual(self.store.count(USER, text="  "), self.store.count(USER))
+
+    def test_cursor_pagination(self):
+        """Test pages follow each other without gaps or repeats, newest first."""
+        seen, cursor = [], None
+        while True:
+            items, cursor = self.store.query(USER, limit=2, cursor=cursor)
+            seen.extend(i["id"] for i in items)
+            if cursor is None:
+                break
+        all_items, _ = self.store.query(USER, limit=100)
+        self.assertEqual(seen, [i["id"] for i in all_items])
+        self.assertEqual(len(seen), 5)
+        with self.assertRaises(ValueError):
+            self.store.query(USER, cursor="not-a-cursor")
+
+class TestHistoryEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        main.history._conn().execute("DELETE FROM interactions")
+        main.history.record_many(USER, [entry(i, "ann@example.com", "Support Query", f"issue {i}") for i in range(3)])
+        self.client = TestClient(main.app)
+
+    def test_history_pages(self):
+        """Test GET /history returns cursor-linked pages and /history/count totals."""
+        first = self.client.get("/history", params={"email": USER, "limit": 2}).json()
+        self.assertEqual([i["email_text"] for i in first["items"]], ["issue 2", "issue 1"])
+        second = self.client.get("/history", params={"email": USER, "limit": 2, "cursor": first["next_cursor"]}).json()
+        self.assertEqual([i["email_text"] for i in second["items"]], ["issue 0"])
+        self.assertIsNone(second["next_cursor"])
+
+        count = self.client.get("/history/count", params={"email": USER, "since": "2025-01-06"}).json()
+        self.assertEqual(count["count"], 3)
+
+    def test_history_bad_input(self):
+        """Test malformed cursors and times are rejected with 400."""
+        self.assertEqual(self.client.get("/history", params={"email": USER, "cursor": "zzz"}).status_code, 400)
+        self.assertEqual(self.client.get("/history", params={"email": USER, "since": "yesterday"}).status_code, 400)
+        # Search text FTS5 can't parse
+        with patch('history_store.fts_query', return_value="AND"):
+            for path in ("/history", "/history/count"):
+                self.assertEqual(self.client.get(path, params={"email": USER, "q": "x"}).status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
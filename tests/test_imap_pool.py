@@ -0,0 +1,116 @@
+import unittest
+import time
+import threading
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+import agent_logic
+from imap_pool import ImapPool, IdleWatcher
+from fake_imap import FakeImapServer, make_message
+
+USER = "me@example.com"
+PASSWORD = "secret"
+
+class TestImapPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeImapServer({USER: PASSWORD}).start()
+        self.pool = ImapPool(self.server.host, self.server.port, ssl=False, timeout=5)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.stop()
+
+    def test_session_is_reused(self):
+        """Test that consecutive sessions share one login."""
+        self.pool.validate(USER, PASSWORD)
+        with self.pool.session(USER, PASSWORD) as mailbox:
+            mailbox.uids()
+        with self.pool.session(USER, PASSWORD) as mailbox:
+            mailbox.uids()
+        self.assertEqual(self.server.logins, 1)
+
+    def test_reconnects_after_server_drop(self):
+        """Test a dropped session is detected by the health check and replaced."""
+        with self.pool.session(USER, PASSWORD):
+            pass
+        self.server.drop_connections()
+        with patch('imap_pool.IMAP_HEALTHCHECK_AFTER', 0):
+            with self.pool.session(USER, PASSWORD) as mailbox:
+                self.assertEqual(mailbox.uids(), [])
+        self.assertEqual(self.server.logins, 2)
+
+    def test_failed_session_is_discarded(self):
+        """Test a session that raised is not handed out again."""
+        with self.assertRaises(RuntimeError):
+            with self.pool.session(USER, PASSWORD):
+                raise RuntimeError("boom")
+        with self.pool.session(USER, PASSWORD):
+            pass
+        self.assertEqual(self.server.logins, 2)
+
+    def test_bad_credentials(self):
+        """Test that validation fails for a wrong password."""
+        with self.assertRaises(Exception):
+            self.pool.validate(USER, "wrong")
+
+    def test_idle_watcher_reports_new_mail(self):
+        """Test IDLE push calls back as soon as mail is delivered."""
+        arrived = threading.Event()
+        watcher = IdleWatcher(self.pool, USER, PASSWORD, lambda user: arrived.set(), poll_seconds=0.5).start()
+        try:
+            deadline = time.time() + 2
+            while not self.server.idlers and time.time() < deadline:
+                time.sleep(0.01)
+            self.server.deliver(USER, make_message("bob@example.com", "Hi", "hello"))
+            self.assertTrue(arrived.wait(2))
+        finally:
+            watcher.stop(timeout=3)
+
+    def test_idle_watcher_survives_errors_and_stops_on_bad_login(self):
+        """Test an unexpected error only makes the watcher reconnect, while a rejected login stops it."""
+        calls = []
+
+        def on_new_mail(user):
+            calls.append(user)
+            raise ValueError("callback bug")
+
+        watcher = IdleWatcher(self.pool, USER, PASSWORD, on_new_mail, poll_seconds=0.2)
+        with patch('imap_pool.IMAP_IDLE_RETRY_MAX', 0.05):
+            watcher.start()
+            try:
+                for i in range(2):
+                    deadline = time.time() + 3
+                    while not self.server.idlers and time.time() < deadline:
+                        time.sleep(0.01)
+                    self.server.deliver(USER, make_message("bob@example.com", f"Hi {i}", "hello"))
+                    deadline = time.time() + 3
+                    while len(calls) <= i and time.time() < deadline:
+                        time.sleep(0.01)
+                self.assertEqual(len(calls), 2)
+                self.assertTrue(watcher._thread.is_alive())
+            finally:
+                watcher.stop(timeout=3)
+
+        bad = IdleWatcher(self.pool, USER, "wrong", on_new_mail).start()
+        bad._thread.join(3)
+        self.assertFalse(bad._thread.is_alive())
+        self.assertIsNotNone(bad.auth_error)
+
+    def test_run_agent_cycle_uses_pool(self):
+        """Test two cycles against the fake server log in only once."""
+        self.server.deliver(USER, make_message("Bob <bob@example.com>", "Meeting", "Can we schedule a meeting?"))
+        with patch('agent_logic.imap_pool', self.pool), \
+             patch('agent_logic.generate_reply_llm', return_value="Sure."), \
+             patch('agent_logic.send_email', return_value=True) as send:
+            logs, _ = agent_logic.run_agent_cycle(USER, PASSWORD, "key")
+            logs2, _ = agent_logic.run_agent_cycle(USER, PASSWORD, "key")
+        self.assertEqual(logs[0]["action"], "Replied")
+        self.assertEqual(logs[0]["intent"], "Meeting Request")
+        self.assertEqual(logs2, [])
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(self.server.logins, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+import email_agent
+from intent_model import IntentModel, train, load_examples, evaluate
+from history_store import HistoryStore
+
+TRAINING = [
+    ("Your weekly digest of deals and coupons", "Promotional/Notification"),
+    ("Flash deals this weekend only, coupons inside", "Promotional/Notification"),
+    ("Your parcel has shipped and is on its way", "Promotional/Notification"),
+    ("Could we find a slot to sync on Thursday afternoon", "Meeting Request"),
+    ("Are you free for a quick call on Thursday", "Meeting Request"),
+    ("Let us find a slot next week for a call", "Meeting Request"),
+    ("Thanks for dinner last night, it was lovely", "General"),
+    ("Great seeing you at the conference, thanks again", "General"),
+    ("Thanks for the book recommendation", "General"),
+]
+
+class TestIntentModel(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model = train([t for t, _ in TRAINING], [l for _, l in TRAINING], feature_bits=12)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_batch_scoring(self):
+        """Test a batch is scored in one pass, one labelled result per text, in order."""
+        results = self.model.classify_batch(["Coupons and deals for you", "Free for a call Thursday?", ""])
+        self.assertEqual([r["intent"] for r in results[:2]], ["Promotional/Notification", "Meeting Request"])
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(0 < r["confidence"] <= 1 for r in results))
+
+    def test_save_and_load(self):
+        """Test the saved weights round-trip (as float16) with the same predictions."""
+        path = os.path.join(self.tmpdir, "model.npz")
+        self.model.save(path)
+        loaded = IntentModel.load(path)
+        self.assertEqual(loaded.labels, self.model.labels)
+        texts = [t for t, _ in TRAINING]
+        self.assertEqual([r["intent"] for r in loaded.classify_batch(texts)],
+                         [r["intent"] for r in self.model.classify_batch(texts)])
+
+    def test_training_data_sources(self):
+        """Test examples load from memory.json and history.db, and evaluate() reports coverage."""
+        memory = os.path.join(self.tmpdir, "memory.json")
+        with open(memory, "w") as f:
+            json.dump([{"email_text": t, "intent": l} for t, l in TRAINING] + [{"email_text": "", "intent": "General"}], f)
+        store = HistoryStore(os.path.join(self.tmpdir, "history.db"))
+        store.record_many("me@example.com", [{"email_text": "Free for a call?", "intent": "Meeting Request"}])
+        store.close()
+
+        examples = load_examples(memory) + load_examples(os.path.join(self.tmpdir, "history.db"))
+        self.assertEqual(len(examples), len(TRAINING) + 1)
+        report = evaluate(self.model, examples, threshold=0.0)
+        self.assertEqual(report["coverage"], 1.0)
+        self.assertGreaterEqual(report["accuracy"], 0.9)
+
+    def test_only_low_confidence_escalates(self):
+        """Test rules decide first, the model next, and only unsure texts reach the LLM."""
+        texts = ["Please help, the export is broken", "Coupons and deals for you", "zzz qqq"]
+        llm = patch('email_agent.classify_intents_llm_batch',
+                    side_effect=lambda batch: [{"intent": "General", "confidence": 0.8}] * len(batch))
+        with patch('email_agent.local_model', self.model), llm as mock_llm:
+            results = email_agent.classify_intents(texts, ["a@x.com"] * 3, threshold=0.6)
+
+        self.assertEqual([r["tier"] for r in results], ["rules", "model", "llm"])
+        self.assertEqual(results[0]["intent"], "Support Query")
+        self.assertEqual(results[1]["intent"], "Promotional/Notification")
+        mock_llm.assert_called_once_with(["zzz qqq"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import os
+import json
+import tempfile
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+import email_agent
+from intent_rules import IntentMatcher, load_categories, DEFAULT_CATEGORIES
+
+class TestIntentRules(unittest.TestCase):
+
+    def classify(self, text, sender="person@example.com"):
+        return email_agent.classify_intent_rules(text, sender, "subject")
+
+    def test_precedence(self):
+        """Test Promotional beats Meeting beats Support beats General."""
+        self.assertEqual(self.classify("Meeting about the bug. Unsubscribe here")["intent"],
+                         "Promotional/Notification")
+        self.assertEqual(self.classify("Can we schedule a meeting about the bug?")["intent"], "Meeting Request")
+        self.assertEqual(self.classify("The export is broken")["intent"], "Support Query")
+        result = self.classify("Thanks for lunch yesterday")
+        self.assertEqual(result["intent"], "General")
+        self.assertEqual(result["confidence"], 0.5)
+
+    def test_all_hits_reported(self):
+        """Test one scan reports every matched category with its keywords."""
+        hits = self.classify("Meeting on Zoom about the ERROR, we need help")["hits"]
+        self.assertEqual(hits["Meeting Request"], ["meeting", "zoom"])
+        self.assertEqual(hits["Support Query"], ["error", "help"])
+
+    def test_sender_only_matches_promotional(self):
+        """Test sender keywords only feed the promotional category."""
+        self.assertEqual(self.classify("Hello there", "no-reply@shop.com")["intent"], "Promotional/Notification")
+        self.assertEqual(self.classify("Hello there", "info-no-reply@bank.com")["intent"], "Promotional/Notification")
+        self.assertEqual(self.classify("Hello there", "support@vendor.com")["intent"], "General")
+
+    def test_word_start_boundary(self):
+        """Test keywords match at word starts only."""
+        self.assertEqual(self.classify("I scanned the barcode")["intent"], "General")
+        self.assertEqual(self.classify("The upload failed")["intent"], "Support Query")
+
+    def test_hyphenated_keywords_match_as_written(self):
+        """Test "no-reply" doesn't fire on a person writing "got no reply"."""
+        text = "Hi, I sent three emails and got no reply yet, the export is broken"
+        result = IntentMatcher(DEFAULT_CATEGORIES).classify(text, "bob@x.com")
+        self.assertEqual((result["intent"], result["confidence"]), ("Support Query", 0.9))
+        self.assertEqual(self.classify("Sent from a no-reply address")["intent"], "Promotional/Notification")
+
+    def test_categories_from_config(self):
+        """Test keyword sets can be loaded from a JSON file."""
+        categories = [{"intent": "Invoice", "confidence": 0.8, "keywords": ["invoice"]}] + DEFAULT_CATEGORIES
+        with tempfile.NamedTemporaryFile('w', suffix=".json", delete=False) as f:
+            json.dump(categories, f)
+        try:
+            matcher = IntentMatcher(load_categories(f.name))
+        finally:
+            os.remove(f.name)
+        self.assertEqual(matcher.classify("Invoice attached, any issue let me know")["intent"], "Invoice")
+
+if __name__ == '__main__':
+    unittest.main()
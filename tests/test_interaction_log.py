@@ -0,0 +1,94 @@
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+from unittest.mock import patch
+
+# Add backend directory to path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from interaction_log import InteractionLog
+
+class TestInteractionLog(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_rotation_and_compression(self):
+        """Test segments rotate by size, old ones are gzipped, and reads span them in order."""
+        log = InteractionLog(self.dir, segment_bytes=200, compress=True)
+        for i in range(20):
+            log.append({"n": i, "text": "x" * 40})
+        log.close()
+
+        segments = log.segments()
+        self.assertGreater(len(segments), 3)
+        self.assertTrue(all(p.endswith(".gz") for p in segments[:-1]))
+        self.assertTrue(segments[-1].endswith(".jsonl"))
+        self.assertEqual([r["n"] for r in log.read()], list(range(20)))
+
+    def test_reopen_appends_to_last_segment(self):
+        """Test a reopened log continues where it left off."""
+        log = InteractionLog(self.dir)
+        log.append({"n": 1})
+        log.close()
+        log = InteractionLog(self.dir)
+        log.append({"n": 2})
+        log.close()
+        self.assertEqual(len(log.segments()), 1)
+        self.assertEqual([r["n"] for r in log.read()], [1, 2])
+
+    def test_torn_write_is_skipped(self):
+        """Test a partial last line from a crash doesn't break reading or later appends."""
+        log = InteractionLog(self.dir)
+        log.append({"n": 1})
+        log.close()
+        with open(log.segments()[-1], "ab") as f:
+            f.write(b'{"n": 2, "tex')
+        log = InteractionLog(self.dir)
+        log.append({"n": 3})
+        log.close()
+        self.assertEqual([r["n"] for r in log.read()], [1, 3])
+
+    def test_fsync_is_batched(self):
+        """Test fsync runs once per batch of records, not per record."""
+        log = InteractionLog(self.dir, fsync_every=10, fsync_interval=3600)
+        with patch("interaction_log.os.fsync") as fsync:
+            for i in range(25):
+                log.append({"n": i})
+            self.assertEqual(fsync.call_count, 2)
+            log.close()
+            self.assertEqual(fsync.call_count, 3)
+
+    def test_interrupted_import_is_redone(self):
+        """Test a crash during the memory.json import leaves the log empty, so the next start imports it all."""
+        legacy = os.path.join(self.dir, "memory.json")
+        with open(legacy, "w") as f:
+            json.dump([{"n": i} for i in range(5)], f)
+        log = InteractionLog(os.path.join(self.dir, "memory"))
+        real_replace = os.replace
+
+        def crash(src, dst):
+            if src.endswith(".tmp"):
+                raise OSError("killed")
+            real_replace(src, dst)
+
+        with patch('interaction_log.os.replace', side_effect=crash):
+            with self.assertRaises(OSError):
+                log.import_json(legacy)
+        self.assertTrue(log.is_empty())
+        self.assertTrue(os.path.exists(legacy))
+
+        self.assertEqual(log.import_json(legacy), 5)
+        log.append({"n": 5})
+        self.assertEqual([r["n"] for r in log.read()], list(range(6)))
+        self.assertTrue(os.path.exists(legacy + ".bak"))
+        log.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import os
+import time
+import asyncio
+import tempfile
+import threading
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+
+import main
+from leases import LeaseStore
+
+class TestLeaseStore(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.join(tempfile.mkdtemp(), "leases.db")
+        self.a = LeaseStore(path, worker_id="a", ttl=10)
+        self.b = LeaseStore(path, worker_id="b", ttl=10)
+
+    def test_claim_is_exclusive_until_released(self):
+        """Test a held lease is busy for other workers, ours to re-claim, and free once released."""
+        self.assertEqual(self.a.claim(["x", "y"], now=100), (["x", "y"], {}))
+        self.assertEqual(self.b.claim(["x", "z"], now=101), (["z"], {"x": 110}))
+        self.assertEqual(self.a.claim(["x"], now=102), (["x"], {}))
+        self.assertEqual(self.a.workers(now=103), {"a": 2, "b": 1})
+        self.a.release("x")
+        self.assertEqual(self.b.claim(["x"], now=104), (["x"], {}))
+        # Releasing someone else's lease does nothing
+        self.a.release("x")
+        self.assertEqual(self.a.claim(["x"], now=105)[0], [])
+
+    def test_expired_leases_are_reassigned(self):
+        """Test a crashed worker's users go to another worker after the TTL, unless it kept heartbeating."""
+        self.a.claim(["x", "y"], now=100)
+        self.assertEqual(self.a.renew(["x"], now=108), 1)
+        claimed, busy = self.b.claim(["x", "y"], now=111)
+        self.assertEqual((claimed, busy), (["y"], {"x": 118}))
+        # a lost y: its heartbeat only keeps x
+        self.assertEqual(self.a.renew(["x", "y"], now=112), 1)
+
+    def test_release_with_hold(self):
+        """Test a lease released with `until` can't be claimed by anyone before then."""
+        self.a.claim(["x"], now=100)
+        self.a.release("x", until=160)
+        self.assertEqual(self.a.claim(["x"], now=120), ([], {"x": 160}))
+        self.assertEqual(self.b.claim(["x"], now=160), (["x"], {}))
+
+    def test_concurrent_workers_never_share_a_user(self):
+        """Test workers racing over the same users (own connections each) claim disjoint sets."""
+        path = os.path.join(tempfile.mkdtemp(), "leases.db")
+        emails = [f"u{i}" for i in range(200)]
+        claims = {}
+
+        def worker(name):
+            store = LeaseStore(path, worker_id=name)
+            mine = []
+            for start in range(0, len(emails), 10):
+                mine += store.claim(emails[start:start + 10])[0]
+            claims[name] = mine
+            store.close()
+
+        threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        everything = [email for mine in claims.values() for email in mine]
+        self.assertEqual(sorted(everything), sorted(emails))
+
+class TestLeasedDispatch(unittest.TestCase):
+
+    def setUp(self):
+        main.store._conn().execute("DELETE FROM users")
+        main.leases._conn().execute("DELETE FROM leases")
+        for i in range(3):
+            main.store.upsert({"email": f"l{i}@example.com", "app_password": "pw", "openrouter_key": "k",
+                               "active": True, "interval_minutes": 30})
+        self.other = LeaseStore(main.leases.path, worker_id="other-worker")
+        self.calls = []
+
+    def tearDown(self):
+        self.other.close()
+
+    def fake_cycle(self, email, app_pass, api_key, deadline=None, sync_state=None, on_action=None):
+        self.calls.append(email)
+        time.sleep(0.05)
+        return [], "2025-01-01T00:00:00"
+
+    def run_job(self, emails, wait=0.5, cycle=None):
+        async def scenario():
+            await main.active_user_job(emails)
+            await asyncio.sleep(wait)
+        with patch('main.run_agent_cycle', cycle or self.fake_cycle):
+            asyncio.run(scenario())
+
+    def test_users_leased_elsewhere_are_skipped(self):
+        """Test a user another worker holds is not run here, but looked at again when its lease can lapse."""
+        self.other.claim(["l0@example.com"], now=time.time())
+        self.run_job(["l0@example.com", "l1@example.com"])
+        self.assertEqual(self.calls, ["l1@example.com"])
+        self.assertAlmostEqual(main.scheduler._due["l0@example.com"], time.time() + self.other.ttl, delta=2)
+        self.assertEqual(main.leases.workers(), {"other-worker": 1})
+
+    def test_crashed_workers_users_are_taken_over(self):
+        """Test once a dead worker's lease has expired, its due user is run here."""
+        self.other.claim(["l0@example.com"], now=time.time() - self.other.ttl - 1)
+        self.run_job(["l0@example.com"])
+        self.assertEqual(self.calls, ["l0@example.com"])
+
+    def test_already_ran_elsewhere(self):
+        """Test a stale due time is dropped when the store shows a run since then."""
+        main.scheduler.popped_due["l0@example.com"] = time.time() - 60
+        main.store.update("l0@example.com", last_run=main.datetime.datetime.now().isoformat())
+        self.run_job(["l0@example.com"])
+        self.assertEqual(self.calls, [])
+        self.assertEqual(main.scheduler._due["l0@example.com"], main.store.get("l0@example.com")["next_due_at"])
+
+    def test_only_free_slots_are_leased(self):
+        """Test due users beyond the free cycle slots wait unleased in the backlog."""
+        leased = []
+
+        def cycle(*args, **kwargs):
+            leased.append(sum(main.leases.workers().values()))
+            return self.fake_cycle(*args, **kwargs)
+
+        with patch('main.MAX_CONCURRENT_CYCLES', 1):
+            self.run_job([f"l{i}@example.com" for i in range(3)], cycle=cycle)
+        self.assertEqual(sorted(self.calls), [f"l{i}@example.com" for i in range(3)])
+        self.assertEqual(leased, [1, 1, 1])
+        self.assertEqual(main.backlog, {})
+
+if __name__ == '__main__':
+    unittest.main()
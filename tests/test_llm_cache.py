@@ -0,0 +1,106 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+import email_agent
+import agent_logic
+from llm_cache import LLMCache, cache_key
+from llm_client import LLMError
+
+def completion(content):
+    return {"choices": [{"message": {"content": content}}]}
+
+class TestLLMCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "cache.db")
+        self.cache = LLMCache(self.path, max_entries=3, ttl=100)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_key_normalizes_body(self):
+        """Test whitespace/case changes share a key but prompt inputs don't."""
+        a = cache_key("reply", "I am having trouble\n logging in", "m", "v1", intent="Support Query")
+        b = cache_key("reply", "i am having   TROUBLE logging in ", "m", "v1", intent="Support Query")
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, cache_key("reply", "i am having trouble logging in", "m", "v1", intent="General"))
+        self.assertNotEqual(a, cache_key("reply", "i am having trouble logging in", "m", "v2", intent="Support Query"))
+        self.assertNotEqual(a, cache_key("reply", "i am having trouble logging in", "other", "v1", intent="Support Query"))
+
+    def test_hits_misses_and_persistence(self):
+        """Test counters and that entries survive reopening the database."""
+        self.assertIsNone(self.cache.get("k"))
+        self.cache.put("k", {"intent": "General", "confidence": 0.5})
+        self.assertEqual(self.cache.get("k"), {"intent": "General", "confidence": 0.5})
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+        reopened = LLMCache(self.path)
+        self.assertEqual(reopened.get("k")["intent"], "General")
+        reopened.close()
+
+    def test_ttl_expiry(self):
+        """Test entries older than the TTL are treated as misses and removed."""
+        self.cache.put("k", "reply", now=1000)
+        self.assertEqual(self.cache.get("k", now=1050), "reply")
+        self.assertIsNone(self.cache.get("k", now=1101))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_size_eviction_keeps_recently_used(self):
+        """Test eviction drops least recently used entries down to max_entries."""
+        for i in range(3):
+            self.cache.put(f"k{i}", i, now=1000 + i)
+        self.cache.get("k0", now=1010)  # k0 is now the most recent
+        self.cache.put("k3", 3, now=1011)  # over the limit: evicts k1
+        self.assertEqual(self.cache.stats()["entries"], 3)
+        self.assertIsNone(self.cache.get("k1", now=1012))
+        self.assertEqual(self.cache.get("k0", now=1012), 0)
+
+    def test_scope(self):
+        """Test per-account scoping unless the cache is shared."""
+        self.assertEqual(self.cache.scope("a@example.com"), "a@example.com")
+        shared = LLMCache(os.path.join(self.tmpdir, "shared.db"), shared=True)
+        self.assertEqual(shared.scope("a@example.com"), "")
+        shared.close()
+
+    @patch('email_agent.model_router.chat_sync')
+    def test_cli_classification_cached(self, mock_chat):
+        """Test a repeated body is classified once, by single or batched calls."""
+        mock_chat.return_value = completion('{"intent": "Support Query", "confidence": 0.9}')
+        with patch('email_agent.llm_cache', self.cache), patch('email_agent.OPENROUTER_API_KEY', 'test_key'):
+            email_agent.classify_intent_llm("I am having trouble logging into my account")
+            result = email_agent.classify_intent_llm("i am having trouble logging into my account ")
+            batch = email_agent.classify_intents_llm_batch(["I am having trouble logging into my account"])
+        self.assertEqual(mock_chat.call_count, 1)
+        self.assertEqual(result["intent"], "Support Query")
+        self.assertEqual(batch[0]["intent"], "Support Query")
+
+    @patch('agent_logic.model_router.stream_sync')
+    def test_backend_reply_cached_per_user(self, mock_chat):
+        """Test backend replies are reused for the same user, not across users by default."""
+        mock_chat.side_effect = lambda payload, key, tier: (d for d in ["Hi Ann,", " we are", " looking into it."])
+        args = ("Login is broken", "Support Query", "Acknowledge the issue.", "Ann", "key")
+        with patch('agent_logic.llm_cache', self.cache):
+            first = agent_logic.generate_reply_llm(*args, user_email="a@example.com")
+            again = agent_logic.generate_reply_llm(*args, user_email="a@example.com")
+            agent_logic.generate_reply_llm(*args, user_email="b@example.com")
+        self.assertEqual(first, again)
+        self.assertEqual(mock_chat.call_count, 2)
+
+    @patch('agent_logic.model_router.stream_sync')
+    def test_failed_reply_not_cached(self, mock_chat):
+        """Test fallback text from a failed call is never stored."""
+        mock_chat.side_effect = LLMError("HTTP 500")
+        with patch('agent_logic.llm_cache', self.cache):
+            agent_logic.generate_reply_llm("Hello", "General", "s", "Ann", "key")
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
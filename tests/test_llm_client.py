@@ -0,0 +1,118 @@
+import unittest
+import sys
+import os
+import time
+import asyncio
+import threading
+from unittest.mock import patch
+
+# Add backend directory to path to import llm_client
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from llm_client import LLMClient, LLMError
+from mock_openrouter import MockOpenRouter
+
+PAYLOAD = {"model": "test", "messages": [{"role": "user", "content": "hi"}]}
+
+class TestLLMClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = None
+        self.client = None
+        # Keep retry sleeps short
+        self.backoff = patch('llm_client.LLM_BACKOFF_BASE', 0.01)
+        self.backoff.start()
+
+    def tearDown(self):
+        self.backoff.stop()
+        if self.client:
+            self.client.close()
+        if self.server:
+            self.server.stop()
+
+    def start(self, **kwargs):
+        client_kwargs = kwargs.pop("client", {})
+        self.server = MockOpenRouter(**kwargs).start()
+        self.client = LLMClient(url=self.server.url, **client_kwargs)
+
+    def test_connections_are_reused(self):
+        """Test sequential calls share one keep-alive connection."""
+        self.start()
+        for _ in range(5):
+            data = self.client.chat_sync(PAYLOAD, "key")
+            self.assertIn("choices", data)
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(self.server.requests[0]["headers"]["Authorization"], "Bearer key")
+
+    def test_retries_429_and_5xx(self):
+        """Test transient errors are retried until success."""
+        self.start(script=[429, 503])
+        data = self.client.chat_sync(PAYLOAD, "key")
+        self.assertIn("choices", data)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_gives_up_after_max_retries(self):
+        """Test persistent 5xx raises LLMError after the retry budget."""
+        self.start(script=[500] * 10, client={"max_retries": 2})
+        with self.assertRaises(LLMError):
+            self.client.chat_sync(PAYLOAD, "key")
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        """Test 4xx other than 429 fails immediately."""
+        self.start(script=[401])
+        with self.assertRaises(LLMError):
+            self.client.chat_sync(PAYLOAD, "key")
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_read_timeout_is_retried(self):
+        """Test a hung request times out instead of blocking forever."""
+        self.start(latency=0.5, client={"read_timeout": 0.1, "max_retries": 1})
+        with self.assertRaises(LLMError):
+            self.client.chat_sync(PAYLOAD, "key")
+
+    def test_inflight_limit_per_key(self):
+        """Test concurrent calls with one API key are capped."""
+        self.start(latency=0.1, client={"max_inflight_per_key": 2})
+        threads = [threading.Thread(target=self.client.chat_sync, args=(PAYLOAD, "key")) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(self.server.peak_inflight, 2)
+
+    def test_backoff_frees_the_slot(self):
+        """Test a request waiting to retry doesn't hold its key's slot."""
+        self.start(script=[429], client={"max_inflight_per_key": 1})
+        finished = {}
+
+        def call(name):
+            self.client.chat_sync(PAYLOAD, "key")
+            finished[name] = time.perf_counter()
+
+        with patch.object(LLMClient, '_backoff', return_value=0.5):
+            started = time.perf_counter()
+            first = threading.Thread(target=call, args=("retried",))
+            first.start()
+            while not self.server.requests:
+                time.sleep(0.01)
+            call("second")
+            first.join()
+        self.assertLess(finished["second"] - started, 0.4)
+        self.assertLess(finished["second"], finished["retried"])
+
+    def test_async_chat_from_another_loop(self):
+        """Test the async API can be awaited from any event loop."""
+        self.start()
+
+        async def run():
+            return await asyncio.gather(*(self.client.chat(PAYLOAD, f"k{i}") for i in range(3)))
+
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 3)
+
+if __name__ == '__main__':
+    unittest.main()
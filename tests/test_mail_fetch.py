@@ -0,0 +1,150 @@
+import unittest
+import os
+from email.message import EmailMessage
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+import agent_logic
+from imap_pool import ImapPool
+from mail_fetch import FetchStats, fetch_lazy, fetch_headers, fetch_bodies, parse_bodystructure, find_text_part, decode_part, TextPart
+from fake_imap import FakeImapServer, make_message
+
+USER = "me@example.com"
+PASSWORD = "secret"
+
+def with_attachment(sender, subject, body, size=200_000, charset_body=None):
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = USER
+    msg["Subject"] = subject
+    msg.set_content(body, cte="base64")
+    msg.add_attachment(os.urandom(size), maintype="application", subtype="pdf", filename="report.pdf")
+    return msg.as_bytes().replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+
+class TestBodyStructure(unittest.TestCase):
+
+    def test_text_part_skips_attachments(self):
+        """Test the inline text/plain part is found inside nested multiparts."""
+        structure = parse_bodystructure(
+            b'((("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 40 2 NIL NIL NIL)'
+            b'("TEXT" "PLAIN" ("CHARSET" "iso-8859-1") NIL NIL "QUOTED-PRINTABLE" 30 1 NIL NIL NIL) "ALTERNATIVE")'
+            b'("TEXT" "PLAIN" NIL NIL NIL "BASE64" 9000 100 NIL ("ATTACHMENT" ("FILENAME" "notes.txt")) NIL) "MIXED")'
+        )
+        self.assertEqual(find_text_part(structure), TextPart("1.2", "plain", "quoted-printable", "iso-8859-1", 30))
+
+    def test_single_part_is_section_one(self):
+        """Test a non-multipart message's body is addressed as section 1."""
+        structure = parse_bodystructure(b'("TEXT" "HTML" NIL NIL NIL "7BIT" 12 1 NIL NIL NIL)')
+        self.assertEqual(find_text_part(structure).section, "1")
+        self.assertIsNone(find_text_part(parse_bodystructure(b'("IMAGE" "PNG" NIL NIL NIL "BASE64" 12 NIL NIL NIL)')))
+
+    def test_truncated_encodings_decode(self):
+        """Test a capped fetch cut mid base64 quantum or mid QP escape still decodes."""
+        b64 = TextPart("1", "plain", "base64", "utf-8", 100)
+        self.assertEqual(decode_part(b"aGVsbG8gd29y\r\nbGQ", b64, truncated=True), "hello wor")
+        qp = TextPart("1", "plain", "quoted-printable", "utf-8", 100)
+        self.assertEqual(decode_part(b"caf=C3=A9 =C3", qp, truncated=True), "café ")
+
+class ScriptedMailbox:
+    """Hands fixed imaplib-style UID FETCH data back, and records what was asked for."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.client = self
+
+    def uid(self, command, uids, items):
+        self.requests.append(items)
+        return "OK", self.responses.pop(0)
+
+class TestFetchResponses(unittest.TestCase):
+
+    HEADERS = b"From: Ann <ann@example.com>\r\nSubject: Invoice (March)\r\n\r\n"
+
+    def test_literal_inside_bodystructure(self):
+        """Test an 8-bit filename sent as a literal doesn't take the header literal's place."""
+        filename = "Rechnung März.pdf".encode()
+        data = [
+            (b'1 (UID 7 RFC822.SIZE 900 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 11 1 NIL '
+             b'NIL NIL)("APPLICATION" "PDF" ("NAME" {%d}' % len(filename), filename),
+            (b') NIL NIL "BASE64" 400 NIL ("ATTACHMENT" ("FILENAME" "x")) NIL) "MIXED") '
+             b'BODY[HEADER.FIELDS (FROM SUBJECT)] {%d}' % len(self.HEADERS), self.HEADERS),
+            b")",
+        ]
+        msg, = fetch_headers(ScriptedMailbox(data), ["7"])
+        self.assertEqual((msg.uid, msg.size, msg.from_, msg.subject), ("7", 900, "ann@example.com", "Invoice (March)"))
+        self.assertEqual(msg.text_part(), TextPart("1", "plain", "7bit", "utf-8", 11))
+        self.assertEqual(msg.structure[1][2], ["NAME", "Rechnung März.pdf"])
+        self.assertFalse(msg.unreadable)
+
+    def test_no_text_part_reads_raw_body_and_missing_data_stays_unread(self):
+        """Test a message without a usable structure gets a capped BODY[TEXT], and one with no data is unreadable."""
+        headers = (b"1 (UID 7 BODYSTRUCTURE (garbage BODY[HEADER.FIELDS (FROM)] {%d}" % len(self.HEADERS), self.HEADERS)
+        mailbox = ScriptedMailbox(
+            [headers, b")", b"2 (UID 8)"],
+            [(b"1 (UID 7 BODY[TEXT]<0> {12}", b"Please call."), b")"],
+        )
+        msgs = fetch_headers(mailbox, ["7", "8"])
+        fetch_bodies(mailbox, msgs[:1], max_bytes=100)
+        self.assertEqual(msgs[0].text, "Please call.")
+        self.assertIn("BODY.PEEK[TEXT]<0.100>", mailbox.requests[-1])
+        self.assertTrue(msgs[1].unreadable)
+        log_entry, job = agent_logic.triage_message(msgs[1], USER)
+        self.assertIsNone(job)
+        self.assertFalse(agent_logic._handled(log_entry))
+
+class TestLazyFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeImapServer({USER: PASSWORD}).start()
+        self.pool = ImapPool(self.server.host, self.server.port, ssl=False, timeout=5)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.stop()
+
+    def test_bodies_only_for_survivors(self):
+        """Test ignored mail costs only its headers and attachments are never fetched."""
+        self.server.deliver(USER, make_message("news@shop.com", "Big sale", "x" * 50_000,
+                                               headers={"List-Unsubscribe": "<mailto:u@shop.com>"}))
+        self.server.deliver(USER, with_attachment("Ann <ann@example.com>", "Report", "Can we meet on Friday?"))
+        self.server.deliver(USER, make_message("bob@example.com", "Long", "word " * 20_000))
+
+        stats = FetchStats()
+        with self.pool.session(USER, PASSWORD) as mailbox:
+            mailbox.folder.set("INBOX")
+            msgs = list(fetch_lazy(mailbox, [1, 2, 3], lambda m: "list-unsubscribe" not in m.headers,
+                                   max_bytes=4096, stats=stats))
+
+        self.assertEqual([m.subject for m in msgs], ["Big sale", "Report", "Long"])
+        self.assertEqual(msgs[0].text, "")
+        self.assertEqual(msgs[1].text.strip(), "Can we meet on Friday?")
+        self.assertEqual(msgs[1].from_values.name, "Ann")
+        self.assertTrue(msgs[2].truncated)
+        self.assertLessEqual(len(msgs[2].text), 4096)
+        self.assertEqual(stats.bodies, 2)
+        self.assertLessEqual(stats.body_bytes, 4096 + len("Can we meet on Friday?") * 2)
+        # The attachment and the newsletter body never crossed the wire
+        self.assertLess(self.server.bytes_sent, 20_000)
+        self.assertGreater(stats.as_dict()["skipped_bytes"], 300_000)
+        # Peeking doesn't mark anything read
+        self.assertFalse(any("\\Seen" in m.flags for m in self.server.mailboxes[USER].messages))
+
+    def test_cycle_ignores_automated_mail_on_headers(self):
+        """Test the agent drops bulk/auto-submitted mail without fetching its body."""
+        self.server.deliver(USER, make_message("alerts@bank.com", "Statement", "Please help",
+                                               headers={"Auto-Submitted": "auto-generated"}))
+        self.server.deliver(USER, make_message("ann@example.com", "Bug", "Please help with this bug"))
+
+        with patch('agent_logic.imap_pool', self.pool), \
+             patch('agent_logic.generate_reply_llm', return_value="Looking into it."), \
+             patch('agent_logic.send_email', return_value=True):
+            logs, _ = agent_logic.run_agent_cycle(USER, PASSWORD, "key")
+
+        self.assertEqual([(l["subject"], l["action"]) for l in logs],
+                         [("Statement", "Ignored (Automated)"), ("Bug", "Replied")])
+        self.assertEqual(agent_logic.fetch_stats[USER]["bodies_fetched"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
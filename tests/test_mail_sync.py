@@ -0,0 +1,112 @@
+import unittest
+import sqlite3
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+import agent_logic
+from imap_pool import ImapPool
+from mail_sync import new_sync_state
+from fake_imap import FakeImapServer, make_message
+
+USER = "me@example.com"
+PASSWORD = "secret"
+
+class TestIncrementalSync(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeImapServer({USER: PASSWORD}).start()
+        self.pool = ImapPool(self.server.host, self.server.port, ssl=False, timeout=5)
+        self.patches = [
+            patch('agent_logic.imap_pool', self.pool),
+            patch('agent_logic.generate_reply_llm', return_value="Looking into it."),
+        ]
+        for p in self.patches:
+            p.start()
+        self.state = new_sync_state()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.pool.close_all()
+        self.server.stop()
+
+    def deliver(self, n, start=0, seen=False):
+        return [self.server.deliver(USER, make_message(f"p{i}@example.com", f"Question {i}", "Please help"), seen)
+                for i in range(start, start + n)]
+
+    def seen_uids(self):
+        return {m.uid for m in self.server.mailboxes[USER].messages if "\\Seen" in m.flags}
+
+    def cycle(self, send=lambda *a, **k: True, fail_to=None):
+        enqueue = agent_logic.outbox.enqueue
+
+        def flaky_enqueue(user_email, key, to_addr, *args, **kwargs):
+            if to_addr == fail_to:
+                raise sqlite3.OperationalError("disk I/O error")
+            return enqueue(user_email, key, to_addr, *args, **kwargs)
+
+        with patch('agent_logic.send_email', send), patch.object(agent_logic.outbox, 'enqueue', flaky_enqueue):
+            logs, _ = agent_logic.run_agent_cycle(USER, PASSWORD, "key", sync_state=self.state)
+        return logs
+
+    def test_backlog_drains_in_bulk_batches(self):
+        """Test every unread message is processed in one cycle, fetched in batches."""
+        uids = self.deliver(25)
+        with patch('mail_sync.SYNC_BATCH_SIZE', 10):
+            logs = self.cycle()
+        self.assertEqual(len(logs), 25)
+        # Headers, then bodies, per batch
+        self.assertEqual(self.server.commands.count("UID FETCH"), 6)
+        self.assertEqual(self.seen_uids(), set(uids))
+        self.assertEqual(self.state["last_uid"], uids[-1])
+
+    def test_failed_message_stays_unseen_and_is_retried(self):
+        """Test \\Seen is only set on handled messages and the mark stops below a failure."""
+        uids = self.deliver(3)
+        # A reply that can't even be queued; a failed SMTP send is queued for retry instead
+        self.cycle(fail_to="p1@example.com")
+        self.assertEqual(self.seen_uids(), {uids[0], uids[2]})
+        self.assertEqual(self.state["last_uid"], uids[0])
+
+        logs = self.cycle()
+        self.assertEqual([l["subject"] for l in logs], ["Question 1"])
+        self.assertEqual(self.seen_uids(), set(uids))
+        self.assertEqual(self.state["last_uid"], uids[2])
+
+    def test_only_new_uids_are_fetched(self):
+        """Test later cycles search above the mark and skip SEARCH when nothing arrived."""
+        self.deliver(2)
+        self.cycle()
+        searches = self.server.commands.count("UID SEARCH")
+
+        self.assertEqual(self.cycle(), [])
+        self.assertEqual(self.server.commands.count("UID SEARCH"), searches)
+
+        self.deliver(1, start=2)
+        logs = self.cycle()
+        self.assertEqual([l["subject"] for l in logs], ["Question 2"])
+
+    def test_uidvalidity_change_resets_mark(self):
+        """Test a new UIDVALIDITY invalidates the stored position."""
+        self.deliver(2)
+        self.cycle()
+        self.server.mailboxes[USER].uidvalidity = 99
+        for m in self.server.mailboxes[USER].messages:
+            m.flags.discard("\\Seen")
+        self.pool.close_all()
+        logs = self.cycle()
+        self.assertEqual(len(logs), 2)
+        self.assertEqual(self.state["uidvalidity"], 99)
+
+    def test_first_sync_takes_newest_backlog_only(self):
+        """Test an account's first sync leaves old unread mail alone beyond the cap."""
+        uids = self.deliver(5)
+        with patch('mail_sync.SYNC_INITIAL_BACKLOG', 2):
+            logs = self.cycle()
+        self.assertEqual([l["subject"] for l in logs], ["Question 3", "Question 4"])
+        self.assertEqual(self.seen_uids(), set(uids[3:]))
+        self.assertEqual(self.cycle(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import time
+import asyncio
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+
+from fastapi.testclient import TestClient
+import main
+import agent_logic
+import metrics
+from metrics import Counter, Histogram, Registry
+from llm_client import LLMClient
+from imap_pool import ImapPool
+from fake_imap import FakeImapServer, make_message
+from mock_openrouter import MockOpenRouter
+
+USER = "me@example.com"
+PASSWORD = "secret"
+
+class TestExposition(unittest.TestCase):
+
+    def test_prometheus_text_format(self):
+        """Test counters and cumulative histogram buckets render as Prometheus text."""
+        registry = Registry()
+        counter = registry.register(Counter("things", "Things.", ["kind"]))
+        histogram = registry.register(Histogram("wait_seconds", "Waits.", ["stage"], buckets=(0.1, 1)))
+        counter.inc(kind='a "quoted"\nvalue')
+        counter.inc(2, kind="b")
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, stage="llm")
+        text = registry.render()
+        self.assertIn("# TYPE email_agent_things_total counter", text)
+        self.assertIn('email_agent_things_total{kind="a \\"quoted\\"\\nvalue"} 1', text)
+        self.assertIn('email_agent_things_total{kind="b"} 2', text)
+        self.assertIn('email_agent_wait_seconds_bucket{stage="llm",le="0.1"} 1', text)
+        self.assertIn('email_agent_wait_seconds_bucket{stage="llm",le="1"} 2', text)
+        self.assertIn('email_agent_wait_seconds_bucket{stage="llm",le="+Inf"} 3', text)
+        self.assertIn('email_agent_wait_seconds_count{stage="llm"} 3', text)
+        self.assertIn('email_agent_wait_seconds_sum{stage="llm"} 5.55', text)
+
+    def test_spans_are_noops_without_opentelemetry(self):
+        """Test span helpers cost nothing when tracing is off."""
+        with patch('metrics._tracer', None):
+            self.assertIsNone(metrics.start_span("x"))
+            metrics.end_span(None, action="Replied")
+            with metrics.span("y") as current:
+                self.assertIsNone(current)
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_cycle_records_stages_and_outcomes(self):
+        """Test a cycle observes imap/classify/llm/smtp/cycle latency and counts messages by intent and action."""
+        server = FakeImapServer({USER: PASSWORD}).start()
+        pool = ImapPool(server.host, server.port, ssl=False, timeout=5)
+        server.deliver(USER, make_message("a@example.com", "Bug", "Please help, the app crashes"))
+        server.deliver(USER, make_message("noreply@shop.com", "Deal", "50% off"))
+        before = {stage: metrics.stage_seconds.count(stage=stage) for stage in ("imap", "classify", "smtp", "cycle")}
+        replied = metrics.messages.value(intent="Support Query", action="Replied")
+        try:
+            with patch('agent_logic.imap_pool', pool), \
+                 patch('agent_logic.generate_reply_llm', return_value="On it."), \
+                 patch('agent_logic.smtp_pool.send', return_value={"sent": True, "error": None}):
+                agent_logic.run_agent_cycle(USER, PASSWORD, "key")
+        finally:
+            pool.close_all()
+            server.stop()
+        for stage in ("imap", "classify", "smtp", "cycle"):
+            self.assertGreater(metrics.stage_seconds.count(stage=stage), before[stage], stage)
+        self.assertEqual(metrics.messages.value(intent="Support Query", action="Replied"), replied + 1)
+        self.assertGreaterEqual(metrics.messages.value(intent="none", action="Ignored (No-Reply)"), 1)
+
+    def test_token_usage_from_chat_and_stream(self):
+        """Test the usage field of completions (and of a stream's last chunk) is counted per model."""
+        server = MockOpenRouter(responder=lambda p: "Sure, Friday works.").start()
+        client = LLMClient(url=server.url, max_retries=0, on_usage=metrics.record_usage)
+        prompt = metrics.llm_tokens.value(model="m1", type="prompt")
+        completion = metrics.llm_tokens.value(model="m1", type="completion")
+        try:
+            client.chat_sync({"model": "m1", "messages": [{"role": "user", "content": "x" * 400}]}, "key")
+            list(client.stream_sync({"model": "m1", "messages": [{"role": "user", "content": "x" * 400}]}, "key"))
+        finally:
+            client.close()
+            server.stop()
+        self.assertEqual(metrics.llm_tokens.value(model="m1", type="prompt"), prompt + 200)
+        # 19 chars // 4 for the completion, one per chunk (3 words) for the stream
+        self.assertEqual(metrics.llm_tokens.value(model="m1", type="completion"), completion + 4 + 3)
+
+    def test_scheduler_lag_and_metrics_endpoint(self):
+        """Test lag is observed from the popped due time, and /metrics serves everything."""
+        main.store._conn().execute("DELETE FROM users")
+        main.store.upsert({"email": "lag@example.com", "app_password": "pw", "openrouter_key": "k",
+                           "active": True, "interval_minutes": 30})
+        main.scheduler.reschedule("lag@example.com", time.time() - 2)
+        lagged = metrics.scheduler_lag_seconds.count()
+
+        def fake_cycle(email, app_pass, api_key, deadline=None, sync_state=None, on_action=None):
+            return [], "2025-01-01T00:00:00"
+
+        async def scenario():
+            await main.active_user_job(main.scheduler.pop_due(time.time()))
+            await asyncio.sleep(0.2)
+
+        with patch('main.run_agent_cycle', fake_cycle):
+            asyncio.run(scenario())
+        self.assertEqual(metrics.scheduler_lag_seconds.count(), lagged + 1)
+        self.assertEqual(main.scheduler.popped_due, {})
+
+        response = TestClient(main.app).get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        for name in ("email_agent_scheduler_lag_seconds_bucket", "email_agent_cycles_total{outcome=\"ok\"}",
+                     "email_agent_running_cycles", "email_agent_outbox_pending"):
+            self.assertIn(name, response.text)
+
+if __name__ == '__main__':
+    unittest.main()
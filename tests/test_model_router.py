@@ -0,0 +1,127 @@
+import unittest
+import sys
+import os
+import time
+from unittest.mock import patch
+
+# Add backend and tests directories to path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from llm_client import LLMClient, LLMError
+from model_router import ModelRouter, ModelStats, parse_models, reply_tier, CHEAP_TIER, DEFAULT_TIER
+from reply_stream import stream_reply
+from mock_openrouter import MockOpenRouter
+
+PAYLOAD = {"messages": [{"role": "user", "content": "hi"}]}
+
+def answer_with_model(payload):
+    return f"Reply from {payload['model']}.\nAI Agent"
+
+def content(data):
+    return data["choices"][0]["message"]["content"]
+
+class TestRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.server = None
+        self.client = None
+        # Keep retry sleeps short
+        self.backoff = patch('llm_client.LLM_BACKOFF_BASE', 0.01)
+        self.backoff.start()
+
+    def tearDown(self):
+        self.backoff.stop()
+        if self.client:
+            self.client.close()
+        if self.server:
+            self.server.stop()
+
+    def router(self, models, per_model=None, **kwargs):
+        self.server = MockOpenRouter(responder=answer_with_model, per_model=per_model).start()
+        self.client = LLMClient(url=self.server.url)
+        return ModelRouter(self.client, parse_models(models), **kwargs)
+
+    def models_requested(self):
+        return [r["payload"]["model"] for r in self.server.requests]
+
+    def test_fails_over_without_retrying(self):
+        """Test a rate-limited model is skipped at once and benched after repeated failures."""
+        router = self.router("a,b", per_model={"a": {"status": 429}}, hedge=False)
+        for _ in range(3):
+            self.assertEqual(content(router.chat_sync(PAYLOAD, "key")), "Reply from b.\nAI Agent")
+        self.assertEqual(self.models_requested(), ["a", "b"] * 3)
+        self.assertFalse(router.stats("chat", "a").healthy())
+        self.assertEqual(router.candidates(), ["b", "a"])
+        router.chat_sync(PAYLOAD, "key")
+        self.assertEqual(self.models_requested()[-1], "b")
+
+    def test_last_model_keeps_its_retries(self):
+        """Test the final candidate still gets the client's retries before giving up."""
+        router = self.router("a", per_model={"a": {"status": 503}}, hedge=False)
+        with self.assertRaises(LLMError):
+            router.chat_sync(PAYLOAD, "key")
+        self.assertEqual(len(self.server.requests), self.client.max_retries + 1)
+
+    def test_hedges_slow_model(self):
+        """Test a request still unanswered at the hedge deadline is raced against the next model."""
+        router = self.router("slow,fast", per_model={"slow": {"latency": 1.0}})
+        with patch('model_router.LLM_HEDGE_DEFAULT_MS', 50):
+            start = time.perf_counter()
+            data = router.chat_sync(PAYLOAD, "key")
+        self.assertEqual(content(data), "Reply from fast.\nAI Agent")
+        self.assertLess(time.perf_counter() - start, 0.8)
+        self.assertEqual(self.models_requested(), ["slow", "fast"])
+        self.assertEqual(router.stats("chat", "fast").as_dict()["requests"], 1)
+        # The loser's time so far is a (censored) sample of its latency, not a request
+        slow = router.stats("chat", "slow")
+        self.assertEqual((len(slow.latencies), slow.as_dict()["requests"]), (1, 0))
+        self.assertGreaterEqual(slow.latencies[0], 0.05)
+
+    def test_hedged_stream_uses_one_model(self):
+        """Test a hedged stream takes its text from whichever model answers first, never both."""
+        router = self.router("slow,fast", per_model={"slow": {"latency": 0.5}})
+        with patch('model_router.LLM_HEDGE_DEFAULT_MS', 50):
+            result = stream_reply(router.tier(DEFAULT_TIER), PAYLOAD, "key")
+        self.assertEqual(result["reply"], "Reply from fast.\nAI Agent")
+        self.assertIsNotNone(router.stats("stream", "fast").p(0.5))
+
+    def test_prefers_faster_model_and_cheap_tier(self):
+        """Test measured latency (scaled by weight) picks the model; the cheap tier tries its models first."""
+        router = self.router("a,b:2", hedge=False, cheap_models=[("small", 1.0)])
+        for latency in (0.4, 0.5, 0.6):
+            router.stats("chat", "a").success(latency)
+            router.stats("chat", "b").success(latency * 1.5)
+        self.assertEqual(router.candidates(), ["b", "a"])
+        self.assertEqual(router.candidates(CHEAP_TIER), ["small", "b", "a"])
+        router.tier(CHEAP_TIER).chat_sync(PAYLOAD, "key")
+        self.assertEqual(self.models_requested(), ["small"])
+
+class TestPolicy(unittest.TestCase):
+
+    def test_tier_models(self):
+        """Test cache keys name every model a tier can fall over to."""
+        router = ModelRouter(None, parse_models("b,a"), cheap_models=parse_models("c"))
+        self.assertEqual(router.tier_models(DEFAULT_TIER), "a,b")
+        self.assertEqual(router.tier_models(CHEAP_TIER), "a,b,c")
+
+    def test_parse_models(self):
+        """Test weights are optional and ':free'-style suffixes stay part of the name."""
+        self.assertEqual(parse_models("a/x:2, b/y, c/z:free"), [("a/x", 2.0), ("b/y", 1.0), ("c/z:free", 1.0)])
+
+    def test_reply_tier(self):
+        """Test simple intents and short mails go to the cheap tier."""
+        self.assertEqual(reply_tier("General", "x" * 1000), CHEAP_TIER)
+        self.assertEqual(reply_tier("Support Query", "Login broken"), CHEAP_TIER)
+        self.assertEqual(reply_tier("Support Query", "x" * 1000), DEFAULT_TIER)
+
+    def test_benched_model_is_probed_after_cooldown(self):
+        """Test an erroring model becomes eligible again once the cooldown passes."""
+        stats = ModelStats()
+        for _ in range(3):
+            stats.failure(now=1000)
+        self.assertFalse(stats.healthy(now=1001))
+        self.assertTrue(stats.healthy(now=1000 + 31))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import unittest
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+import agent_logic
+from imap_pool import ImapPool
+from outbox import Outbox, OutboxSender, RateLimiter, idempotency_key, references_for, OUTBOX_MAX_ATTEMPTS
+from fake_imap import FakeImapServer, make_message
+
+USER = "me@example.com"
+PASSWORD = "secret"
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.outbox = Outbox("")
+        self.sent = []
+        self.up = True
+
+        def send(entry, app_pass):
+            if self.up:
+                self.sent.append(entry["to_addr"])
+            return self.up
+
+        self.sender = OutboxSender(self.outbox, send, rate_per_minute=0)
+
+    def tearDown(self):
+        self.outbox.close()
+
+    def queue(self, message_id="<a1@example.com>", now=1000.0):
+        key = idempotency_key(USER, message_id, "ann@example.com", "Hi", "body")
+        return self.outbox.enqueue(USER, key, "ann@example.com", "Hi", "Reply", in_reply_to=message_id, now=now)
+
+    def test_enqueue_is_idempotent(self):
+        """Test the same Message-ID (in any spelling) is only ever queued once."""
+        entry, new = self.queue()
+        again, new_again = self.queue(message_id=" <A1@example.com>")
+        self.assertTrue(new)
+        self.assertFalse(new_again)
+        self.assertEqual(entry["id"], again["id"])
+        self.assertEqual(self.outbox.depth()["pending"], 1)
+        self.assertNotEqual(idempotency_key(USER, "", "x", "Hi", "body"), idempotency_key(USER, "", "y", "Hi", "body"))
+
+    def test_claim_leases_entries(self):
+        """Test a claimed entry isn't handed out again until its lease expires."""
+        self.queue()
+        self.assertEqual(len(self.outbox.claim(now=1000.0)), 1)
+        self.assertEqual(self.outbox.claim(now=1001.0), [])
+        # The sender crashed mid-send: the lease runs out and the entry comes back
+        self.assertEqual(len(self.outbox.claim(now=1000.0 + 3600)), 1)
+
+    def test_retries_back_off_then_dead_letter(self):
+        """Test failed sends are retried later and later, then given up on."""
+        entry, _ = self.queue()
+        self.up = False
+        now = 1000.0
+        delays = []
+        for _ in range(OUTBOX_MAX_ATTEMPTS):
+            self.assertEqual(self.sender.drain(lambda user: PASSWORD, now=now), 0)
+            entry = self.outbox.get(entry["id"])
+            delays.append(entry["next_attempt_at"] - now)
+            # Nothing is due before the backoff has passed
+            self.assertEqual(self.outbox.claim(now=now + 1), [])
+            now = entry["next_attempt_at"]
+        self.assertEqual(delays[:3], [30, 60, 120])
+        self.assertEqual(entry["status"], "failed")
+        self.assertEqual(self.sender.metrics()["dead_lettered"], 1)
+        self.assertEqual(self.sent, [])
+
+    def test_delivery_after_outage(self):
+        """Test a queued reply goes out once SMTP is back, exactly once."""
+        entry, _ = self.queue()
+        self.up = False
+        self.sender.drain(lambda user: PASSWORD, now=1000.0)
+        self.up = True
+        self.assertEqual(self.sender.drain(lambda user: PASSWORD, now=1000.0 + 30), 1)
+        self.assertEqual(self.sender.drain(lambda user: PASSWORD, now=1000.0 + 3600), 0)
+        self.assertEqual(self.sent, ["ann@example.com"])
+        metrics = self.sender.metrics()
+        self.assertEqual((metrics["depth"]["sent"], metrics["delivered"], metrics["retries_scheduled"]), (1, 1, 1))
+        self.assertIsNotNone(metrics["delivery_latency_ms"]["p50"])
+
+    def test_rate_limit_defers_without_counting_an_attempt(self):
+        """Test sends beyond the per-account rate wait for the bucket to refill."""
+        limiter = RateLimiter(rate_per_minute=2)
+        self.assertEqual([limiter.acquire(USER, now=0), limiter.acquire(USER, now=0)], [0, 0])
+        self.assertAlmostEqual(limiter.acquire(USER, now=0), 30)
+        self.assertEqual(limiter.acquire("other@example.com", now=0), 0)
+
+        self.sender.limiter = RateLimiter(rate_per_minute=1)
+        self.queue("<a1@example.com>")
+        self.queue("<a2@example.com>")
+        self.assertEqual(self.sender.drain(lambda user: PASSWORD, now=1000.0), 1)
+        deferred = self.outbox.claim(now=1000.0 + 60)
+        self.assertEqual(len(deferred), 1)
+        self.assertEqual(deferred[0]["attempts"], 0)
+
+    def test_references_chain(self):
+        """Test References carries the thread and ends with the parent's Message-ID."""
+        self.assertEqual(references_for("<b@x>", "<root@x> <a@x>"), "<root@x> <a@x> <b@x>")
+        self.assertEqual(references_for("<b@x>", "<b@x>"), "<b@x>")
+        self.assertEqual(references_for("", ""), "")
+
+class TestCycleOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeImapServer({USER: PASSWORD}).start()
+        self.pool = ImapPool(self.server.host, self.server.port, ssl=False, timeout=5)
+        self.patches = [
+            patch('agent_logic.imap_pool', self.pool),
+            patch('agent_logic.generate_reply_llm', return_value="Looking into it."),
+            patch('agent_logic.outbox', Outbox("")),
+        ]
+        for p in self.patches:
+            p.start()
+        agent_logic.outbox_sender.outbox = agent_logic.outbox
+        self.messages = []
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        agent_logic.outbox_sender.outbox = agent_logic.outbox
+        self.pool.close_all()
+        self.server.stop()
+
+    def smtp_send(self, up):
+        def send(user_email, app_pass, msg):
+            if up:
+                self.messages.append(msg)
+                return {"to": msg["To"], "sent": True, "error": None}
+            return {"to": msg["To"], "sent": False, "error": "421 try again later"}
+        return patch('agent_logic.smtp_pool.send', send)
+
+    def cycle(self):
+        logs, _ = agent_logic.run_agent_cycle(USER, PASSWORD, "key")
+        return [(l["subject"], l["action"]) for l in logs]
+
+    def test_smtp_outage_queues_reply_and_worker_sends_it_threaded(self):
+        """Test an SMTP failure queues the reply, marks the mail read, and the worker sends it once."""
+        raw = make_message("ann@example.com", "Login issue", "Please help, login fails",
+                           headers={"References": "<root@example.com>"})
+        uid = self.server.deliver(USER, raw)
+        stored = [m for m in self.server.mailboxes[USER].messages if m.uid == uid][0]
+        with self.smtp_send(up=False):
+            self.assertEqual(self.cycle(), [("Login issue", "Reply Queued")])
+        self.assertIn("\\Seen", stored.flags)
+        self.assertEqual(self.messages, [])
+
+        with self.smtp_send(up=True):
+            # Next cycle finds nothing new; the worker delivers once the backoff is over
+            self.assertEqual(self.cycle(), [])
+            self.assertEqual(agent_logic.outbox_sender.drain(lambda user: PASSWORD, now=2e9), 1)
+            self.assertEqual(agent_logic.outbox_sender.drain(lambda user: PASSWORD, now=2e9), 0)
+        self.assertEqual(len(self.messages), 1)
+        reply = self.messages[0]
+        original = stored.obj["Message-ID"]
+        self.assertEqual(reply["In-Reply-To"], original)
+        self.assertEqual(reply["References"], f"<root@example.com> {original}")
+        self.assertTrue(reply["Message-ID"].startswith("<reply."))
+
+    def test_reprocessed_mail_is_not_replied_twice(self):
+        """Test a message seen again (e.g. after a crash before \\Seen) reuses its sent reply."""
+        self.server.deliver(USER, make_message("ann@example.com", "Login issue", "Please help"))
+        with self.smtp_send(up=True):
+            self.assertEqual(self.cycle(), [("Login issue", "Replied")])
+            for m in self.server.mailboxes[USER].messages:
+                m.flags.discard("\\Seen")
+            self.assertEqual(self.cycle(), [("Login issue", "Replied")])
+        self.assertEqual(len(self.messages), 1)
+
+if __name__ == '__main__':
+    unittest.main()
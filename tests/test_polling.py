@@ -0,0 +1,78 @@
+import unittest
+import time
+import asyncio
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+
+from fastapi.testclient import TestClient
+import main
+from polling import next_poll, POLL_MIN_MINUTES, POLL_MAX_MINUTES
+
+USER = "poll@example.com"
+
+class TestNextPoll(unittest.TestCase):
+
+    def test_idle_inbox_backs_off_exponentially(self):
+        """Test each empty check doubles the interval, up to the maximum."""
+        user = {"interval_minutes": 30}
+        intervals = []
+        for _ in range(5):
+            user.update(next_poll(user, 0, 30))
+            intervals.append(user["poll_interval"])
+        self.assertEqual(intervals, [60, 120, 240, POLL_MAX_MINUTES, POLL_MAX_MINUTES])
+        self.assertEqual(user["empty_cycles"], 5)
+
+    def test_busy_inbox_polls_faster_than_its_interval(self):
+        """Test a burst shortens the interval to find about POLL_TARGET_MESSAGES, and mail resets the backoff."""
+        user = {"interval_minutes": 30, "poll_interval": 240, "empty_cycles": 4}
+        user.update(next_poll(user, 30, 60))
+        self.assertEqual(user["empty_cycles"], 0)
+        self.assertLess(user["poll_interval"], 30)
+        self.assertGreaterEqual(user["poll_interval"], POLL_MIN_MINUTES)
+        # A trickle never stretches it past the account's own interval
+        self.assertEqual(next_poll({"interval_minutes": 30}, 1, 600)["poll_interval"], 30)
+
+    def test_backlog_comes_back_soon(self):
+        """Test a check that left mail pending is repeated after the minimum interval."""
+        self.assertEqual(next_poll({"interval_minutes": 30}, 50, 30, backlog=True)["poll_interval"],
+                         POLL_MIN_MINUTES)
+
+class TestAdaptiveSchedule(unittest.TestCase):
+
+    def setUp(self):
+        main.store._conn().execute("DELETE FROM users")
+        main.leases._conn().execute("DELETE FROM leases")
+        main.store.upsert({"email": USER, "app_password": "pw", "openrouter_key": "k", "active": True,
+                           "interval_minutes": 30, "last_run": "2025-01-01T09:00:00"})
+
+    def run_cycle(self, messages):
+        def fake_cycle(email, app_pass, api_key, deadline=None, sync_state=None, on_action=None):
+            main.fetch_stats[email] = {"messages": messages}
+            return [], "2025-01-01T10:00:00"
+
+        async def scenario():
+            await main.active_user_job([USER])
+            await asyncio.sleep(0.2)
+
+        with patch('main.run_agent_cycle', fake_cycle), patch('main.ADAPTIVE_POLLING', True):
+            asyncio.run(scenario())
+        return main.store.get(USER)
+
+    def test_empty_cycle_pushes_the_next_check_back(self):
+        """Test the stored due time follows the adapted interval, and empty checks are counted."""
+        empty = main.polls.value(result="empty")
+        user = self.run_cycle(0)
+        self.assertEqual((user["poll_interval"], user["empty_cycles"]), (60, 1))
+        self.assertEqual(user["next_due_at"], time.mktime((2025, 1, 1, 11, 0, 0, 0, 0, -1)))
+        self.assertEqual(main.polls.value(result="empty"), empty + 1)
+
+    def test_settings_restart_from_the_new_interval(self):
+        """Test changing the interval drops the adapted one."""
+        self.run_cycle(0)
+        TestClient(main.app).post("/settings", json={"email": USER, "interval": 15})
+        self.assertEqual(main.store.get(USER)["next_due_at"], time.mktime((2025, 1, 1, 10, 15, 0, 0, 0, -1)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+import re
+import json
+import time
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+
+from fastapi.testclient import TestClient
+import main
+import agent_logic
+from llm_client import LLMClient, LLMError
+from model_router import ModelRouter
+from reply_stream import ReplyFilter, stream_reply
+from mock_openrouter import MockOpenRouter
+
+USER = "me@example.com"
+MESSY = ('<s> "Subject: Re: Login issue\n\nDear Ann,\n\nThanks for reaching out. [Your Company Name] is '
+         'looking into it.\n\nBest regards,\n[Your Name]\nAI Agent\n\nSubject: Alternative reply\nDear Ann,"</s>')
+
+def tokens(text):
+    return re.findall(r"\s*\S+|\s+$", text)
+
+def run_filter(deltas, **kwargs):
+    reply_filter = ReplyFilter(**kwargs)
+    out = []
+    for delta in deltas:
+        out.append(reply_filter.feed(delta))
+        if reply_filter.done:
+            break
+    out.append(reply_filter.finish())
+    return "".join(out), reply_filter
+
+class TestReplyFilter(unittest.TestCase):
+
+    def test_artifacts_stripped_and_stops_at_sign_off(self):
+        """Test tags, quotes, Subject lines and placeholders never reach the output."""
+        text, reply_filter = run_filter(tokens(MESSY))
+        self.assertEqual(text, "Dear Ann,\n\nThanks for reaching out. is looking into it.\n\nBest regards,\nAI Agent")
+        self.assertEqual(reply_filter.text(), text)
+        self.assertEqual(reply_filter.stop_reason, "sign_off")
+
+    def test_chunk_boundaries_do_not_matter(self):
+        """Test the same reply comes out whether streamed per token or per character."""
+        per_char, _ = run_filter(list(MESSY))
+        per_token, _ = run_filter(tokens(MESSY))
+        self.assertEqual(per_char, per_token)
+
+    def test_stop_patterns_and_budget(self):
+        """Test role labels and template markers end the reply, and the token budget is enforced."""
+        text, reply_filter = run_filter(tokens("Hi Bob,\nSure, Friday works.\nUser: and then?"))
+        self.assertEqual((text, reply_filter.stop_reason), ("Hi Bob,\nSure, Friday works.", "stop_pattern"))
+        text, reply_filter = run_filter(tokens("Hi Bob, thanks.[/INST] Draft two"))
+        self.assertEqual((text, reply_filter.stop_reason), ("Hi Bob, thanks.", "stop_pattern"))
+        text, reply_filter = run_filter(tokens("word " * 50), max_tokens=10)
+        self.assertEqual((len(text.split()), reply_filter.stop_reason), (10, "max_tokens"))
+
+class TestStreamingClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = None
+        self.client = None
+
+    def tearDown(self):
+        if self.client:
+            self.client.close()
+        if self.server:
+            self.server.stop()
+
+    def start(self, **kwargs):
+        self.server = MockOpenRouter(**kwargs).start()
+        self.client = LLMClient(url=self.server.url, max_retries=1)
+
+    def test_early_stop_closes_stream(self):
+        """Test generation stops at the sign-off and the server stops sending chunks."""
+        self.start(responder=lambda p: MESSY + " filler" * 200, chunk_delay=0.002)
+        result = stream_reply(self.client, {"model": "m", "messages": []}, "key")
+        self.assertTrue(result["reply"].endswith("AI Agent"))
+        self.assertEqual(result["stop_reason"], "sign_off")
+        self.assertLessEqual(result["ttft_ms"], result["total_ms"])
+        self.assertEqual(self.server.requests[0]["payload"]["max_tokens"], 300)
+        self.assertTrue(self.server.requests[0]["payload"]["stream"])
+        time.sleep(0.1)
+        self.assertLess(self.server.chunks_sent, 60)
+
+    def test_retries_before_first_token(self):
+        """Test a 503 before anything is streamed is retried; errors after retries raise."""
+        self.start(script=[503])
+        with patch('llm_client.LLM_BACKOFF_BASE', 0.01):
+            self.assertIn("AI Agent", "".join(self.client.stream_sync({"model": "m"}, "key")))
+            self.server.script = [503, 503]
+            with self.assertRaises(LLMError):
+                list(self.client.stream_sync({"model": "m"}, "key"))
+
+    def test_backend_reply_streams(self):
+        """Test generate_reply_llm streams, and falls back when the request fails."""
+        self.start()
+        with patch('agent_logic.model_router', ModelRouter(self.client)):
+            reply = agent_logic.generate_reply_llm("Login is broken", "Support Query", "s", "Ann", "key")
+        self.assertTrue(self.server.requests[0]["payload"]["stream"])
+        self.assertTrue(reply.startswith("Thank you for your email."))
+        with patch('agent_logic.model_router.stream_sync', side_effect=LLMError("down")):
+            reply = agent_logic.generate_reply_llm("Login is broken", "Support Query", "s", "Ann", "key")
+        self.assertEqual(reply, "Thank you for your email. We will get back to you shortly.")
+
+class TestDraftEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockOpenRouter(responder=lambda p: MESSY).start()
+        self.llm = LLMClient(url=self.server.url, max_retries=0)
+        main.store.upsert({"email": USER, "app_password": "pw", "openrouter_key": "key", "active": False,
+                           "interval_minutes": 30, "last_run": None})
+        self.client = TestClient(main.app)
+
+    def tearDown(self):
+        self.llm.close()
+        self.server.stop()
+
+    def events(self, response):
+        out = []
+        for block in response.text.strip().split("\n\n"):
+            event, data = block.split("\n")
+            out.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return out
+
+    def test_draft_streams_events(self):
+        """Test POST /draft streams cleaned deltas and ends with timing metrics."""
+        with patch('main.model_router', ModelRouter(self.llm)):
+            response = self.client.post("/draft", json={"email": USER, "text": "Please help, login fails",
+                                                        "sender_name": "Ann"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+        events = self.events(response)
+        self.assertEqual(events[0], ("intent", "Support Query"))
+        draft = "".join(data for event, data in events if event == "delta")
+        self.assertTrue(draft.startswith("Dear Ann,") and draft.endswith("AI Agent"))
+        self.assertNotIn("Subject", draft)
+        event, metrics = events[-1]
+        self.assertEqual((event, metrics["stop_reason"]), ("done", "sign_off"))
+        self.assertIn("ttft_ms", metrics)
+        self.assertGreaterEqual(self.client.get("/generation").json()["replies"], 1)
+
+    def test_draft_unknown_user(self):
+        """Test /draft needs a logged-in account (for its OpenRouter key)."""
+        self.assertEqual(self.client.post("/draft", json={"email": "x@y.z", "text": "hi"}).status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
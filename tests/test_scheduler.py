@@ -0,0 +1,55 @@
+import unittest
+import sys
+import os
+import time
+import asyncio
+
+# Add backend directory to path to import scheduler
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from scheduler import DueScheduler
+
+class TestDueScheduler(unittest.TestCase):
+
+    def test_pop_due_only_returns_due_users(self):
+        """Test that only users past their deadline are popped, earliest first."""
+        sched = DueScheduler()
+        sched.load([("a", 100.0), ("b", 50.0), ("c", 300.0)])
+        self.assertEqual(sched.pop_due(150.0), ["b", "a"])
+        self.assertEqual(sched.next_deadline(), 300.0)
+        self.assertEqual(len(sched), 1)
+
+    def test_reschedule_and_remove(self):
+        """Test that moving or removing a user discards its old heap entry."""
+        sched = DueScheduler()
+        sched.load([("a", 100.0), ("b", 200.0)])
+        sched.reschedule("a", 500.0)
+        sched.remove("b")
+        self.assertEqual(sched.pop_due(400.0), [])
+        self.assertEqual(sched.next_deadline(), 500.0)
+        self.assertEqual(sched.pop_due(500.0), ["a"])
+        self.assertIsNone(sched.next_deadline())
+
+    def test_run_wakes_on_deadline_and_reschedule(self):
+        """Test the run loop sleeps until deadlines instead of polling."""
+        async def scenario():
+            sched = DueScheduler()
+            seen = []
+
+            async def callback(emails):
+                seen.append((emails, time.time()))
+
+            sched.load([("a", time.time() + 0.05)])
+            task = asyncio.create_task(sched.run(callback))
+            await asyncio.sleep(0.01)
+            # Earlier deadline added while sleeping must wake the loop
+            sched.reschedule("b", time.time())
+            await asyncio.sleep(0.15)
+            task.cancel()
+            return seen
+
+        seen = asyncio.run(scenario())
+        self.assertEqual([emails for emails, _ in seen], [["b"], ["a"]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import sys
+import os
+import socket
+from email.mime.text import MIMEText
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+# Add backend directory to path to import smtp_pool
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from smtp_pool import SmtpPool
+
+USER = "me@example.com"
+PASSWORD = "secret"
+
+class SinkHandler:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("reject"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 Message accepted"
+
+def authenticator(server, session, envelope, mechanism, auth_data):
+    ok = auth_data.login.decode() == USER and auth_data.password.decode() == PASSWORD
+    return AuthResult(success=ok, handled=False)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def make_msg(to):
+    msg = MIMEText("hello")
+    msg['Subject'] = "Re: test"
+    msg['From'] = USER
+    msg['To'] = to
+    return msg
+
+class TestSmtpPool(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = SinkHandler()
+        self.controller = Controller(
+            self.handler, hostname="127.0.0.1", port=free_port(),
+            authenticator=authenticator, auth_require_tls=False
+        )
+        self.controller.start()
+        self.pool = SmtpPool("127.0.0.1", self.controller.port, starttls=False, timeout=5)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.controller.stop()
+
+    def test_batch_uses_one_session(self):
+        """Test a batch of replies is sent over a single login."""
+        results = self.pool.send_batch(USER, PASSWORD, [make_msg(f"r{i}@example.com") for i in range(5)])
+        self.assertTrue(all(r["sent"] for r in results))
+        self.assertEqual(len(self.handler.messages), 5)
+        self.pool.send(USER, PASSWORD, make_msg("again@example.com"))
+        self.assertEqual(self.pool.connects, 1)
+
+    def test_rejected_message_does_not_stop_batch(self):
+        """Test per-message results when one recipient is refused."""
+        results = self.pool.send_batch(USER, PASSWORD, [
+            make_msg("a@example.com"), make_msg("reject@example.com"), make_msg("b@example.com")
+        ])
+        self.assertEqual([r["sent"] for r in results], [True, False, True])
+        self.assertIsNotNone(results[1]["error"])
+        self.assertEqual(self.pool.connects, 1)
+
+    def test_reconnects_after_disconnect(self):
+        """Test a session closed by the server is replaced transparently."""
+        self.pool.send(USER, PASSWORD, make_msg("a@example.com"))
+        # Break the pooled socket behind the pool's back
+        server, _, _ = self.pool._idle[USER]
+        server.sock.shutdown(socket.SHUT_RDWR)
+        result = self.pool.send(USER, PASSWORD, make_msg("b@example.com"))
+        self.assertTrue(result["sent"])
+        self.assertEqual(self.pool.connects, 2)
+
+    def test_bad_credentials_fail_every_message(self):
+        """Test an auth failure is reported for each message without retry storms."""
+        results = self.pool.send_batch(USER, "wrong", [make_msg("a@example.com"), make_msg("b@example.com")])
+        self.assertEqual([r["sent"] for r in results], [False, False])
+        self.assertEqual(self.handler.messages, [])
+
+if __name__ == '__main__':
+    unittest.main()
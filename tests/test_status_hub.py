@@ -0,0 +1,122 @@
+import unittest
+import json
+import asyncio
+from unittest.mock import patch
+
+# Paths and throwaway stores, before any backend module is imported
+import backend_env  # noqa: F401
+
+from fastapi.testclient import TestClient
+import main
+from status_hub import StatusHub
+
+USER = "hub@example.com"
+
+def parse(message):
+    event, data = message.strip().split("\n")
+    return event[len("event: "):], json.loads(data[len("data: "):])
+
+class TestStatusHub(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = StatusHub()
+        self.hub.load([{"email": USER, "active": True, "interval_minutes": 15, "last_run": None, "next_due_at": 0}])
+
+    def collect(self, scenario, count):
+        """Runs `scenario(hub)` while one subscriber reads `count` events."""
+        async def run():
+            stream = self.hub.stream(USER, keepalive=5)
+            events = [parse(await stream.__anext__())]
+            await asyncio.to_thread(scenario, self.hub)
+            for _ in range(count):
+                events.append(parse(await asyncio.wait_for(stream.__anext__(), 2)))
+            await stream.aclose()
+            return events
+        return asyncio.run(run())
+
+    def test_snapshot_then_cycle_events_in_order(self):
+        """Test a subscriber gets the snapshot, then events published from another thread."""
+        def cycle(hub):
+            hub.cycle_started(USER)
+            hub.action(USER, {"subject": "Hi", "sender": "a@x.com", "action": "Replied", "reply": "secret body"})
+            hub.cycle_finished(USER, 1, next_due_at=123.0)
+
+        events = self.collect(cycle, 3)
+        self.assertEqual([e for e, _ in events], ["status", "cycle_started", "action", "cycle_finished"])
+        self.assertEqual(events[0][1]["interval"], 15)
+        self.assertEqual(events[2][1], {"subject": "Hi", "sender": "a@x.com", "action": "Replied"})
+        self.assertEqual(events[3][1]["next_due_at"], 123.0)
+        self.assertEqual(self.hub.connections(), 0)
+
+        status = self.hub.get(USER)
+        self.assertFalse(status["running"])
+        self.assertEqual([a["subject"] for a in status["recent"]], ["Hi"])
+
+    def test_slow_subscriber_skips_to_snapshot(self):
+        """Test a subscriber whose queue fills up is sent the current state instead of a backlog."""
+        def flood(hub):
+            for i in range(10):
+                hub.action(USER, {"subject": f"m{i}", "action": "Replied"})
+
+        with patch('status_hub.STATUS_QUEUE_SIZE', 4):
+            events = self.collect(flood, 2)
+        # The backlog was replaced by a snapshot (which carries the recent actions)
+        self.assertEqual([e for e, _ in events], ["status", "status", "action"])
+        self.assertIn("m8", [a["subject"] for a in events[1][1]["recent"]])
+        self.assertEqual(events[2][1]["subject"], "m9")
+
+    def test_unknown_users_are_ignored(self):
+        """Test events for users without a snapshot are dropped."""
+        self.hub.cycle_started("nobody@example.com")
+        self.hub.action("nobody@example.com", {"action": "Replied"})
+        self.assertIsNone(self.hub.get("nobody@example.com"))
+
+class TestStatusEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        main.store._conn().execute("DELETE FROM users")
+        self.client = TestClient(main.app)
+
+    def test_status_follows_the_store(self):
+        """Test /login, /toggle and /settings update the snapshot, and /status sees other workers' runs."""
+        with patch('main.imap_pool.validate'):
+            self.client.post("/login", json={"email": USER, "app_password": "pw", "openrouter_key": "k",
+                                             "interval": 15})
+        self.client.post("/toggle", json={"email": USER, "active": False})
+        self.client.post("/settings", json={"email": USER, "interval": 60})
+        self.assertEqual(main.status_hub.get(USER)["interval"], 60)
+        status = self.client.post(f"/status?email={USER}").json()
+        self.assertEqual((status["active"], status["interval"], status["next_run"]), (False, 60, "Pending..."))
+        # A cycle run by another worker only shows in the store
+        main.store.update(USER, last_run="2025-01-01T00:00:00")
+        status = self.client.post(f"/status?email={USER}").json()
+        self.assertEqual((status["last_run"], status["next_run"]), ("2025-01-01T00:00:00", "Now/Soon"))
+        self.assertEqual(self.client.get("/status/stream?email=x@y.z").status_code, 404)
+
+    def test_cycle_progress_is_published(self):
+        """Test a scheduled cycle pushes its start, each action and its end."""
+        main.sync_schedule(main.store.upsert({"email": USER, "app_password": "pw", "openrouter_key": "k",
+                                              "active": True, "interval_minutes": 30}))
+
+        def fake_cycle(email, app_pass, api_key, deadline=None, sync_state=None, on_action=None):
+            on_action({"subject": "Hello", "sender": "a@x.com", "action": "Replied"})
+            return [{"subject": "Hello", "action": "Replied"}], "2025-01-01T00:00:00"
+
+        async def scenario():
+            stream = main.status_hub.stream(USER, keepalive=5)
+            events = [parse(await stream.__anext__())]
+            await main.active_user_job([USER])
+            while events[-1][0] != "status" or len(events) == 1:
+                events.append(parse(await asyncio.wait_for(stream.__anext__(), 2)))
+            await stream.aclose()
+            return events
+
+        with patch('main.run_agent_cycle', fake_cycle):
+            events = asyncio.run(scenario())
+        self.assertEqual([e for e, _ in events], ["status", "cycle_started", "action", "cycle_finished", "status"])
+        self.assertEqual(events[3][1]["actions"], 1)
+        self.assertEqual(events[-1][1]["last_run"], "2025-01-01T00:00:00")
+        self.assertEqual(events[-1][1]["next_run"][:3], "Now")
+
+if __name__ == '__main__':
+    unittest.main()
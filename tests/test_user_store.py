@@ -0,0 +1,84 @@
+import unittest
+import sys
+import os
+import json
+import time
+import shutil
+import tempfile
+
+# Add backend directory to path to import user_store
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from user_store import SQLiteUserStore, migrate_from_json, compute_next_due
+
+class TestUserStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = SQLiteUserStore(os.path.join(self.tmpdir, "users.db"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_upsert_and_get(self):
+        """Test a user round-trips through the store."""
+        self.store.upsert({
+            "email": "a@example.com",
+            "app_password": "pw",
+            "openrouter_key": "key",
+            "active": True,
+            "interval_minutes": 15,
+            "last_run": None
+        })
+        user = self.store.get("a@example.com")
+        self.assertEqual(user["app_password"], "pw")
+        self.assertIs(user["active"], True)
+        self.assertEqual(user["next_due_at"], 0.0)
+        self.assertIsNone(self.store.get("missing@example.com"))
+
+    def test_update_recomputes_next_due(self):
+        """Test that changing last_run or the interval moves the due time."""
+        self.store.upsert({"email": "a@example.com", "active": True, "interval_minutes": 30})
+        self.store.update("a@example.com", last_run="2025-01-01T10:00:00")
+        user = self.store.update("a@example.com", interval_minutes=5)
+        self.assertEqual(user["next_due_at"], compute_next_due("2025-01-01T10:00:00", 5))
+        self.assertIsNone(self.store.update("missing@example.com", active=False))
+        with self.assertRaises(ValueError):
+            self.store.update("a@example.com", bogus=1)
+
+    def test_due_users(self):
+        """Test only active users past their due time are returned, earliest first."""
+        now = time.time()
+        self.store.upsert({"email": "never@example.com", "active": True})
+        self.store.upsert({"email": "inactive@example.com", "active": False})
+        self.store.upsert({
+            "email": "future@example.com", "active": True, "interval_minutes": 30,
+            "last_run": "2999-01-01T00:00:00"
+        })
+        self.store.upsert({
+            "email": "late@example.com", "active": True, "interval_minutes": 1,
+            "last_run": "2000-01-01T00:00:00"
+        })
+        due = [u["email"] for u in self.store.due_users(now)]
+        self.assertEqual(due, ["never@example.com", "late@example.com"])
+
+    def test_migrate_from_json(self):
+        """Test legacy users.json is imported once and renamed."""
+        legacy = os.path.join(self.tmpdir, "users.json")
+        with open(legacy, 'w') as f:
+            json.dump({
+                "a@example.com": {
+                    "email": "a@example.com", "app_password": "pw", "openrouter_key": "k",
+                    "active": True, "interval_minutes": 10, "last_run": None
+                }
+            }, f)
+
+        self.assertEqual(migrate_from_json(self.store, legacy), 1)
+        self.assertFalse(os.path.exists(legacy))
+        self.assertTrue(os.path.exists(legacy + ".bak"))
+        self.assertEqual(self.store.get("a@example.com")["interval_minutes"], 10)
+        self.assertEqual(migrate_from_json(self.store, legacy), 0)
+
+if __name__ == '__main__':
+    unittest.main()